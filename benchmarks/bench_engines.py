@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark comparing the Moo Lisp execution engines.
+
+Runs the same recursive programs with each engine in
+moolisp.interpreter.engines and reports the best time out of a few runs.
+
+    python benchmarks/bench_engines.py
+"""
+
+import sys
+import time
+from os.path import dirname, join, abspath
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from moolisp.interpreter import interpret, default_env, engines  # noqa
+
+DEFINITIONS = """
+(begin
+    (define fib
+        (lambda (n)
+            (if (< n 2)
+                n
+                (+ (fib (- n 1)) (fib (- n 2))))))
+    (define fib-cond
+        (lambda (n)
+            (cond ((< n 2) n)
+                  (#t (+ (fib-cond (- n 1)) (fib-cond (- n 2)))))))
+    (define ack
+        (lambda (m n)
+            (cond ((= m 0) (+ n 1))
+                  ((= n 0) (ack (- m 1) 1))
+                  (#t (ack (- m 1) (ack m (- n 1)))))))
+    (define make-adder
+        (lambda (a) (lambda (b) (lambda (c) (lambda (d) (+ a (+ b (+ c d))))))))
+    (define sum-closures
+        (lambda (n acc)
+            (cond ((= n 0) acc)
+                  (#t (sum-closures (- n 1)
+                                    (+ acc ((((make-adder n) 1) 2) 3))))))))
+"""
+
+PROGRAMS = [
+    ("fib 18", "(fib 18)"),
+    ("fib-cond 18", "(fib-cond 18)"),
+    ("ackermann 3 4", "(ack 3 4)"),
+    ("closures 5000", "(sum-closures 5000 0)"),
+]
+
+def time_program(source, engine, repeat=3):
+    env = default_env()
+    interpret(DEFINITIONS, env, engine)
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        interpret(source, env, engine)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    sys.setrecursionlimit(100000)
+    names = sorted(engines)
+    print "%-16s" % "program" + "".join("%12s" % name for name in names)
+    for title, source in PROGRAMS:
+        timings = [time_program(source, name) for name in names]
+        print "%-16s" % title + "".join("%11.3fs" % t for t in timings)
+
+if __name__ == '__main__':
+    main()
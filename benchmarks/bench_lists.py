@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of list recursion with cons, car and cdr.
+
+Builds lists of increasing length with cons, then walks, maps and
+reverses them with car and cdr. With constant time list operations the
+time per element should stay roughly flat as the lists grow.
+
+    python benchmarks/bench_lists.py [size ...]
+"""
+
+import sys
+import time
+from os.path import dirname, join, abspath
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from moolisp.interpreter import interpret, default_env, engines  # noqa
+
+DEFINITIONS = """
+(begin
+    (define range
+        (lambda (n acc)
+            (if (= n 0) acc (range (- n 1) (cons n acc)))))
+    (define sum
+        (lambda (lst acc)
+            (if (nil? lst) acc (sum (cdr lst) (+ acc (car lst))))))
+    (define rev
+        (lambda (lst acc)
+            (if (nil? lst) acc (rev (cdr lst) (cons (car lst) acc)))))
+    (define map-rev
+        (lambda (f lst acc)
+            (if (nil? lst) acc (map-rev f (cdr lst) (cons (f (car lst)) acc))))))
+"""
+
+PROGRAM = "(sum (rev (map-rev (lambda (x) (* x 2)) (range %d '()) '()) '()) 0)"
+
+SIZES = [1000, 10000, 100000]
+
+def time_program(size, engine):
+    env = default_env()
+    interpret(DEFINITIONS, env, engine)
+    start = time.time()
+    result = interpret(PROGRAM % size, env, engine)
+    assert result == str(size * (size + 1)), result
+    return time.time() - start
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    names = sorted(engines)
+    print "%-10s" % "elements" + "".join("%20s" % name for name in names)
+    for size in sizes:
+        timings = [time_program(size, name) for name in names]
+        print "%-10d" % size + "".join("%9.3fs %6.2fus/el" % (t, t / size * 1e6)
+                                       for t in timings)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark for the Moo Lisp reader.
+
+Parses generated sources of doubling size and reports the time spent
+per kilobyte, both for many small definitions and for one large quoted
+table. With a linear reader the last column stays roughly flat as the
+input grows.
+
+    python benchmarks/bench_parser.py
+"""
+
+import sys
+import time
+from os.path import dirname, join, abspath
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from moolisp.parser import parse_multiple  # noqa
+
+FORM = """
+;; generated definition number %d
+(define fn-%d
+    (lambda (n acc)
+        (if (<= n 0)
+            '(done #t ,acc (nested (list (of (things)))))
+            (fn-%d (- n 1) (cons n acc)))))
+"""
+
+def generate_definitions(forms):
+    return "".join(FORM % (i, i, i) for i in range(forms))
+
+def generate_table(forms):
+    rows = " ".join("(row %d (#t %d) 'x)" % (i, i * 7) for i in range(forms * 5))
+    return "(define table '(%s))" % rows
+
+def time_parse(source, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        parse_multiple(source)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(sizes=(250, 500, 1000, 2000, 4000)):
+    for name, generate in [("definitions", generate_definitions),
+                           ("table", generate_table)]:
+        print name
+        print "%8s %10s %10s %12s" % ("size", "KB", "seconds", "ms per KB")
+        for size in sizes:
+            source = generate(size)
+            kb = len(source) / 1024.0
+            elapsed = time_parse(source)
+            print "%8d %10.1f %10.4f %12.3f" % (size, kb, elapsed, 1000 * elapsed / kb)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of interpreter startup, with and without the parse cache.
+
+Times default_env(), which loads core.moo, and interpret_file on a
+generated script, with the cache turned off, cold and warm.
+
+    python benchmarks/bench_startup.py
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+from os.path import dirname, join, abspath
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from moolisp.interpreter import interpret_file, default_env  # noqa
+from moolisp.env import get_builtin_env  # noqa
+
+def make_script(path, definitions=500):
+    "A script defining lots of functions, like a large library would"
+    with open(path, 'w') as script:
+        for i in range(definitions):
+            script.write("(define f%d (lambda (x y) (cond ((eq x 'a) (cons y '(1 2 3)))"
+                         " (#t (list x y %d)))))\n" % (i, i))
+        script.write("(f0 'a 0)\n")
+
+def best_time(fn, repeat=20):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    workdir = tempfile.mkdtemp()
+    try:
+        script = join(workdir, 'script.moo')
+        make_script(script)
+        tasks = [
+            ("default_env", default_env),
+            ("script", lambda: interpret_file(script, get_builtin_env())),
+        ]
+        print "%-14s%12s%12s%12s" % ("task", "no cache", "cold", "warm")
+        for title, task in tasks:
+            os.environ['MOOLISP_CACHE'] = ''
+            uncached = best_time(task)
+            os.environ['MOOLISP_CACHE'] = join(workdir, 'cache')
+            shutil.rmtree(join(workdir, 'cache'), ignore_errors=True)
+            cold = best_time(task, repeat=1)
+            warm = best_time(task)
+            print "%-14s%11.2fms%11.2fms%11.2fms" \
+                % (title, uncached * 1000, cold * 1000, warm * 1000)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main()
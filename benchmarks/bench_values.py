@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark for the cost of Moo Lisp values.
+
+Measures the throughput of an arithmetic-heavy loop with each engine,
+and the memory needed to hold a large parsed table of integers and
+booleans.
+
+    python benchmarks/bench_values.py
+"""
+
+import sys
+import time
+import resource
+from os.path import dirname, join, abspath
+
+sys.path.insert(0, abspath(join(dirname(__file__), '..')))
+
+from moolisp.interpreter import interpret, default_env, engines  # noqa
+from moolisp.parser import parse  # noqa
+
+LOOP = """
+(define sum-to
+    (lambda (n acc)
+        (cond ((= n 0) acc)
+              (#t (sum-to (- n 1) (+ acc (* (mod n 7) (- n 3))))))))
+"""
+
+def arithmetic_throughput(engine, n=20000):
+    "Arithmetic builtin calls per second in a tail-recursive loop"
+    env = default_env()
+    interpret(LOOP, env, engine)
+    start = time.time()
+    interpret("(sum-to %d 0)" % n, env, engine)
+    elapsed = time.time() - start
+    return 5 * n / elapsed  # =, -, +, *, mod, - per iteration, minus one
+
+def table_memory(rows=200000):
+    "Peak memory growth in KB from parsing a table of integers and booleans"
+    source = "'(%s)" % " ".join("(%d %d #t #f)" % (i, i * 3) for i in range(rows))
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    table = parse(source)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    del table
+    return after - before
+
+def main():
+    sys.setrecursionlimit(100000)
+    print "peak memory of a parsed 200k row table: %d KB" % table_memory()
+    for name in sorted(engines):
+        print "%-8s arithmetic calls per second: %10.0f" \
+            % (name, arithmetic_throughput(name))
+
+if __name__ == '__main__':
+    main()
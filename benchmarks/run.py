@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite for Moo Lisp, with results to compare between runs.
+
+Runs the Lisp programs in benchmarks/programs, parsing of a large
+generated source and startup of ./moo, and reports operations per second
+and peak memory for each. The last expression in a program is the
+operation being timed; everything before it is setup. Each benchmark runs
+in a fresh process, so the peak memory is its own.
+
+    python benchmarks/run.py [--engine=vm] [--output=results.json] [name ...]
+    python benchmarks/run.py --compare old.json new.json [--threshold=10]
+
+Comparing two result files lists the change in speed and memory for each
+benchmark, and exits with status 1 if any got slower, or grew, by more
+than the threshold percentage.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import subprocess
+from argparse import ArgumentParser, SUPPRESS
+from datetime import datetime
+from os.path import dirname, join, abspath, basename, splitext
+
+ROOT = abspath(join(dirname(__file__), '..'))
+PROGRAMS = join(ROOT, 'benchmarks', 'programs')
+
+sys.path.insert(0, ROOT)
+
+from moolisp.interpreter import interpret, default_env, engines  # noqa
+from moolisp.parser import parse_multiple, unparse  # noqa
+from bench_parser import generate_definitions  # noqa
+
+def programs():
+    return dict((splitext(basename(path))[0], path)
+                for path in glob.glob(join(PROGRAMS, '*.moo')))
+
+def benchmark_names():
+    return sorted(programs()) + ['parse', 'startup']
+
+def program_operation(name, engine):
+    "Run the setup of a program, and return its last expression as a thunk"
+    with open(programs()[name]) as program:
+        forms = parse_multiple(program.read())
+    env = default_env()
+    for form in forms[:-1]:
+        interpret(unparse(form), env, engine)
+    last = unparse(forms[-1])
+    return lambda: interpret(last, env, engine)
+
+def parse_operation(definitions=1000):
+    source = generate_definitions(definitions)
+    return lambda: parse_multiple(source)
+
+def startup_operation():
+    "Start ./moo on a trivial program, in a new process"
+    command = [sys.executable, join(ROOT, 'moo'), '-']
+
+    def start():
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        process.communicate("1")
+    return start
+
+def time_operation(operation, min_time):
+    "Time the operation at least three times, and for at least `min_time` seconds"
+    timings = []
+    started = time.time()
+    while len(timings) < 3 or time.time() - started < min_time:
+        start = time.time()
+        operation()
+        timings.append(time.time() - start)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    return {
+        'runs': len(timings),
+        'best': timings[0],
+        'median': median,
+        'ops_per_sec': 1.0 / median,
+    }
+
+def worker(name, engine, min_time):
+    "Run one benchmark in this process, and print its timings as JSON"
+    sys.setrecursionlimit(100000)
+    if name == 'parse':
+        operation = parse_operation()
+    elif name == 'startup':
+        operation = startup_operation()
+    else:
+        operation = program_operation(name, engine)
+    print json.dumps(time_operation(operation, min_time))
+
+def run_benchmark(name, engine, min_time):
+    "Run one benchmark in a worker process, and add its peak memory use"
+    process = subprocess.Popen(
+        [sys.executable, abspath(__file__), '--worker', name,
+         '--engine', engine, '--min-time', str(min_time)],
+        stdout=subprocess.PIPE)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = status
+    if status != 0:
+        raise RuntimeError("Benchmark '%s' failed" % name)
+    result = json.loads(output)
+    # in kilobytes on Linux, but bytes on OS X
+    result['peak_memory'] = usage.ru_maxrss
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(names, engine, min_time):
+    results = {
+        'engine': engine,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.now().isoformat(),
+        'benchmarks': {},
+    }
+    print "%-12s %12s %12s %8s %12s" % (
+        "benchmark", "ops/sec", "median", "runs", "peak memory")
+    for name in names:
+        result = results['benchmarks'][name] = run_benchmark(name, engine, min_time)
+        print "%-12s %12.2f %11.4fs %8d %12d" % (
+            name, result['ops_per_sec'], result['median'], result['runs'],
+            result['peak_memory'])
+    return results
+
+def change(old, new):
+    return 100.0 * (new - old) / old
+
+def compare(old, new, threshold):
+    "Print the changes from the `old` to the `new` results, and return the regressions"
+    if old['engine'] != new['engine']:
+        print "Warning: comparing %s engine to %s engine" % (old['engine'], new['engine'])
+    regressions = []
+    print "%-12s %12s %12s %9s %9s" % ("benchmark", "old ops/sec", "new ops/sec",
+                                       "speed", "memory")
+    for name in sorted(set(old['benchmarks']) & set(new['benchmarks'])):
+        before, after = old['benchmarks'][name], new['benchmarks'][name]
+        speed = change(before['ops_per_sec'], after['ops_per_sec'])
+        memory = change(before['peak_memory'], after['peak_memory'])
+        flags = []
+        if speed < -threshold:
+            flags.append("slower")
+        if memory > threshold:
+            flags.append("more memory")
+        if flags:
+            regressions.append(name)
+        print ("%-12s %12.2f %12.2f %+8.1f%% %+8.1f%%  %s" % (
+            name, before['ops_per_sec'], after['ops_per_sec'], speed, memory,
+            ", ".join(flags))).rstrip()
+    return regressions
+
+def main():
+    arguments = ArgumentParser(description="Run and compare Moo Lisp benchmarks")
+    arguments.add_argument('names', nargs='*', metavar='name',
+        help="benchmarks to run, out of: %s (default: all)"
+             % ", ".join(benchmark_names()))
+    arguments.add_argument('--engine', default='eval', choices=sorted(engines),
+        help="engine to run the programs with (default: eval)")
+    arguments.add_argument('--min-time', type=float, default=1.0, metavar='SECONDS',
+        help="time to spend running each benchmark (default: 1)")
+    arguments.add_argument('--output', metavar='FILE',
+        help="write the results as JSON to FILE")
+    arguments.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help="compare two result files instead of running benchmarks")
+    arguments.add_argument('--threshold', type=float, default=10.0, metavar='PERCENT',
+        help="change counted as a regression when comparing (default: 10)")
+    arguments.add_argument('--worker', help=SUPPRESS)
+    args = arguments.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.engine, args.min_time)
+    elif args.compare:
+        old, new = [json.load(open(filename)) for filename in args.compare]
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            print "Regressions beyond %g%%: %s" % (args.threshold, ", ".join(regressions))
+            sys.exit(1)
+    else:
+        unknown = set(args.names) - set(benchmark_names())
+        if unknown:
+            arguments.error("Unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+        results = run(args.names or benchmark_names(), args.engine, args.min_time)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
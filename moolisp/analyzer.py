@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+"""
+An alternative backend that separates syntactic analysis from execution.
+
+`analyze` turns an AST into a Python closure taking an environment.
+Special forms, variable references and calls are recognized once, when
+the closure is built, so running a program is just a matter of calling
+closures. This is the technique from section 4.1.7 of SICP.
+
+Lambda and let bodies run in array-backed Frames rather than dict based
+Environments. During analysis a chain of Scopes mirrors the frames, so
+each local variable reference is resolved to a (depth, index) pair, and
+every other variable is looked up directly in the global environment.
+Variables defined in a body are allocated a slot up front. A call binds
+the arguments in a frame over the lambda's own environment, so scoping
+is lexical, as with the evaluator (see doc.txt).
+
+Calls in tail position don't call the lambda body directly. They return
+a TailCall, which the nearest enclosing non-tail call (or `execute`)
+runs in a loop. Tail calls thus use constant Python stack space, just
+like with the evaluator.
+"""
+
+from errors import LispError, LispSyntaxError, LispTypeError
+from env import Environment, Frame, Scope, UNBOUND, GlobalCache, assign
+from env import global_cache_stats
+from types import Lambda, Builtin, Macro, named
+from types import TRUE, FALSE, boolean, is_atom, is_symbol, is_list
+from types import is_pair, to_list
+from parser import unparse
+from limits import enforced
+from evaluator import expansion_cache, _is_macro_call
+from evaluator import _assert_exp_length, _assert_valid_definition, _assert_boolean
+
+def execute(ast, env):
+    """Analyze an AST, then run it in the specified environment."""
+    return analyze(ast)(env)
+
+def analyze(ast, scope=None, tail=False):
+    """Turn an Abstract Syntax Tree into a closure taking an environment.
+
+    The closure must be run in a Frame laid out by `scope`, or in any
+    environment if the scope is None. If `tail` is set, the expression is
+    in tail position, and calls may return a TailCall rather than a value.
+    Syntax errors in special forms are raised when the closure is run,
+    not during analysis, just like with the tree-walking evaluator."""
+    try:
+        return _analyze(ast, scope, tail)
+    except LispError, e:
+        return _deferred_error(e)
+
+def _analyze(ast, scope, tail):
+    if is_symbol(ast): return analyze_variable(ast, scope)
+    elif is_atom(ast): return analyze_constant(ast)
+    elif is_list(ast):
+        if not ast:
+            raise LispSyntaxError("Call to empty list: ()")
+        elif is_symbol(ast[0]) and ast[0] in special_forms:
+            return special_forms[ast[0]](ast, scope, tail)
+        else:
+            return analyze_call(ast, scope, tail)
+    elif is_pair(ast):
+        return _analyze(to_list(ast), scope, tail)  # data evaluated as code
+    else:
+        raise LispSyntaxError(ast)
+
+class TailCall(object):
+    "A lambda body still to be run, returned from calls in tail position"
+    __slots__ = ('body', 'env')
+
+    def __init__(self, body, env):
+        self.body = body
+        self.env = env
+
+def _deferred_error(error):
+    def fail(env):
+        raise error
+    return fail
+
+def analyze_variable(name, scope):
+    address = scope.resolve(name) if scope is not None else None
+    if scope is None:
+        def variable(env):
+            return env[name]
+    elif address is None:
+        cache = GlobalCache(name)
+        changes = cache.changes
+
+        def variable(env):
+            if scope.shadowed:
+                return env[name]
+            globals_, version, value = cache.entry
+            if globals_ is env.globals and version == changes.version:
+                global_cache_stats.hits += 1
+                return value
+            return cache.lookup(env.globals)
+    elif address[0] == 0 and scope.is_param(address[1]):
+        index = address[1]
+
+        def variable(env):
+            return env.values[index]
+    else:
+        depth, index = address
+
+        def variable(env):
+            if scope.shadowed:
+                return env[name]
+            frame = env
+            for _ in xrange(depth):
+                frame = frame.outer
+            value = frame.values[index]
+            return env[name] if value is UNBOUND else value
+    return variable
+
+def analyze_constant(value):
+    def constant(env):
+        return value
+    return constant
+
+def analyze_call(ast, scope, tail):
+    fn_exp = analyze(ast[0], scope)
+    arg_exps = [analyze(exp, scope) for exp in ast[1:]]
+    nargs = len(arg_exps)
+    expansion = [None, None]  # the macro last called here, and its expansion
+
+    def call(env):
+        fn = fn_exp(env)
+        if enforced.limits is not None:
+            enforced.limits.step()
+        fn_type = type(fn)
+        if fn_type is Lambda:
+            if nargs != len(fn.params):
+                msg = "Wrong number of arguments, expected %d got %d: %s" \
+                    % (len(fn.params), nargs, unparse(ast))
+                raise LispTypeError(msg)
+            fn_scope, body = compiled_lambda(fn)
+            args = [exp(env) for exp in arg_exps]
+            if fn_scope.padding:
+                args.extend(fn_scope.padding)
+            frame = Frame(fn_scope, args, fn.env)
+            if tail:
+                return TailCall(body, frame)
+            result = body(frame)
+            while type(result) is TailCall:
+                result = result.body(result.env)
+            return result
+        elif fn_type is Builtin:
+            return fn.fn(*[exp(env) for exp in arg_exps])
+        elif fn_type is Macro:
+            # memoized per call site, see moolisp.evaluator.ExpansionCache
+            if expansion[0] is fn:
+                expansion_cache.hits += 1
+            else:
+                if expansion[0] is not None:
+                    expansion_cache.invalidations += 1
+                expansion_cache.misses += 1
+                expanded_form = expand_call(fn, ast, env)
+                expansion[:] = [fn, analyze(expanded_form, scope, tail)]
+            return expansion[1](env)
+        else:
+            raise LispTypeError("Call to: " + unparse(ast[0]))
+    return call
+
+def compiled_lambda(fn):
+    """The scope and analyzed body of a lambda.
+
+    Lambdas made by the tree-walking evaluator (e.g. from the core
+    library) are analyzed the first time they are called from here."""
+    if fn.compiled is None:
+        fn_scope = Scope(fn.params, _defined_variables(fn.body))
+        fn.compiled = fn_scope, analyze(fn.body, fn_scope, tail=True)
+    return fn.compiled
+
+def call_lambda(fn, args):
+    "Run a lambda on already evaluated arguments, returning its value"
+    fn_scope, body = compiled_lambda(fn)
+    result = body(Frame(fn_scope, args + fn_scope.padding, fn.env))
+    while type(result) is TailCall:
+        result = result.body(result.env)
+    return result
+
+def compiled_macro(macro):
+    "The analyzed body of a macro, analyzed on first use"
+    if macro.compiled is None:
+        macro.compiled = analyze(macro.body)
+    return macro.compiled
+
+def expand_once(form, env):
+    """expand macro form once, see moolisp.evaluator.expand_once"""
+    if is_pair(form):
+        form = to_list(form)
+    macro = analyze(form[0])(env)
+    return expand_call(macro, form, env)
+
+def expand_call(macro, form, env):
+    "expand a call to the given macro"
+    substitutions = Environment(zip(macro.params, form[1:]), env)
+    expansion = compiled_macro(macro)(substitutions)
+    return to_list(expansion) if is_pair(expansion) else expansion
+
+def _defined_variables(body):
+    """Find the variables a lambda or let body may define in its frame.
+
+    Forms with frames of their own are skipped. Anything else that looks
+    like a definition counts, since allocating a slot that is never used
+    does no harm: lookups skip slots that are still unbound."""
+    names = []
+    pending = [body]
+    while pending:
+        ast = pending.pop()
+        if not is_list(ast) or not ast:
+            continue
+        head = ast[0]
+        if head in ('quote', 'lambda', 'λ', 'macro'):
+            continue
+        elif head == 'define' and len(ast) == 3 and is_symbol(ast[1]):
+            if ast[1] not in names:
+                names.append(ast[1])
+        pending.extend(ast)
+    return names
+
+## Special forms
+
+def analyze_atom(ast, scope, tail):
+    arg = analyze(ast[1], scope)
+
+    def atom(env):
+        return boolean(is_atom(arg(env)))
+    return atom
+
+def analyze_eq(ast, scope, tail):
+    _assert_exp_length(ast, 3)
+    exp1, exp2 = analyze(ast[1], scope), analyze(ast[2], scope)
+
+    def eq(env):
+        v1, v2 = exp1(env), exp2(env)
+        return boolean(True) if v1 == v2 and is_atom(v1) else boolean(False)
+    return eq
+
+def analyze_macro(ast, scope, tail):
+    (_, params, body) = ast
+
+    def macro(env):
+        return Macro(params, body)
+    return macro
+
+def analyze_expand_1(ast, scope, tail):
+    form_exp = analyze(ast[1], scope)
+
+    def expand_1(env):
+        form = form_exp(env)
+        if _is_macro_call(form, env):
+            form = expand_once(form, env)
+        return form
+    return expand_1
+
+def analyze_expand(ast, scope, tail):
+    form_exp = analyze(ast[1], scope)
+
+    def expand(env):
+        form = form_exp(env)
+        while _is_macro_call(form, env):
+            form = expand_once(form, env)
+        return form
+    return expand
+
+def analyze_cond(ast, scope, tail):
+    clauses = [(analyze(predicate, scope), analyze(exp, scope, tail), predicate)
+               for predicate, exp in ast[1:]]
+
+    def cond(env):
+        for predicate, exp, source in clauses:
+            p = predicate(env)
+            if p is TRUE:
+                return exp(env)
+            elif p is not FALSE:
+                _assert_boolean(p, source)
+    return cond
+
+def analyze_let(ast, scope, tail):
+    _assert_exp_length(ast, 3)
+    for d in ast[1]:
+        _assert_valid_definition(d)
+    value_exps = [analyze(d[1], scope) for d in ast[1]]
+    let_scope = Scope([d[0] for d in ast[1]], _defined_variables(ast[2]), scope)
+    body = analyze(ast[2], let_scope, tail)
+
+    def let(env):
+        values = [exp(env) for exp in value_exps]
+        if let_scope.padding:
+            values.extend(let_scope.padding)
+        return body(Frame(let_scope, values, env))
+    return let
+
+def analyze_eval(ast, scope, tail):
+    _assert_exp_length(ast, 2)
+    exp = analyze(ast[1], scope)
+
+    def eval_(env):
+        if enforced.limits is not None:
+            enforced.limits.step()
+        return analyze(exp(env), tail=tail)(env)
+    return eval_
+
+def analyze_set(ast, scope, tail):
+    _assert_exp_length(ast, 3)
+    (_, var, exp) = ast
+    value_exp = analyze(exp, scope)
+    address = scope.resolve(var) if scope is not None else None
+
+    if address is not None and address[0] == 0 and scope.is_param(address[1]):
+        index = address[1]
+
+        def set_(env):
+            env.values[index] = value_exp(env)
+            return var
+    else:
+        def set_(env):
+            assign(env, var, value_exp(env))
+            return var
+    return set_
+
+def analyze_quote(ast, scope, tail):
+    _assert_exp_length(ast, 2)
+    return analyze_constant(ast[1])
+
+def analyze_quasiquote(ast, scope, tail):
+    _assert_exp_length(ast, 2)
+    return _analyze_template(ast[1], scope)
+
+def _analyze_template(template, scope):
+    if not isinstance(template, list):
+        return analyze_constant(template)
+    elif template and template[0] == "unquote":
+        _assert_exp_length(template, 2)
+        return analyze(template[1], scope)
+    else:
+        parts = [_analyze_template(exp, scope) for exp in template]
+
+        def build(env):
+            return [part(env) for part in parts]
+        return build
+
+def analyze_lambda(ast, scope, tail):
+    _assert_exp_length(ast, 3)
+    (_, params, body) = ast
+    fn_scope = Scope(params, _defined_variables(body), scope)
+    compiled = fn_scope, analyze(body, fn_scope, tail=True)
+
+    def lambda_(env):
+        fn = Lambda(params, body, env, 'analyze')
+        fn.compiled = compiled
+        return fn
+    return lambda_
+
+def analyze_begin(ast, scope, tail):
+    if len(ast[1:]) == 0:
+        raise LispSyntaxError("begin cannot be empty: %s" % unparse(ast))
+    init = [analyze(exp, scope) for exp in ast[1:-1]]
+    last = analyze(ast[-1], scope, tail)
+
+    def begin(env):
+        for exp in init:
+            exp(env)
+        return last(env)
+    return begin
+
+def analyze_define(ast, scope, tail):
+    _assert_valid_definition(ast[1:])
+    var, value_exp = ast[1], analyze(ast[2], scope)
+
+    if scope is not None and var in scope.index:
+        index = scope.index[var]
+
+        def define(env):
+            env.values[index] = named(value_exp(env), var)
+            return var
+    else:
+        def define(env):
+            env[var] = named(value_exp(env), var)
+            return var
+    return define
+
+special_forms = {
+    'atom': analyze_atom,
+    'eq': analyze_eq,
+    'macro': analyze_macro,
+    'expand': analyze_expand,
+    'expand-1': analyze_expand_1,
+    'cond': analyze_cond,
+    'let': analyze_let,
+    'eval': analyze_eval,
+    'set!': analyze_set,
+    'quote': analyze_quote,
+    'quasiquote': analyze_quasiquote,
+    'lambda': analyze_lambda,
+    'λ': analyze_lambda,
+    'begin': analyze_begin,
+    'define': analyze_define,
+}
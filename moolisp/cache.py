@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of parsed programs.
+
+The forms read from a file are pickled into a cache directory, keyed by
+a hash of the source and of the interpreter version. Running a file that
+has not changed since last time loads its forms from there, skipping the
+parser entirely.
+
+The cache lives in $MOOLISP_CACHE, by default moolisp/ under
+$XDG_CACHE_HOME or ~/.cache. Setting MOOLISP_CACHE to the empty string
+turns the cache off. The cache is only an optimization, so failing to
+read or write it is never an error.
+
+Loading an entry unpickles it, which could run any code an attacker put
+there. So the directory is made readable and writable by its owner only,
+and the cache isn't used at all if it belongs to another user, or if
+others may write to it.
+
+Entries are touched when loaded. Once the cache takes up more than
+`max_size` bytes, the least recently used entries are removed, see prune.
+"""
+
+import os
+import random
+import hashlib
+import tempfile
+import cPickle as pickle
+from os.path import join, exists, expanduser, splitext
+from stat import S_IWGRP, S_IWOTH
+
+import types
+import parser
+
+# Bump when the representation of forms changes in a way the hash of the
+# parser and types modules does not capture.
+FORMAT_VERSION = 1
+
+def _interpreter_version():
+    "Identifies the parser, and the types of the forms it produces"
+    digest = hashlib.sha1(str(FORMAT_VERSION))
+    for module in (parser, types):
+        with open(splitext(module.__file__)[0] + '.py', 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+interpreter_version = _interpreter_version()
+
+# Most bytes the entries may take up together
+max_size = 64 * 1024 * 1024
+
+# The size of the cache is checked after storing one entry in this many,
+# on average, so that storing stays cheap however many entries there are
+prune_interval = 100
+
+def cache_dir():
+    """The directory the cache is kept in, or None if it is turned off"""
+    path = os.environ.get('MOOLISP_CACHE')
+    if path is None:
+        base = os.environ.get('XDG_CACHE_HOME') or expanduser(join('~', '.cache'))
+        path = join(base, 'moolisp')
+    return path or None
+
+def cache_key(source, shared=False):
+    version = interpreter_version + (' shared' if shared else '')
+    return hashlib.sha1(version + '\0' + source).hexdigest()
+
+def parse_cached(source, shared=None):
+    """Parse the expressions of a program, using the cache if possible.
+
+    Like with parser.parse_multiple, syntax errors are raised as
+    LispSyntaxError. Programs that fail to parse are not cached.
+
+    Given parser.SharedData, the forms are read with it, and cached apart
+    from unshared ones. Pickles keep most of the sharing, but not that of
+    integers and tails of lists, so forms loaded are shared again."""
+    directory = cache_dir()
+    if directory is None or not _is_private(directory):
+        return parser.parse_multiple(source, shared)
+
+    path = join(directory, cache_key(source, shared is not None) + '.pickle')
+    forms = _load(path)
+    if forms is None:
+        forms = parser.parse_multiple(source, shared)
+        _store(directory, path, forms)
+    elif shared is not None:
+        forms = [shared.share_code(exp) for exp in forms]
+    return forms
+
+def prune(directory, size=None):
+    """Remove the least recently used entries, and any files left behind
+    by interrupted writes, until the cache takes up at most `size` bytes,
+    by default `max_size`"""
+    if size is None:
+        size = max_size
+    files = []
+    for name in os.listdir(directory):
+        path = join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # removed by another process in the meantime
+        files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(file_size for _, file_size, _ in files)
+    for _, file_size, path in sorted(files):
+        if total <= size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= file_size
+
+def _is_private(directory):
+    """Whether no one but the current user may have written to the cache
+    directory. A missing directory is made private when first stored to."""
+    try:
+        info = os.stat(directory)
+    except OSError:
+        return not exists(directory)
+    return info.st_uid == os.getuid() \
+        and not info.st_mode & (S_IWGRP | S_IWOTH)
+
+def _load(path):
+    try:
+        with open(path, 'rb') as cached:
+            forms = parser.intern_symbols(pickle.load(cached))
+    except Exception:
+        return None  # missing, unreadable or corrupt
+    try:
+        os.utime(path, None)  # recently used, see prune
+    except OSError:
+        pass
+    return forms
+
+def _store(directory, path, forms):
+    "Write the cache entry atomically, so readers never see partial entries"
+    try:
+        if not exists(directory):
+            os.makedirs(directory, 0700)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            pickle.dump(forms, temp, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, path)
+    except (IOError, OSError, RuntimeError, pickle.PicklingError):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return
+    if random.random() * prune_interval < 1:
+        try:
+            prune(directory)
+        except OSError:
+            pass
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client for the evaluation server in moolisp.server.
+
+Only needs the standard library, so running a script through a server
+doesn't pay for importing the interpreter.
+"""
+
+import json
+import socket
+import struct
+
+_length = struct.Struct('>I')
+
+def write_message(stream, message):
+    data = json.dumps(message)
+    stream.write(_length.pack(len(data)) + data)
+    stream.flush()
+
+def read_message(stream):
+    """Read a message from a file-like object, or None at end of file"""
+    header = stream.read(_length.size)
+    if not header:
+        return None
+    if len(header) < _length.size:
+        raise EOFError("Connection closed in the middle of a message")
+    size, = _length.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError("Connection closed in the middle of a message")
+    return json.loads(data)
+
+class Client(object):
+    "A connection to a server, for sending any number of requests"
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.stream = self.socket.makefile('rwb')
+
+    def evaluate(self, source, session=None):
+        """Run the source on the server, returning the response"""
+        request = {'source': source}
+        if session is not None:
+            request['session'] = session
+        write_message(self.stream, request)
+        response = read_message(self.stream)
+        if response is None:
+            raise EOFError("Connection closed by the server")
+        return response
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,17 +1,63 @@
 # -*- coding: utf-8 -*-
 
-from errors import LispNamingError
-from types import Builtin, boolean, integer, value_of
+from itertools import count
+from errors import LispNamingError, LispTypeError
+from types import Builtin, Pair, boolean, integer, value_of
+
+_versions = count(1)
+
+class NameVersion(object):
+    """The version of all variables of one name, changed whenever one is
+    defined or set in any existing environment, to a number never used
+    before. See GlobalCache."""
+    __slots__ = ('version',)
+
+    def __init__(self):
+        self.version = 0
+
+# The NameVersion of each name referenced by compiled code. Names missing
+# here are in no cache, so defining them changes no version.
+_name_versions = {}
+
+def name_version(name):
+    """The NameVersion of variables named `name`"""
+    return _name_versions.setdefault(name, NameVersion())
 
 class Environment(dict):
+    frozen = False
+
     def __init__(self, vars=None, outer=None):
         self.outer = outer
         if vars:
-            self.update(vars)
+            dict.update(self, vars)  # a new environment is in no cache yet
 
     def __getitem__(self, key):
         return self.defining_env(key).get(key)
 
+    def __setitem__(self, key, value):
+        if self.frozen:
+            raise LispNamingError("Can't define '%s' in a frozen environment" % key)
+        dict.__setitem__(self, key, value)
+        changed = _name_versions.get(key)
+        if changed is not None:
+            changed.version = next(_versions)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def freeze(self):
+        """Make the environment read-only, so it can be shared by forks"""
+        self.frozen = True
+        return self
+
+    def fork(self):
+        """A new, empty environment layered over this one.
+
+        Definitions in the fork are only visible there. If the environment
+        is frozen, variables assigned in the fork are copied into it."""
+        return Environment(outer=self)
+
     def defining_env(self, variable):
         "Find the innermost environment defining a variable"
         if variable in self:
@@ -21,12 +67,216 @@ class Environment(dict):
         else:
             raise LispNamingError("Variable '%s' is undefined" % variable)
 
+def assign(env, variable, value):
+    """Set an existing variable, in the innermost environment defining it.
+
+    Variables of a frozen environment are copied on write, into the
+    environment forked from it, leaving the frozen one untouched."""
+    target = env.defining_env(variable)
+    if target.frozen and target is not env:
+        while env.outer is not target:
+            env = env.outer
+        target = env
+    target[variable] = value
+
+class GlobalCache(object):
+    """Inline cache for one reference to a global variable, in compiled code
+
+    Keeps the value found last time, along with the global environment it
+    was found from and the version of its name then. While both are the
+    same, no variable of that name can have been defined or set since, and
+    the value is used without looking it up. Each version number is only
+    used once, so this holds with several threads too. The entry is
+    replaced as a whole, so threads sharing the code never see half an
+    entry.
+
+    The hot path is inlined where the references are run, leaving only
+    misses to `lookup`. Hits and misses are counted in `global_cache_stats`."""
+    __slots__ = ('name', 'entry', 'changes')
+
+    def __init__(self, name):
+        self.name = name
+        self.entry = (None, None, None)  # global environment, version, value
+        self.changes = name_version(name)
+
+    def lookup(self, env):
+        "Look up the variable from the global environment, and cache it"
+        version = self.changes.version
+        value = env[self.name]
+        global_cache_stats.misses += 1
+        if not isinstance(env, Environment):
+            return value  # a Frame, as made for code from eval, has no version
+        if self.entry[0] is not None:
+            global_cache_stats.invalidations += 1
+        self.entry = (env, version, value)
+        return value
+
+    def __repr__(self):
+        return self.name
+
+class GlobalCacheStats(object):
+    "Counts of inline cache hits and misses, for all global references"
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.hits = self.misses = self.invalidations = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def __str__(self):
+        return "%d hits, %d misses (%d invalidated), %.1f%% hit rate" \
+            % (self.hits, self.misses, self.invalidations, 100 * self.hit_rate())
+
+global_cache_stats = GlobalCacheStats()
+
+class Unbound(object):
+    "Marker for frame slots of variables that are not yet defined"
+
+    def __reduce__(self):
+        return 'UNBOUND'  # unpickle to the existing marker
+
+    def __repr__(self):
+        return "<unbound>"
+
+UNBOUND = Unbound()
+
+class Scope(object):
+    """Compile-time layout of a Frame: the names of its variables, by index
+
+    The parameters come first, followed by any variables the body defines.
+    Scopes are chained just like the frames they describe, so a variable
+    can be resolved to a (depth, index) pair ahead of time.
+
+    A scope is `shadowed` once a frame of it, or of a scope it is nested
+    in, has defined a variable by name that it did not allocate. Such a
+    variable may shadow one that was resolved ahead of time, so resolved
+    code in a shadowed scope falls back to lookups by name."""
+
+    def __init__(self, params, defines=(), outer=None):
+        self.names = list(params) + [d for d in defines if d not in params]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.nparams = len(params)
+        self.padding = [UNBOUND] * (len(self.names) - self.nparams)
+        self.outer = outer
+        self.inner = []  # the scopes nested in this one
+        self.shadowed = outer is not None and outer.shadowed
+        if outer is not None:
+            outer.inner.append(self)
+
+    def shadow(self):
+        """Mark this scope, and those nested in it, as shadowed"""
+        pending = [self]
+        while pending:
+            scope = pending.pop()
+            if not scope.shadowed:
+                scope.shadowed = True
+                pending.extend(scope.inner)
+
+    def resolve(self, variable):
+        """Find (depth, index) of a variable in this chain of scopes,
+        or None if it is not allocated in any of them"""
+        scope, depth = self, 0
+        while scope is not None:
+            if variable in scope.index:
+                return depth, scope.index[variable]
+            scope, depth = scope.outer, depth + 1
+        return None
+
+    def is_param(self, index):
+        return index < self.nparams
+
+class Frame(object):
+    """An environment with its variables stored by position
+
+    The layout is given by a Scope. Frames support the same lookups by
+    name as Environment, so code that was not resolved ahead of time (such
+    as forms built at runtime for eval) works the same in both. Frames of
+    statically nested scopes share a reference to the enclosing global
+    environment, where any variable not allocated in a scope lives.
+
+    Variables defined by name that the scope did not allocate are kept in
+    `extra`. Since such a variable may shadow one that was resolved ahead
+    of time, this marks the scope as shadowed (see Scope)."""
+
+    __slots__ = ('scope', 'values', 'outer', 'globals', 'extra')
+
+    frozen = False
+
+    def __init__(self, scope, values, outer):
+        self.scope = scope
+        self.values = values
+        self.outer = outer
+        self.globals = outer if scope.outer is None else outer.globals
+        self.extra = None
+
+    def __getitem__(self, key):
+        return self.defining_env(key).get(key)
+
+    def __setitem__(self, key, value):
+        index = self.scope.index.get(key)
+        if index is not None:
+            self.values[index] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+            self.scope.shadow()
+
+    def __contains__(self, key):
+        index = self.scope.index.get(key)
+        if index is not None:
+            return self.values[index] is not UNBOUND
+        return self.extra is not None and key in self.extra
+
+    def get(self, key, default=None):
+        "Look up a variable in this frame only"
+        if key not in self:
+            return default
+        index = self.scope.index.get(key)
+        return self.extra[key] if index is None else self.values[index]
+
+    def defining_env(self, variable):
+        "Find the innermost environment defining a variable"
+        if variable in self:
+            return self
+        return self.outer.defining_env(variable)
+
+## List builtins
+#
+# Lists are chains of Pairs, so cons, car and cdr take constant time.
+# Python lists, like the ones built by quasiquote, are accepted as well.
+# Note that cdr returns the symbol nil, not (), at the end of a list.
+
+def _cons(head, rest):
+    if rest == 'nil':
+        rest = []
+    elif not isinstance(rest, (Pair, list)):
+        raise LispTypeError("Can't cons onto non-list: %s" % rest)
+    return Pair(head, rest)
+
+def _car(lst):
+    return lst.car if isinstance(lst, Pair) else lst[0]
+
+def _cdr(lst):
+    rest = lst.cdr if isinstance(lst, Pair) else lst[1:]
+    return rest if rest else 'nil'
+
+def _list(*args):
+    rest = []
+    for x in reversed(args):
+        rest = Pair(x, rest)
+    return rest if args else 'nil'
+
 def get_builtin_env():
     """Returns an environment with the builtin functions defined.
 
     You probably want to use moolisp.interpreter.default_env instead,
     which is this extended with the Moo Lisp core functions."""
-    return Environment({
+    env = Environment({
         '+': Builtin(lambda x, y: integer(value_of(x) + value_of(y))),
         '-': Builtin(lambda x, y: integer(value_of(x) - value_of(y))),
         '*': Builtin(lambda x, y: integer(value_of(x) * value_of(y))),
@@ -39,8 +289,11 @@ def get_builtin_env():
         '>=': Builtin(lambda x, y: boolean(x >= y)), 
         '<=': Builtin(lambda x, y: boolean(x <= y)),
 
-        'cons': Builtin(lambda h, rest: [h] + rest),
-        'car': Builtin(lambda lst: lst[0]),
-        'cdr': Builtin(lambda lst: 'nil' if len(lst) == 1 else lst[1:]),
-        'list': Builtin(lambda *args: 'nil' if len(args) == 0 else list(args))
+        'cons': Builtin(_cons),
+        'car': Builtin(_car),
+        'cdr': Builtin(_cdr),
+        'list': Builtin(_list)
     })
+    for name, fn in env.iteritems():
+        fn.name = name
+    return env
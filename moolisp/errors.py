@@ -8,3 +8,7 @@ class LispNamingError(LookupError, LispError):
     pass
 class LispTypeError(TypeError, LispError): 
     pass
+class LispRecursionError(RuntimeError, LispError):
+    pass
+class LispLimitError(LispError):
+    pass
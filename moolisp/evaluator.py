@@ -1,55 +1,109 @@
 # -*- coding: utf-8 -*-
 
-from errors import LispSyntaxError, LispTypeError
-from env import Environment
-from types import Lambda, Macro
-from types import value_of, boolean, is_boolean, is_atom, is_symbol, is_list
+from errors import LispSyntaxError, LispTypeError, LispNamingError
+from env import Environment, assign
+from types import Lambda, Macro, named
+from types import TRUE, FALSE, boolean, is_boolean, is_atom, is_symbol, is_list
+from types import is_pair, to_list
 from types import is_macro, is_lambda, is_builtin
 from parser import unparse
+from limits import enforced
 
-def evaluate(ast, env):
-    """Evaluate an Abstract Syntax Tree in the specified environment."""
-    if is_symbol(ast): return env[ast]
-    elif is_atom(ast): return ast
-    elif is_list(ast):
-        if ast[0] == 'atom': return eval_atom(ast, env)
-        elif ast[0] == 'eq': return eval_eq(ast, env)
-        elif ast[0] == 'macro': return eval_macro(ast, env)
-        elif ast[0] == 'expand': return eval_expand(ast, env)
-        elif ast[0] == 'expand-1': return eval_expand_1(ast, env)
-        elif ast[0] == 'cond': return eval_cond(ast, env)
-        elif ast[0] == 'let': return eval_let(ast, env)
-        elif ast[0] == 'eval': return eval_eval(ast, env)
-        elif ast[0] == 'set!': return eval_set(ast, env)
-        elif ast[0] == 'quote': return eval_quote(ast, env)
-        elif ast[0] == 'quasiquote': return eval_quasiquote(ast, env)
-        elif ast[0] in ('lambda', 'λ'): return eval_lambda(ast, env)
-        elif ast[0] == 'begin': return eval_begin(ast, env)
-        elif ast[0] == 'define': return eval_define(ast, env)
-        else: 
-            fn = evaluate(ast[0], env)
-            if is_macro(fn): 
-                return apply_macro(ast, env)
-            elif is_lambda(fn): 
-                return apply_lambda(ast, env)
-            elif is_builtin(fn): 
-                return apply_builtin(ast, env)
-            else: 
-                raise LispTypeError("Call to: " + unparse(ast[0]))
-    else:
-        raise LispSyntaxError(ast)
+# The active moolisp.profiler.Profiler, if any. Set with profiler.enable.
+profiler = None
+
+def evaluate(ast, env, profiled=None):
+    """Evaluate an Abstract Syntax Tree in the specified environment.
+
+    Expressions in tail position are not evaluated recursively. The forms
+    that have one (cond, let, eval, begin and calls to macros or lambdas)
+    return the next (ast, env) pair instead, and the loop below carries on
+    with it. Tail calls therefore run in constant Python stack space.
+
+    The lambda currently being run by this loop, if any, and the call to
+    it, are kept in the locals `running` and `running_site`. They are
+    only read by moolisp.sampler, from the Python stack.
+
+    While profiling, `profiled` is the number of calls the profiler had
+    running when this evaluation started, see _evaluate_profiled."""
+    if profiler is not None and profiled is None:
+        return _evaluate_profiled(ast, env)
+    while True:
+        if is_symbol(ast): return env[ast]
+        elif is_atom(ast): return ast
+        elif is_list(ast):
+            if not is_symbol(ast[0]) or ast[0] not in special_forms:
+                fn = evaluate(ast[0], env)
+                if enforced.limits is not None: enforced.limits.step()
+                if is_macro(fn): 
+                    ast, env = apply_macro(fn, ast, env)
+                elif is_lambda(fn): 
+                    site = ast
+                    ast, env = apply_lambda(fn, site, env, profiled)
+                    running, running_site = fn, site  # see moolisp.sampler
+                elif is_builtin(fn): 
+                    return apply_builtin(fn, ast, env)
+                else: 
+                    raise LispTypeError("Call to: " + unparse(ast[0]))
+            elif ast[0] == 'atom': return eval_atom(ast, env)
+            elif ast[0] == 'eq': return eval_eq(ast, env)
+            elif ast[0] == 'macro': return eval_macro(ast, env)
+            elif ast[0] == 'expand': return eval_expand(ast, env)
+            elif ast[0] == 'expand-1': return eval_expand_1(ast, env)
+            elif ast[0] == 'cond':
+                ast, env = eval_cond(ast, env)
+                if ast is None: return None  # no clause matched
+            elif ast[0] == 'let': ast, env = eval_let(ast, env)
+            elif ast[0] == 'eval':
+                if enforced.limits is not None: enforced.limits.step()
+                ast, env = eval_eval(ast, env)
+            elif ast[0] == 'set!': return eval_set(ast, env)
+            elif ast[0] == 'quote': return eval_quote(ast, env)
+            elif ast[0] == 'quasiquote': return eval_quasiquote(ast, env)
+            elif ast[0] in ('lambda', 'λ'): return eval_lambda(ast, env)
+            elif ast[0] == 'begin': ast, env = eval_begin(ast, env)
+            else: return eval_define(ast, env)
+        elif is_pair(ast):
+            ast = to_list(ast)  # data evaluated as code
+        else:
+            raise LispSyntaxError(ast)
+
+def _evaluate_profiled(ast, env):
+    """Evaluate while profiling. The lambda calls run by the loop in
+    evaluate end when it returns, so the profiler is told here."""
+    running = len(profiler.calls)
+    try:
+        return evaluate(ast, env, running)
+    finally:
+        while len(profiler.calls) > running:
+            profiler.exit()
+
+# Checked before the special forms above, so calls skip their comparisons
+special_forms = frozenset(['atom', 'eq', 'macro', 'expand', 'expand-1', 'cond',
+                           'let', 'eval', 'set!', 'quote', 'quasiquote', 'lambda',
+                           'λ', 'begin', 'define'])
 
 def eval_eq(ast, env):
     _assert_exp_length(ast, 3)
     v1, v2 = evaluate(ast[1], env), evaluate(ast[2], env)
     return boolean(True) if v1 == v2 and is_atom(v1) else boolean(False)
 
-def apply_macro(ast, env):
-    expanded_form = expand_once(ast, env)
-    return evaluate(expanded_form, env)
+def apply_macro(macro, ast, env):
+    "Expand the macro call, returning the expansion to be evaluated next"
+    if profiler is not None:
+        return profiler.call(macro, _expand_cached, macro, ast, env), env
+    return _expand_cached(macro, ast, env), env
+
+def _expand_cached(macro, ast, env):
+    expanded_form = expansion_cache.lookup(ast, macro)
+    if expanded_form is None:
+        expanded_form = expand_call(macro, ast, env)
+        expansion_cache.store(ast, macro, expanded_form)
+    return expanded_form
 
-def apply_lambda(ast, env):
-    fn = evaluate(ast[0], env)
+def apply_lambda(fn, ast, env, profiled=None):
+    """Bind the arguments, returning the function body to be evaluated next.
+    While profiling, `profiled` is as given to evaluate."""
     args = ast[1:]
 
     if len(args) != len(fn.params):
@@ -58,11 +112,23 @@ def apply_lambda(ast, env):
         raise LispTypeError(msg)
     
     args = [evaluate(exp, env) for exp in ast[1:]]
-    return evaluate(fn.body, Environment(zip(fn.params, args), env))
+    if profiled is not None:
+        profiler.tail_call(fn, profiled)
+    return fn.body, Environment(zip(fn.params, args), fn.env)
 
-def apply_builtin(ast, env):
-    fn = evaluate(ast[0], env)
+def call_lambda(fn, args):
+    "Run a lambda on already evaluated arguments, returning its value"
+    if profiler is not None:
+        return profiler.call(fn, _run_lambda, fn, args)
+    return _run_lambda(fn, args)
+
+def _run_lambda(fn, args):
+    return evaluate(fn.body, Environment(zip(fn.params, args), fn.env))
+
+def apply_builtin(fn, ast, env):
     args = [evaluate(exp, env) for exp in ast[1:]]
+    if profiler is not None:
+        return profiler.call(fn, fn.fn, *args)
     return fn.fn(*args)
 
 def eval_macro(ast, env):
@@ -75,17 +141,74 @@ def expand_once(form, env):
     Assumes first element of form is a macro or macro call.
     Evaluates this element in case it is a reference"""
 
+    if is_pair(form):
+        form = to_list(form)
+
     # might be call to named macro in the environment
     macro = evaluate(form[0], env) 
-    
-    # expand
+    return expand_call(macro, form, env)
+
+def expand_call(macro, form, env):
+    "expand a call to the given macro"
     substitutions = Environment(zip(macro.params, form[1:]), env)
-    return evaluate(macro.body, substitutions)
+    expansion = evaluate(macro.body, substitutions)
+    return to_list(expansion) if is_pair(expansion) else expansion
+
+class ExpansionCache(object):
+    """Macro expansions memoized per call site
+
+    Entries are keyed by the identity of the call form, and are only used
+    while the call still refers to the same macro. Redefining a macro with
+    define or set! binds a new Macro object, which invalidates the entries
+    of the old one. Expansions are assumed to depend only on the macro and
+    the forms passed to it, not on other variables in the environment."""
+
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        self.entries = {}
+        self.hits = self.misses = self.invalidations = 0
+
+    def lookup(self, form, macro):
+        "The cached expansion of the call, or None"
+        entry = self.entries.get(id(form))
+        if entry is not None and entry[0] is form:
+            if entry[1] is macro:
+                self.hits += 1
+                return entry[2]
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def store(self, form, macro, expansion):
+        # the entry keeps the form alive, so its id can't be reused
+        if len(self.entries) >= self.max_size:
+            self.entries.clear()
+        self.entries[id(form)] = (form, macro, expansion)
+
+    def __str__(self):
+        return "%d hits, %d misses (%d invalidated), %d cached" \
+            % (self.hits, self.misses, self.invalidations, len(self.entries))
+
+expansion_cache = ExpansionCache()
 
 def _is_macro_call(ast, env):
-    first = ast[0]
-    return is_macro(first) \
-        or is_macro(env.get(first, False))
+    if is_pair(ast):
+        first = ast.car
+    elif is_list(ast) and ast:
+        first = ast[0]
+    else:
+        return False
+    if is_macro(first):
+        return True
+    elif not is_symbol(first):
+        return False
+    try:
+        return is_macro(env[first])
+    except LispNamingError:
+        return False
 
 def eval_expand_1(ast, env):
     form = evaluate(ast[1], env)
@@ -100,11 +223,14 @@ def eval_expand(ast, env):
     return form
 
 def eval_cond(ast, env):
+    "Select the expression to evaluate next, or None if no clause matches"
     for predicate, ast in ast[1:]:
         p = evaluate(predicate, env)
-        _assert_boolean(p, predicate)
-        if value_of(p) is True:
-            return evaluate(ast, env)
+        if p is TRUE:
+            return ast, env
+        elif p is not FALSE:
+            _assert_boolean(p, predicate)
+    return None, env
 
 def eval_atom(ast, env):
     arg = evaluate(ast[1], env)
@@ -113,23 +239,24 @@ def eval_atom(ast, env):
 def eval_eval(ast, env):
     _assert_exp_length(ast, 2)
     (_, exp) = ast
-    return evaluate(evaluate(exp, env), env)
+    return evaluate(exp, env), env
 
 def eval_define(ast, env):
     _assert_valid_definition(ast[1:])
-    env[ast[1]] = evaluate(ast[2], env)
+    env[ast[1]] = named(evaluate(ast[2], env), ast[1])
     return ast[1]
 
-def eval_lambda(ast, env):
+def eval_lambda(ast, env, engine='eval'):
     _assert_exp_length(ast, 3)
     (_, params, body) = ast
-    return Lambda(params, body, env)
+    return Lambda(params, body, env, engine)
 
 def eval_begin(ast, env):
     if len(ast[1:]) == 0:
         raise LispSyntaxError("begin cannot be empty: %s" % unparse(ast))
-    results = [evaluate(exp, env) for exp in ast[1:]]
-    return results[-1]
+    for exp in ast[1:-1]:
+        evaluate(exp, env)
+    return ast[-1], env
 
 def eval_quasiquote(ast, env):
     def qq(ast, env):
@@ -151,7 +278,7 @@ def eval_quote(ast, env):
 def eval_set(ast, env):
     _assert_exp_length(ast, 3)
     (_, var, exp) = ast
-    env.defining_env(var)[var] = evaluate(exp, env)
+    assign(env, var, evaluate(exp, env))
     return var
 
 def eval_let(ast, env):
@@ -159,7 +286,7 @@ def eval_let(ast, env):
     for d in ast[1]:
         _assert_valid_definition(d)
     defs = [(d[0], evaluate(d[1], env)) for d in ast[1]]
-    return evaluate(ast[2], Environment(defs, env))
+    return ast[2], Environment(defs, env)
 
 ## Syntax assertions
 
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ahead-of-time macro expansion.
+
+`expand_all` walks a program once and replaces every macro call it can
+resolve with its full expansion, so the result can be evaluated without
+any macro machinery. A call is expanded if its operator is a variable
+bound to a macro in the environment, and that binding cannot change
+before the call runs: it must not be shadowed by a lambda or let
+variable, nor defined or set! anywhere in the statement being expanded.
+Anything else is left to be expanded lazily during evaluation.
+
+Statements are expanded one at a time, right before they run. The
+bodies of lambdas and macros run later, possibly after the statements
+that follow have redefined a macro. So calls in them are only expanded
+when all the statements of the program are known up front, and none of
+them defines or set!s the operator. Otherwise they are left to the
+expansion cache, as the body runs.
+
+Like the expansion cache, this assumes macro expansions depend only on
+the macro and the forms passed to it. Note that calls are expanded even
+in branches that never run, so a macro that only terminates for values
+seen at runtime may not terminate here.
+"""
+
+from errors import LispError
+from types import is_macro, is_symbol, is_list
+from evaluator import expand_call
+
+def expand_all(ast, env, program=None):
+    """Expand all statically resolvable macro calls in an AST.
+
+    If the whole program is known, `program` holds the variables it may
+    assign, see moolisp.optimizer.program_variables. Otherwise, nothing
+    in the bodies of lambdas and macros is expanded. Returns the expanded
+    AST, leaving the original untouched."""
+    later = None if program is None else program.union(_assigned_variables(ast))
+    return _expand(ast, env, frozenset(), _Unstable(_assigned_variables(ast), later))
+
+def _expand(ast, env, bound, unstable):
+    if not is_list(ast) or not ast:
+        return ast
+
+    head = ast[0]
+    if is_symbol(head) and head in special_forms:
+        return special_forms[head](ast, env, bound, unstable)
+
+    macro = _static_macro(head, env, bound, unstable)
+    if macro is not None:
+        try:
+            expanded_form = expand_call(macro, ast, env)
+        except LispError:
+            pass  # left for evaluation, which fails only if the call is reached
+        else:
+            return _expand(expanded_form, env, bound, unstable)
+    return [_expand(exp, env, bound, unstable) for exp in ast]
+
+def _static_macro(head, env, bound, unstable):
+    "The macro a call operator refers to, if it can be known ahead of time"
+    if is_macro(head):
+        return head
+    elif not is_symbol(head) or head in bound or head in unstable:
+        return None
+    try:
+        value = env[head]
+    except LispError:
+        return None
+    return value if is_macro(value) else None
+
+def _assigned_variables(ast):
+    "All variables that are defined or set! anywhere in an AST"
+    names = set()
+    pending = [ast]
+    while pending:
+        ast = pending.pop()
+        if not is_list(ast) or not ast:
+            continue
+        elif ast[0] in ('define', 'set!') and len(ast) > 1 and is_symbol(ast[1]):
+            names.add(ast[1])
+        pending.extend(ast)
+    return names
+
+class _Unstable(object):
+    """The variables that may have another value when code runs: `now`
+    for the statement being prepared, and `later` for the bodies of its
+    lambdas and macros, where None means any variable at all."""
+
+    def __init__(self, now, later):
+        self.now = now
+        self.later = later
+
+    def __contains__(self, name):
+        return self.now is None or name in self.now
+
+    def deferred(self):
+        """The unstable variables for code run later"""
+        return _Unstable(self.later, self.later)
+
+## Special forms
+
+def _expand_arguments(ast, env, bound, unstable):
+    return [ast[0]] + [_expand(exp, env, bound, unstable) for exp in ast[1:]]
+
+def _expand_quote(ast, env, bound, unstable):
+    return ast
+
+def _expand_quasiquote(ast, env, bound, unstable):
+    def template(ast):
+        if not is_list(ast) or not ast:
+            return ast
+        elif ast[0] == 'unquote' and len(ast) == 2:
+            return ['unquote', _expand(ast[1], env, bound, unstable)]
+        else:
+            return [template(exp) for exp in ast]
+    return template(ast)
+
+def _expand_lambda(ast, env, bound, unstable):
+    if len(ast) != 3 or not is_list(ast[1]) or not all(map(is_symbol, ast[1])):
+        return ast  # malformed, reported when evaluated
+    (head, params, body) = ast
+    return [head, params, _expand(body, env, bound.union(params), unstable.deferred())]
+
+def _expand_let(ast, env, bound, unstable):
+    if len(ast) != 3 or not all(is_list(d) and len(d) == 2 for d in ast[1]):
+        return ast  # malformed, reported when evaluated
+    defs = [[name, _expand(exp, env, bound, unstable)] for name, exp in ast[1]]
+    inner = bound.union(name for name, _ in ast[1] if is_symbol(name))
+    return ['let', defs, _expand(ast[2], env, inner, unstable)]
+
+def _expand_cond(ast, env, bound, unstable):
+    if not all(is_list(clause) and len(clause) == 2 for clause in ast[1:]):
+        return ast  # malformed, reported when evaluated
+    clauses = [[_expand(predicate, env, bound, unstable),
+                _expand(exp, env, bound, unstable)] for predicate, exp in ast[1:]]
+    return ['cond'] + clauses
+
+def _expand_definition(ast, env, bound, unstable):
+    return ast[:2] + [_expand(exp, env, bound, unstable) for exp in ast[2:]]
+
+special_forms = {
+    'atom': _expand_arguments,
+    'eq': _expand_arguments,
+    'macro': _expand_lambda,
+    'expand': _expand_arguments,
+    'expand-1': _expand_arguments,
+    'cond': _expand_cond,
+    'let': _expand_let,
+    'eval': _expand_arguments,
+    'set!': _expand_definition,
+    'quote': _expand_quote,
+    'quasiquote': _expand_quasiquote,
+    'lambda': _expand_lambda,
+    'λ': _expand_lambda,
+    'begin': _expand_arguments,
+    'define': _expand_definition,
+}
@@ -1,43 +1,178 @@
 # -*- coding: utf-8 -*-
 
 from os.path import dirname, join
+from StringIO import StringIO
 
 from evaluator import evaluate
-from parser import parse, unparse, parse_multiple
+from analyzer import execute
+import vm
+import iterative
+import memo
+import parallel
+from expander import expand_all
+from optimizer import optimize as optimize_ast, program_variables
+from parser import parse, unparse, write, read_all, tokenize_stream, SharedData
 from env import get_builtin_env
+from cache import parse_cached
+from errors import LispSyntaxError
+from limits import enforcing
 
-def interpret(source, env=None):
+# The available backends for running an AST in an environment:
+#   eval       -- the tree-walking evaluator in moolisp.evaluator
+#   analyze    -- analysis into closures first, see moolisp.analyzer
+#   vm         -- compilation to bytecode for a stack machine, see moolisp.vm
+#   iterative  -- evaluation without Python recursion, see moolisp.iterative
+engines = {
+    'eval': evaluate,
+    'analyze': execute,
+    'vm': vm.execute,
+    'iterative': iterative.execute,
+}
+
+def interpret(source, env=None, engine='eval', expand=False, limits=None,
+              optimize=False):
     """
     Interpret a moo lisp program statement
 
     Accepts a moo program statement as a string, interprets it, and then
-    returns the resulting moo lisp expression as string.
+    returns the resulting moo lisp expression as string. If `expand` is
+    set, macros are expanded ahead of time (see moolisp.expander). If
+    `optimize` is set, constant expressions are then folded (see
+    moolisp.optimizer). If `limits` are given, the statement is stopped
+    with a LispLimitError when it exceeds them (see moolisp.limits).
     """
+    run = get_engine(engine)
     if env is None:
         env = default_env()
 
-    return unparse(evaluate(parse(source), env))
+    ast = parse(source)
+    with enforcing(limits):
+        return unparse(run(_prepare(ast, env, expand, optimize), env))
 
-def interpret_file(filename, env=None):
+def interpret_file(filename, env=None, engine='eval', expand=False, limits=None,
+                   optimize=False, output=None, hash_cons=False):
     """
     Interpret a moo lisp file
 
     Accepts a file name of a moo lisp files containing a series
     of moo lisp statements. Returns the value of the last expression
     of the file.
+
+    The parsed statements are cached on disk (see moolisp.cache), so
+    running an unchanged file again skips the parser. Files larger than
+    `max_cached_size` bytes are streamed instead, like by interpret_stream.
+    The `limits` apply to all the statements together. If `output` is
+    given, the result is written to it instead, and `hash_cons` shares
+    identical data, see interpret_stream. Since all the statements are
+    read before any is run, `expand` and `optimize` work on lambda bodies
+    too, unlike in a stream.
+    """
+    with open(filename, 'r') as sourcefile:
+        source = sourcefile.read(max_cached_size + 1)
+        if len(source) > max_cached_size:
+            sourcefile.seek(0)
+            return interpret_stream(sourcefile, env, engine, expand, limits, optimize,
+                                    output, hash_cons)
+
+    try:
+        forms = parse_cached(source, SharedData() if hash_cons else None)
+    except LispSyntaxError:
+        # run the statements before the error, just like when streaming
+        return interpret_stream(StringIO(source), env, engine, expand, limits,
+                                optimize, output, hash_cons)
+    return _interpret_all(forms, env, engine, expand, limits, optimize, output,
+                          whole_program=True)
+
+max_cached_size = 1024 * 1024
+
+def interpret_stream(stream, env=None, engine='eval', expand=False, limits=None,
+                     optimize=False, output=None, hash_cons=False):
     """
+    Interpret moo lisp statements from a file-like object
+
+    The statements are read, evaluated and discarded one at a time, so
+    memory use depends on the largest statement rather than the size of
+    the whole input. Works with pipes and stdin as well as regular files.
+    Returns the value of the last expression, or an empty string if the
+    stream contained none.
+
+    If `expand` is set, each statement is macro expanded ahead of time,
+    right before it is evaluated. Macros defined by earlier statements
+    are thus expanded too. Likewise with `optimize`. Both leave the bodies
+    of lambdas alone, as the statements to come are not known yet (see
+    moolisp.expander and moolisp.optimizer). The `limits` apply to all
+    the statements together.
+
+    If `output` is given, the value of the last expression is written to
+    that file-like object as it is unparsed, and None is returned. Huge
+    results are then never held in memory as text (see parser.write).
+
+    If `hash_cons` is set, identical quoted data and integers in all the
+    statements are shared, which saves memory on data-heavy programs
+    (see parser.SharedData).
+    """
+    forms = read_all(tokenize_stream(stream), SharedData() if hash_cons else None)
+    return _interpret_all(forms, env, engine, expand, limits, optimize, output)
+
+def _interpret_all(forms, env, engine, expand, limits, optimize, output,
+                   whole_program=False):
+    """Run the statements in `forms`. If `whole_program` is set, they are
+    a list of all the statements of the program, and the ahead of time
+    passes may look at all of them first."""
+    run = get_engine(engine)
     if env is None:
         env = default_env()
 
-    with open(filename, 'r') as sourcefile:
-        source = "".join(sourcefile.readlines())
+    result = None
+    with enforcing(limits):
+        program = None
+        if whole_program and (expand or optimize):
+            # may expand macros, so it counts against the limits too
+            program = program_variables(forms, env)
+        for ast in forms:
+            result = run(_prepare(ast, env, expand, optimize, program), env)
+    if output is not None:
+        if result is not None:
+            write(result, output)
+        return None
+    return "" if result is None else unparse(result)
+
+def _prepare(ast, env, expand, optimize, program=None):
+    """The AST to run, after the ahead of time passes asked for. `program`
+    is what is known of the whole program, if anything."""
+    if expand:
+        ast = expand_all(ast, env, program)
+    if optimize:
+        ast = optimize_ast(ast, env, program)
+    return ast
 
-    asts = parse_multiple(source)
-    results = [evaluate(ast, env) for ast in asts]
-    return unparse(results[-1])
+def get_engine(name):
+    """Look up the function running ASTs for the named engine"""
+    if name not in engines:
+        raise ValueError("Unknown engine '%s', expected one of: %s"
+            % (name, ", ".join(sorted(engines))))
+    return engines[name]
 
 def default_env():
-    """Returns the base moo lisp environment"""
-    env = get_builtin_env()
-    interpret_file(join(dirname(__file__), '..', 'core.moo'), env)
-    return env
+    """Returns a new base moo lisp environment
+
+    The environment is a fork of the prelude, so creating one is cheap,
+    and definitions made in it are not visible in any other."""
+    return prelude().fork()
+
+_prelude = None
+
+def prelude():
+    """The builtins, including memoize and pmap (see moolisp.memo and
+    moolisp.parallel), and the Moo Lisp core library, in a frozen environment
+
+    Built the first time it is needed, and then shared by every
+    environment from default_env for the rest of the process."""
+    global _prelude
+    if _prelude is None:
+        env = get_builtin_env()
+        env.update(memo.builtins)
+        env.update(parallel.builtins)
+        interpret_file(join(dirname(__file__), '..', 'core.moo'), env)
+        _prelude = env.freeze()
+    return _prelude
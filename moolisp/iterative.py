@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""
+A tree-walking evaluator that does not recurse in Python.
+
+moolisp.evaluator evaluates nested forms, such as the arguments of a
+call, by calling itself. Deep non-tail recursion in a Lisp program thus
+runs out of Python stack. This engine does the same work in a loop, and
+keeps what is left to do after each nested form as a frame on a list of
+its own, the continuation stack. Recursion is then limited by memory,
+and by `max_depth`: the number of frames allowed on the stack at once,
+beyond which a LispRecursionError is raised.
+
+Each special form behaves just like in moolisp.evaluator, whose syntax
+checks are reused. Macro bodies are run in a loop of their own, so only
+macros expanding to calls of other macros use the Python stack.
+"""
+
+from errors import LispRecursionError, LispSyntaxError, LispTypeError
+from env import Environment, assign
+from types import TRUE, FALSE, boolean, is_atom, is_symbol, is_list, named
+from types import is_pair, to_list, is_macro, is_lambda, is_builtin
+from parser import unparse
+from limits import enforced
+from evaluator import eval_macro, eval_lambda, eval_quote
+from evaluator import expansion_cache, special_forms, _is_macro_call
+from evaluator import _assert_exp_length, _assert_valid_definition, _assert_boolean
+
+# The most frames the continuation stack may hold
+max_depth = 1000000
+
+def execute(ast, env):
+    """Evaluate an Abstract Syntax Tree in the specified environment"""
+    return run(ast, env)
+
+# Kinds of continuation frames, by what is done with the value of the
+# nested form once it is known
+(ATOM, EQ_FIRST, EQ_SECOND, EXPAND, EXPAND_1, COND, LET, EVAL, SET, DEFINE,
+ BEGIN, QUASIQUOTE, OPERATOR, ARGUMENT) = range(14)
+
+def run(ast, env):
+    stack = []
+    push = stack.append
+    while True:
+        # evaluate `ast`, pushing frames for the work left after nested forms
+        while True:
+            if is_symbol(ast):
+                value = env[ast]
+                break
+            elif is_atom(ast):
+                value = ast
+                break
+            elif is_pair(ast):
+                ast = to_list(ast)  # data evaluated as code
+                continue
+            elif not is_list(ast):
+                raise LispSyntaxError(ast)
+
+            if len(stack) >= max_depth:
+                raise LispRecursionError(
+                    "Maximum evaluation depth of %d exceeded" % max_depth)
+            form = ast[0]
+            if not is_symbol(form) or form not in special_forms:
+                push((OPERATOR, ast, env))
+                ast = form
+            elif form == 'atom':
+                push((ATOM,))
+                ast = ast[1]
+            elif form == 'eq':
+                _assert_exp_length(ast, 3)
+                push((EQ_FIRST, ast, env))
+                ast = ast[1]
+            elif form == 'macro':
+                value = eval_macro(ast, env)
+                break
+            elif form == 'expand':
+                push((EXPAND, env))
+                ast = ast[1]
+            elif form == 'expand-1':
+                push((EXPAND_1, env))
+                ast = ast[1]
+            elif form == 'cond':
+                if len(ast) == 1:
+                    value = None  # no clause matched
+                    break
+                predicate, _ = ast[1]
+                push((COND, ast, 1, env))
+                ast = predicate
+            elif form == 'let':
+                _assert_exp_length(ast, 3)
+                for d in ast[1]:
+                    _assert_valid_definition(d)
+                if not ast[1]:
+                    ast, env = ast[2], Environment([], env)
+                    continue
+                push((LET, ast, [], env))
+                ast = ast[1][0][1]
+            elif form == 'eval':
+                _assert_exp_length(ast, 2)
+                push((EVAL, env))
+                ast = ast[1]
+            elif form == 'set!':
+                _assert_exp_length(ast, 3)
+                push((SET, ast[1], env))
+                ast = ast[2]
+            elif form == 'quote':
+                value = eval_quote(ast, env)
+                break
+            elif form == 'quasiquote':
+                _assert_exp_length(ast, 2)
+                unquotes = []
+                _find_unquotes(ast[1], unquotes)
+                if not unquotes:
+                    value = ast[1]
+                    break
+                _assert_exp_length(unquotes[0], 2)
+                push((QUASIQUOTE, ast[1], unquotes, [], env))
+                ast = unquotes[0][1]
+            elif form in ('lambda', 'λ'):
+                value = eval_lambda(ast, env, 'iterative')
+                break
+            elif form == 'begin':
+                if len(ast) == 1:
+                    raise LispSyntaxError("begin cannot be empty: %s" % unparse(ast))
+                if len(ast) > 2:
+                    push((BEGIN, ast, 1, env))
+                ast = ast[1]
+            else:
+                _assert_valid_definition(ast[1:])  # define
+                push((DEFINE, ast[1], env))
+                ast = ast[2]
+
+        # pass the value on to the innermost frame, until one has more to evaluate
+        while True:
+            if not stack:
+                return value
+            frame = stack.pop()
+            kind = frame[0]
+
+            if kind == OPERATOR:
+                if enforced.limits is not None:
+                    enforced.limits.step()
+                _, call, env = frame
+                fn = value
+                if is_macro(fn):
+                    ast = _expand_cached(fn, call, env)
+                    break
+                elif not is_lambda(fn) and not is_builtin(fn):
+                    raise LispTypeError("Call to: " + unparse(call[0]))
+                elif is_lambda(fn) and len(call) - 1 != len(fn.params):
+                    msg = "Wrong number of arguments, expected %d got %d: %s" \
+                        % (len(fn.params), len(call) - 1, unparse(call))
+                    raise LispTypeError(msg)
+                elif len(call) > 1:
+                    push((ARGUMENT, call, fn, [], env))
+                    ast = call[1]
+                    break
+                elif is_lambda(fn):
+                    ast, env = fn.body, Environment([], fn.env)
+                    break
+                value = fn.fn()
+            elif kind == ARGUMENT:
+                _, call, fn, args, env = frame
+                args.append(value)
+                if len(args) < len(call) - 1:
+                    push(frame)
+                    ast = call[len(args) + 1]
+                    break
+                elif is_lambda(fn):
+                    ast, env = fn.body, Environment(zip(fn.params, args), fn.env)
+                    break
+                value = fn.fn(*args)
+            elif kind == COND:
+                _, cond, i, env = frame
+                if value is TRUE:
+                    ast = cond[i][1]
+                    break
+                elif value is not FALSE:
+                    _assert_boolean(value, cond[i][0])
+                if i + 1 == len(cond):
+                    value = None  # no clause matched
+                    continue
+                predicate, _ = cond[i + 1]
+                push((COND, cond, i + 1, env))
+                ast = predicate
+                break
+            elif kind == BEGIN:
+                _, begin, i, env = frame
+                if i + 2 < len(begin):
+                    push((BEGIN, begin, i + 1, env))
+                ast = begin[i + 1]
+                break
+            elif kind == LET:
+                _, let, values, env = frame
+                values.append(value)
+                defs = let[1]
+                if len(values) < len(defs):
+                    push(frame)
+                    ast = defs[len(values)][1]
+                else:
+                    ast, env = let[2], Environment(zip([d[0] for d in defs], values), env)
+                break
+            elif kind == DEFINE:
+                _, name, env = frame
+                env[name] = named(value, name)
+                value = name
+            elif kind == SET:
+                _, name, env = frame
+                assign(env, name, value)
+                value = name
+            elif kind == EVAL:
+                if enforced.limits is not None:
+                    enforced.limits.step()
+                ast, env = value, frame[1]
+                break
+            elif kind == ATOM:
+                value = boolean(is_atom(value))
+            elif kind == EQ_FIRST:
+                _, eq, env = frame
+                push((EQ_SECOND, value))
+                ast = eq[2]
+                break
+            elif kind == EQ_SECOND:
+                first = frame[1]
+                value = TRUE if first == value and is_atom(first) else FALSE
+            elif kind == QUASIQUOTE:
+                _, template, unquotes, values, env = frame
+                values.append(value)
+                if len(values) < len(unquotes):
+                    _assert_exp_length(unquotes[len(values)], 2)
+                    push(frame)
+                    ast = unquotes[len(values)][1]
+                    break
+                value = _fill_unquotes(template, iter(values))
+            elif kind == EXPAND_1:
+                env = frame[1]
+                if _is_macro_call(value, env):
+                    value = expand_once(value, env)
+            elif kind == EXPAND:
+                env = frame[1]
+                while _is_macro_call(value, env):
+                    value = expand_once(value, env)
+
+def _find_unquotes(template, unquotes):
+    "Collect the unquote forms of a quasiquote template, in order"
+    if not isinstance(template, list):
+        return
+    elif template[0] == "unquote":
+        unquotes.append(template)
+    else:
+        for exp in template:
+            _find_unquotes(exp, unquotes)
+
+def _fill_unquotes(template, values):
+    "The template with its unquote forms replaced by their values, in order"
+    if not isinstance(template, list):
+        return template
+    elif template[0] == "unquote":
+        return next(values)
+    else:
+        return [_fill_unquotes(exp, values) for exp in template]
+
+def call_lambda(fn, args):
+    "Run a lambda on already evaluated arguments, returning its value"
+    return run(fn.body, Environment(zip(fn.params, args), fn.env))
+
+## Macros
+
+def _expand_cached(macro, form, env):
+    expanded_form = expansion_cache.lookup(form, macro)
+    if expanded_form is None:
+        expanded_form = expand_call(macro, form, env)
+        expansion_cache.store(form, macro, expanded_form)
+    return expanded_form
+
+def expand_once(form, env):
+    """expand macro form once, see moolisp.evaluator.expand_once"""
+    if is_pair(form):
+        form = to_list(form)
+    macro = run(form[0], env)
+    return expand_call(macro, form, env)
+
+def expand_call(macro, form, env):
+    "expand a call to the given macro"
+    substitutions = Environment(zip(macro.params, form[1:]), env)
+    expansion = run(macro.body, substitutions)
+    return to_list(expansion) if is_pair(expansion) else expansion
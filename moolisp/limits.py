@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Limits on the resources a Moo Lisp program may use.
+
+Untrusted programs may run for ever, or use up all the memory there is.
+Running them with Limits stops them with a LispLimitError after a number
+of steps, after some seconds, or once the memory of the process has
+grown by some number of bytes:
+
+    interpret(source, limits=Limits(steps=100000, seconds=1.0))
+
+A step is a call to a function or macro, or an eval: a program can't run
+for long without taking steps. While limits are being enforced, every
+engine counts the steps it takes, and checks the clock and the memory
+use every `interval` steps. Memory is the resident size of the whole
+process, so that limit is approximate.
+
+Limits are enforced per thread, with `with limits: ...`. When no limits
+are enforced, counting steps costs a single attribute lookup.
+"""
+
+import os
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+from errors import LispLimitError
+
+class Limits(object):
+    # steps between checks of the clock and memory use
+    interval = 1000
+
+    def __init__(self, steps=None, seconds=None, memory=None):
+        self.max_steps = steps
+        self.seconds = seconds
+        self.memory = memory
+        self.spent = (0, 0.0)  # steps taken and seconds passed before starting
+        self.start()
+
+    def start(self):
+        """Start counting from now, with no steps taken but those spent"""
+        self.steps, seconds = self.spent
+        self.started = time.time()
+        self.deadline = None if self.seconds is None \
+            else self.started + self.seconds - seconds
+        self.max_memory = None if self.memory is None else resident_memory() + self.memory
+        self.batch = self.countdown = self._next_batch()
+
+    def step(self):
+        self.countdown -= 1
+        if not self.countdown:
+            self.check()
+
+    def check(self):
+        """Raise a LispLimitError if any limit has been exceeded"""
+        self.steps += self.batch - self.countdown
+        self.batch = self.countdown
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise LispLimitError("Step limit of %d exceeded" % self.max_steps)
+        if self.deadline is not None and time.time() > self.deadline:
+            raise LispLimitError("Time limit of %g seconds exceeded" % self.seconds)
+        if self.max_memory is not None and resident_memory() > self.max_memory:
+            raise LispLimitError("Memory limit of %d bytes exceeded" % self.memory)
+        self.batch = self.countdown = self._next_batch()
+
+    def _next_batch(self):
+        if self.max_steps is None:
+            return self.interval
+        # the step after the last one allowed is a check
+        return max(1, min(self.interval, self.max_steps + 1 - self.steps))
+
+    def steps_taken(self):
+        return self.steps + self.batch - self.countdown
+
+    def take(self, steps):
+        """Count steps taken elsewhere, such as in worker processes"""
+        self.steps += steps
+        self.check()
+
+    def seconds_left(self):
+        """Seconds until the time limit, or None if there is none"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def copy(self):
+        """New Limits of the same size, to enforce separately"""
+        return Limits(self.max_steps, self.seconds, self.memory)
+
+    def remaining(self, parts=1):
+        """New Limits of what is left of these, to enforce separately,
+        such as in a worker process. They count on from the steps and
+        seconds spent so far. If the steps left are to be shared by
+        `parts` workers, the new Limits only allow one equal part."""
+        left = self.copy()
+        steps = self.steps_taken()
+        if self.max_steps is not None:
+            steps = self.max_steps - max(0, self.max_steps - steps) // parts
+        left.spent = (steps, self.spent[1] + time.time() - self.started)
+        return left
+
+    def __enter__(self):
+        self.start()
+        self.outer = enforced.limits
+        enforced.limits = self
+        return self
+
+    def __exit__(self, *exc_info):
+        enforced.limits = self.outer
+
+@contextmanager
+def enforcing(limits):
+    """Context manager enforcing the limits, if not None"""
+    if limits is None:
+        yield
+    else:
+        with limits:
+            yield
+
+class _Enforced(threading.local):
+    limits = None
+
+# The engines take steps with `enforced.limits.step()`, when not None
+enforced = _Enforced()
+
+_page_size = os.sysconf('SC_PAGE_SIZE')
+
+def resident_memory():
+    """The resident memory of this process in bytes. Where /proc is
+    missing, the peak resident memory is used instead."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _page_size
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
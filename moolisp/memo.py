@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memoization of Moo Lisp functions.
+
+`(memoize fn)` returns a builtin calling the lambda `fn`, which keeps the
+results of the latest calls, by argument values, in an LRU cache. By
+default the 128 most recently used results are kept; `(memoize fn size)`
+sets another limit. Since a memoized recursive function is usually
+defined under the name its body calls, the recursive calls are cached
+too:
+
+    (define fib
+        (memoize (lambda (n)
+            (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))))
+
+`(memo-stats fib)` gives the list (hits misses size max-size), and
+`(memo-clear fib)` empties the cache and resets the counts.
+
+On a cache miss, the lambda is run by the engine it was made by, as
+recorded in Lambda.engine. Only use memoize on functions without side
+effects.
+"""
+
+from collections import OrderedDict
+
+import evaluator
+import analyzer
+import vm
+import iterative
+from errors import LispTypeError
+from parser import unparse
+from types import Builtin, TRUE, from_list, hashable, is_integer, is_lambda
+
+_missing = object()
+
+class LRUCache(object):
+    "A mapping keeping only the `maxsize` most recently used entries"
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.entries.pop(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries[key] = value  # now the most recently used
+        return value
+
+    def store(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+# How each engine runs a lambda on evaluated arguments, by engine name
+callers = {
+    'eval': evaluator.call_lambda,
+    'analyze': analyzer.call_lambda,
+    'vm': vm.call_lambda,
+    'iterative': iterative.call_lambda,
+}
+
+def call_lambda(fn, args):
+    "Run a lambda on evaluated arguments, with the engine that made it"
+    return callers[fn.engine](fn, args)
+
+def memoize(fn, maxsize=128):
+    if not is_lambda(fn):
+        raise LispTypeError("Can't memoize %s, expected a lambda" % unparse(fn))
+    if not is_integer(maxsize) or maxsize < 1:
+        raise LispTypeError("Cache size must be a positive integer, got %s"
+            % unparse(maxsize))
+    cache = LRUCache(maxsize)
+
+    def memoized(*args):
+        if len(args) != len(fn.params):
+            raise LispTypeError("Wrong number of arguments, expected %d got %d: %s"
+                % (len(fn.params), len(args), unparse([fn] + list(args))))
+        key = hashable(args)
+        value = cache.get(key, _missing)
+        if value is _missing:
+            value = call_lambda(fn, list(args))
+            cache.store(key, value)
+        return value
+    memoized.fn = fn
+    memoized.cache = cache
+    return Builtin(memoized, fn.name)
+
+def _cache_of(fn):
+    cache = getattr(getattr(fn, 'fn', None), 'cache', None)
+    if cache is None:
+        raise LispTypeError("Not a memoized function: %s" % unparse(fn))
+    return cache
+
+def memo_stats(fn):
+    cache = _cache_of(fn)
+    return from_list([cache.hits, cache.misses, len(cache), cache.maxsize])
+
+def memo_clear(fn):
+    _cache_of(fn).clear()
+    return TRUE
+
+builtins = {
+    'memoize': Builtin(memoize, 'memoize'),
+    'memo-stats': Builtin(memo_stats, 'memo-stats'),
+    'memo-clear': Builtin(memo_clear, 'memo-clear'),
+}
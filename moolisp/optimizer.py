@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+"""
+Ahead-of-time constant folding and partial evaluation.
+
+`optimize` walks a program once, and simplifies what depends only on
+literals, before the program is run:
+
+    (+ 3 4)                      =>  7
+    (cond (#f a) (#t b) (c d))   =>  b
+    (let ((x 5)) (* x 2))        =>  10
+    (begin 1 '(a) (f))           =>  (f)
+
+Calls are folded when all their arguments are constants, and the
+operator is a pure builtin from get_builtin_env that can't be anything
+else when the call runs: its name must not be shadowed by a lambda or
+let variable, nor defined or set! anywhere in the program. Constant let
+bindings are substituted into the body, unless the body assigns them or
+might run code that can't be seen here: eval, expand, or a call to
+anything but a known lambda or builtin, which could be a macro. Calls
+that fail, such as (/ 1 0), are left to fail when evaluated.
+
+Statements are optimized one at a time, right before they run. The
+bodies of lambdas and macros run later, possibly after the statements
+that follow have redefined a builtin. So calls in them are only folded
+when all the statements of the program are known up front, and none of
+them defines or set!s the operator, even through a macro. If any of
+them could do so unseen, through eval or a call that can't be resolved
+ahead of time, none of those calls are folded, see `program_variables`.
+
+Like moolisp.expander, this is best run after macro expansion, which
+turns macros like `if` into forms the optimizer understands.
+"""
+
+from types import TRUE, FALSE, is_boolean, is_integer, is_symbol, is_list
+from types import is_builtin, is_lambda, is_macro, is_pair
+from errors import LispError
+from expander import _assigned_variables, _expand, _Unstable
+
+# Builtins without side effects, always giving the same result for the
+# same arguments
+pure_builtins = frozenset(['+', '-', '*', '/', 'mod', '=', '>', '<', '>=', '<='])
+
+def optimize(ast, env, program=None):
+    """Fold the constant parts of an AST, for running in `env`.
+
+    If the whole program is known, `program` holds the variables it may
+    assign, from `program_variables`. Otherwise, nothing that runs later,
+    in the bodies of lambdas and macros, is folded. Returns the optimized
+    AST, leaving the original untouched."""
+    later = None if program is None else program.union(_assigned_variables(ast))
+    return _optimize(ast, env, frozenset(), {},
+                     _Unstable(_assigned_variables(ast), later))
+
+def program_variables(forms, env):
+    """All variables the statements of a program may define or set!, once
+    their macro calls are expanded, including in quoted code that eval or
+    macros may run. Returns None when that can't be known ahead of time,
+    that is when a statement uses eval, or makes a call that expansion
+    can't resolve, which might be to a macro defining anything.
+
+    Only macros from `env` that the program never assigns are expanded
+    here, so calls to macros the program defines itself give None too.
+    Like moolisp.expander, this assumes expansions have no side effects."""
+    names = frozenset()
+    while True:
+        expanded = []
+        for form in forms:
+            unstable = names.union(_assigned_variables(form))
+            try:
+                expanded.append(_expand(form, env, frozenset(),
+                                        _Unstable(unstable, unstable)))
+            except Exception:
+                return None  # reported when the statement runs
+        assignments = _assignments(expanded)
+        if any(_makes_unresolved_calls(form, env, assignments) for form in expanded):
+            return None
+        if names.issuperset(assignments):
+            return names
+        # the new names may leave other macro calls unexpanded
+        names = names.union(assignments)
+
+def _assignments(forms):
+    """The variables defined or set! anywhere in some ASTs, each mapped to
+    whether all the values assigned to it are lambda expressions"""
+    lambdas = {}
+    pending = list(forms)
+    while pending:
+        exp = pending.pop()
+        if is_pair(exp):
+            exp = list(exp)
+        if not is_list(exp) or not exp:
+            continue
+        elif exp[0] in ('define', 'set!') and len(exp) > 1 and is_symbol(exp[1]):
+            value = exp[2] if len(exp) == 3 else None
+            lambdas[exp[1]] = lambdas.get(exp[1], True) and is_list(value) \
+                and len(value) > 0 and value[0] in ('lambda', 'λ')
+        pending.extend(exp)
+    return lambdas
+
+def _makes_unresolved_calls(ast, env, assignments):
+    """Whether an expanded AST uses eval, or calls something that might be
+    a macro: a variable the program assigns anything but lambdas to, a
+    lambda or let variable, or an expression other than a lambda"""
+    pending = [(ast, frozenset())]
+    while pending:
+        ast, bound = pending.pop()
+        if not is_list(ast) or not ast:
+            continue
+        head = ast[0]
+        if is_symbol(head) and head in special_forms:
+            if head == 'eval':
+                return True
+            elif head in ('lambda', 'λ', 'macro') and len(ast) == 3 \
+                    and is_list(ast[1]):
+                pending.append((ast[2], bound.union(ast[1])))
+            elif head == 'let' and len(ast) == 3 and is_list(ast[1]):
+                names = [d[0] for d in ast[1] if is_list(d) and len(d) == 2]
+                pending.extend((d[1], bound) for d in ast[1]
+                               if is_list(d) and len(d) == 2)
+                pending.append((ast[2], bound.union(names)))
+            else:
+                pending.extend((exp, bound) for exp in _evaluated_parts(ast))
+            continue
+        elif is_list(head) and head and head[0] in ('lambda', 'λ'):
+            pass
+        elif not is_symbol(head) or head in bound:
+            return True
+        elif head in assignments:
+            if not assignments[head]:
+                return True
+        elif is_macro(_global_value(head, env)):
+            return True
+        pending.extend((exp, bound) for exp in ast)
+    return False
+
+def _optimize(ast, env, bound, constants, unstable):
+    if is_symbol(ast):
+        return constants.get(ast, ast)
+    elif not is_list(ast) or not ast:
+        return ast
+
+    head = ast[0]
+    if is_symbol(head) and head in special_forms:
+        return special_forms[head](ast, env, bound, constants, unstable)
+
+    call = [_optimize(exp, env, bound, constants, unstable) for exp in ast]
+    builtin = _pure_builtin(head, env, bound, unstable)
+    if builtin is None or not all(map(is_constant, call[1:])):
+        return call
+    try:
+        value = builtin.fn(*map(constant_value, call[1:]))
+    except Exception:
+        return call  # left for evaluation, which fails only if the call is reached
+    return value if is_integer(value) or is_boolean(value) else call
+
+def is_constant(exp):
+    "Whether an expression always evaluates to the same value"
+    return is_integer(exp) or is_boolean(exp) \
+        or (is_list(exp) and len(exp) == 2 and exp[0] == 'quote')
+
+def constant_value(exp):
+    return exp[1] if is_list(exp) else exp
+
+def _pure_builtin(head, env, bound, unstable):
+    "The pure builtin a call operator refers to, if it can be known ahead of time"
+    if not is_symbol(head) or head not in pure_builtins \
+            or head in bound or head in unstable:
+        return None
+    value = _global_value(head, env)
+    if is_builtin(value) and value.name == head:
+        return value
+    return None
+
+def _global_value(name, env):
+    try:
+        return env[name]
+    except LispError:
+        return None
+
+def _runs_unseen_code(ast, env, bound, unstable):
+    "Whether an AST might run code not found in it, such as a macro expansion"
+    pending = [ast]
+    while pending:
+        ast = pending.pop()
+        if not is_list(ast) or not ast:
+            continue
+        head = ast[0]
+        if is_symbol(head) and head in special_forms:
+            if head in ('eval', 'expand', 'expand-1'):
+                return True
+            pending.extend(_evaluated_parts(ast))
+        elif is_list(head) and head and head[0] in ('lambda', 'λ'):
+            pending.extend(ast)
+        elif not is_symbol(head) or head in bound or head in unstable:
+            return True
+        else:
+            value = _global_value(head, env)
+            if not is_builtin(value) and not is_lambda(value):
+                return True
+            pending.extend(ast[1:])
+    return False
+
+def _evaluated_parts(ast):
+    "The expressions in a special form that may be evaluated"
+    head = ast[0]
+    if head == 'quote':
+        return []
+    elif head == 'quasiquote':
+        return [exp[1] for exp in _unquotes(ast[1:])]
+    elif head in ('lambda', 'λ', 'macro', 'define', 'set!'):
+        return ast[2:]
+    elif head == 'let' and len(ast) > 1 and is_list(ast[1]):
+        return [d[1] for d in ast[1] if is_list(d) and len(d) == 2] + ast[2:]
+    elif head == 'cond':
+        return [exp for clause in ast[1:] if is_list(clause) for exp in clause]
+    else:
+        return ast[1:]
+
+def _unquotes(templates):
+    "The unquote forms in quasiquote templates"
+    unquotes = []
+    pending = list(templates)
+    while pending:
+        template = pending.pop()
+        if not is_list(template) or not template:
+            continue
+        elif template[0] == 'unquote' and len(template) == 2:
+            unquotes.append(template)
+        else:
+            pending.extend(template)
+    return unquotes
+
+def _shadow(names, bound, constants):
+    "The bound names and the constants in scope where `names` are rebound"
+    inner = dict((name, exp) for name, exp in constants.iteritems()
+                 if name not in names)
+    return bound.union(names), inner
+
+## Special forms
+
+def _optimize_arguments(ast, env, bound, constants, unstable):
+    return [ast[0]] + [_optimize(exp, env, bound, constants, unstable)
+                       for exp in ast[1:]]
+
+def _optimize_quote(ast, env, bound, constants, unstable):
+    return ast
+
+def _optimize_quasiquote(ast, env, bound, constants, unstable):
+    def template(ast):
+        if not is_list(ast) or not ast:
+            return ast
+        elif ast[0] == 'unquote' and len(ast) == 2:
+            return ['unquote', _optimize(ast[1], env, bound, constants, unstable)]
+        else:
+            return [template(exp) for exp in ast]
+    return template(ast)
+
+def _optimize_lambda(ast, env, bound, constants, unstable):
+    if len(ast) != 3 or not is_list(ast[1]) or not all(map(is_symbol, ast[1])):
+        return ast  # malformed, reported when evaluated
+    (head, params, body) = ast
+    inner_bound, inner_constants = _shadow(params, bound, constants)
+    return [head, params, _optimize(body, env, inner_bound, inner_constants,
+                                    unstable.deferred())]
+
+def _optimize_let(ast, env, bound, constants, unstable):
+    if len(ast) != 3 or not is_list(ast[1]) \
+            or not all(is_list(d) and len(d) == 2 and is_symbol(d[0]) for d in ast[1]):
+        return ast  # malformed, reported when evaluated
+    defs = [[name, _optimize(exp, env, bound, constants, unstable)]
+            for name, exp in ast[1]]
+    inner_bound, inner_constants = _shadow([name for name, _ in defs],
+                                           bound, constants)
+    body = ast[2]
+    assigned = _assigned_variables(body)
+    if not _runs_unseen_code(body, env, inner_bound, unstable):
+        for name, exp in defs:
+            if name not in assigned and is_constant(exp):
+                inner_constants[name] = exp
+    body = _optimize(body, env, inner_bound, inner_constants, unstable)
+    defs = [d for d in defs if d[0] not in inner_constants]
+    if not defs and not assigned:
+        return body
+    return ['let', defs, body]
+
+def _optimize_cond(ast, env, bound, constants, unstable):
+    if not all(is_list(clause) and len(clause) == 2 for clause in ast[1:]):
+        return ast  # malformed, reported when evaluated
+    clauses = []
+    for predicate, exp in ast[1:]:
+        predicate = _optimize(predicate, env, bound, constants, unstable)
+        if predicate is FALSE:
+            continue  # never chosen
+        exp = _optimize(exp, env, bound, constants, unstable)
+        if predicate is TRUE and not clauses:
+            return exp
+        clauses.append([predicate, exp])
+        if predicate is TRUE:
+            break  # the clauses after it are never reached
+    return ['cond'] + clauses
+
+def _optimize_begin(ast, env, bound, constants, unstable):
+    if len(ast) == 1:
+        return ast  # empty, reported when evaluated
+    exps = [_optimize(exp, env, bound, constants, unstable) for exp in ast[1:]]
+    # constants have no effects, so only the value of the last one matters
+    exps = [exp for exp in exps[:-1] if not is_constant(exp)] + exps[-1:]
+    return exps[0] if len(exps) == 1 else ['begin'] + exps
+
+def _optimize_definition(ast, env, bound, constants, unstable):
+    return ast[:2] + [_optimize(exp, env, bound, constants, unstable)
+                      for exp in ast[2:]]
+
+special_forms = {
+    'atom': _optimize_arguments,
+    'eq': _optimize_arguments,
+    'macro': _optimize_lambda,
+    'expand': _optimize_arguments,
+    'expand-1': _optimize_arguments,
+    'cond': _optimize_cond,
+    'let': _optimize_let,
+    'eval': _optimize_arguments,
+    'set!': _optimize_definition,
+    'quote': _optimize_quote,
+    'quasiquote': _optimize_quasiquote,
+    'lambda': _optimize_lambda,
+    'λ': _optimize_lambda,
+    'begin': _optimize_begin,
+    'define': _optimize_definition,
+}
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parallel map and reduce over Moo Lisp lists, in worker processes.
+
+`(pmap fn xs)` is like mapping `fn` over the list `xs`, but the elements
+are split into chunks that run in a pool of processes, one per CPU by
+default. The results come back in order. `(preduce fn xs init)` folds
+each chunk with `fn` in the workers, and then the results of the chunks,
+starting from `init`. The function must therefore be associative.
+
+Functions, lists and other values are sent to the workers pickled. The
+workers are forked after the prelude is loaded, so anything defined in
+the prelude is sent by name rather than copied. Everything else a lambda
+can reach through its environment is copied, so definitions and set!
+made by a worker are not seen by the caller or by other workers.
+
+A LispError raised in a worker is raised again by pmap or preduce. Any
+other exception is raised as a LispError. Calls made from inside a
+worker run sequentially, in that worker.
+
+When limits are enforced (see moolisp.limits), each chunk is run under
+what is left of them when pmap or preduce is called, and gets an equal
+share of the steps left. All the chunks together thus can't take more
+steps than the caller has left. The steps taken by the workers are then
+counted by the caller too, and the caller stops waiting for the workers
+once its time is up.
+"""
+
+import cPickle as pickle
+from multiprocessing import Pool, TimeoutError, cpu_count
+from StringIO import StringIO
+
+import interpreter
+from memo import call_lambda, memoize
+from limits import enforced, enforcing
+from errors import LispError, LispLimitError, LispTypeError
+from env import _list
+from parser import unparse
+from types import Builtin, Lambda, Macro, is_builtin, is_lambda, is_pair
+
+# Number of worker processes, one per CPU if None. Read when the pool is made.
+processes = None
+
+_pool = None
+_in_worker = False
+
+## serialization
+
+def dumps(value):
+    """Pickle a Moo Lisp value, referring to the prelude by name"""
+    out = StringIO()
+    pickler = pickle.Pickler(out, 2)
+    pickler.persistent_id = _persistent_id(interpreter.prelude())
+    pickler.dump(value)
+    return out.getvalue()
+
+def loads(data):
+    """Unpickle a value from `dumps`, in a process with the same prelude"""
+    unpickler = pickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = _persistent_load(interpreter.prelude())
+    return unpickler.load()
+
+def _persistent_id(prelude):
+    names = dict((id(value), name) for name, value in prelude.iteritems())
+
+    def persistent_id(obj):
+        if obj is prelude:
+            return ('prelude',)
+        obj_type = type(obj)
+        if obj_type in (Builtin, Lambda, Macro) and id(obj) in names:
+            return ('value', names[id(obj)])
+        if obj_type is Builtin:
+            memoized = getattr(obj.fn, 'cache', None)
+            if memoized is None:
+                raise LispTypeError("Can't send %s to a worker process"
+                                    % (obj.name or unparse(obj)))
+            return ('memoized', obj.fn.fn, memoized.maxsize, obj.name)
+        return None
+    return persistent_id
+
+def _persistent_load(prelude):
+    def persistent_load(pid):
+        if pid[0] == 'prelude':
+            return prelude
+        elif pid[0] == 'value':
+            return prelude.get(pid[1])
+        _, fn, maxsize, name = pid
+        memoized = memoize(fn, maxsize)
+        memoized.name = name
+        return memoized
+    return persistent_load
+
+## worker processes
+
+def pool():
+    """The pool of worker processes, started on first use"""
+    global _pool
+    if _pool is None:
+        interpreter.prelude()  # loaded before forking, so workers share it
+        _pool = Pool(processes, initializer=_init_worker)
+    return _pool
+
+def shutdown():
+    """Stop the worker processes"""
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+def _init_worker():
+    global _in_worker
+    _in_worker = True
+    enforced.limits = None  # forked from a thread that may be enforcing its own
+
+def _call(fn, args):
+    if is_lambda(fn):
+        return call_lambda(fn, args)
+    return fn.fn(*args)
+
+def _map_chunk(data):
+    fn, items, limits = loads(data)
+    with enforcing(limits):
+        results = [_call(fn, [x]) for x in items]
+    return dumps((results, _steps_taken(limits)))
+
+def _reduce_chunk(data):
+    fn, items, limits = loads(data)
+    with enforcing(limits):
+        result = items[0]
+        for x in items[1:]:
+            result = _call(fn, [result, x])
+    return dumps((result, _steps_taken(limits)))
+
+def _steps_taken(limits):
+    return 0 if limits is None else limits.steps_taken() - limits.spent[0]
+
+def _run_chunks(worker, fn, items):
+    """Run `worker` on chunks of the items, returning the unpickled results"""
+    chunks = _chunks(items, (processes or cpu_count()) * 4)
+    limits = enforced.limits
+    budget = None if limits is None else limits.remaining(len(chunks))
+    pending = pool().map_async(worker, [dumps((fn, chunk, budget)) for chunk in chunks])
+    timeout = None if limits is None else limits.seconds_left()
+    try:
+        # always with a timeout, since get() can't be interrupted without one
+        results = pending.get(1e9 if timeout is None else timeout)
+    except TimeoutError:
+        shutdown()  # stop the workers still running
+        raise LispLimitError("Time limit of %g seconds exceeded" % limits.seconds)
+    except LispError:
+        raise
+    except Exception, e:
+        raise LispError("Error in worker process: %s: %s" % (type(e).__name__, e))
+    results = [loads(result) for result in results]
+    if limits is not None:
+        limits.take(sum(steps for _, steps in results))
+    return [result for result, _ in results]
+
+def _chunks(items, n):
+    size = -(-len(items) // n)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+## builtins
+
+def _check_function(fn, nargs, name):
+    if is_lambda(fn) and len(fn.params) == nargs or is_builtin(fn):
+        return
+    raise LispTypeError("%s expects a function of %d arguments, got %s"
+        % (name, nargs, unparse(fn)))
+
+def _elements(xs, name):
+    if xs == 'nil':
+        return []
+    if not isinstance(xs, list) and not is_pair(xs):
+        raise LispTypeError("%s expects a list, got %s" % (name, unparse(xs)))
+    return list(xs)
+
+def pmap(fn, xs):
+    _check_function(fn, 1, 'pmap')
+    items = _elements(xs, 'pmap')
+    if _in_worker or len(items) < 2:
+        results = [_call(fn, [x]) for x in items]
+    else:
+        results = [x for chunk in _run_chunks(_map_chunk, fn, items) for x in chunk]
+    return _list(*results)
+
+def preduce(fn, xs, init):
+    _check_function(fn, 2, 'preduce')
+    items = _elements(xs, 'preduce')
+    if _in_worker or len(items) < 2:
+        partials = items
+    else:
+        partials = _run_chunks(_reduce_chunk, fn, items)
+    result = init
+    for x in partials:
+        result = _call(fn, [result, x])
+    return result
+
+builtins = {
+    'pmap': Builtin(pmap, 'pmap'),
+    'preduce': Builtin(preduce, 'preduce'),
+}
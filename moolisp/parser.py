@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import re
-from types import boolean, is_boolean, integer, is_integer, value_of
+from types import TRUE, FALSE, boolean, integer
+from types import Pair, from_list, symbol, is_symbol
 from errors import LispSyntaxError
 
 quote_names = {
@@ -11,33 +12,301 @@ quote_names = {
 }
 quote_ticks = dict((tick, name) for name, tick in quote_names.iteritems())
 
+# A token is a paren, a quote tick, a comment or an atom. Quote ticks are
+# only recognized at the start of a token, so "a,b" is still a single atom.
+token_pattern = re.compile(r"[()'`,]|;[^\n]*|[^\s()'`,;][^\s()';]*")
+
 def parse(source):
     """Parse string representation of one single expression
     into the corresponding Abstract Syntax Tree"""
-    source = remove_comments(source)
-    exp, rest = partition_exp(source)
-    if rest:
+    tokens = tokenize(source)
+    exp = read(tokens)
+    if exp is EOF:
+        raise LispSyntaxError('Expected expression, got EOF')
+    elif next(tokens, None) is not None:
         raise LispSyntaxError('Expected EOF')
-    elif exp[0] in quote_ticks:
-        return [quote_ticks[exp[0]], parse(exp[1:])]
-    elif exp[0] == "(":
-        end = find_matching_paren(exp)
-        return [parse(e) for e in split_exps(exp[1:end])]
-    else:
-        return atomize(exp)
-
-def unparse(ast):
-    if is_boolean(ast):
-        return "#t" if value_of(ast) else "#f"
-    elif is_integer(ast):
-        return str(value_of(ast))
-    elif isinstance(ast, list):
-        if len(ast) > 0 and ast[0] in quote_names:
-            return "%s%s" % (quote_names[ast[0]], unparse(ast[1]))
+    return exp
+
+def parse_multiple(source, shared=None):
+    """Creates a list of ASTs from program source 
+    constituting multiple expressions. See read_all for `shared`."""
+    return list(read_all(tokenize(source), shared))
+
+def tokenize(source):
+    """Lazily split a source string into tokens, skipping
+    whitespace and comments"""
+    for match in token_pattern.finditer(source):
+        token = match.group()
+        if token[0] != ';':
+            yield token
+
+def tokenize_stream(stream):
+    """Lazily tokenize a file-like object, one line at a time
+
+    Tokens never span lines, so only the current line is kept in memory.
+    Lines are read with readline rather than iteration, to avoid the
+    read-ahead buffering of file iterators on pipes."""
+    for line in iter(stream.readline, ''):
+        for token in tokenize(line):
+            yield token
+
+class EndOfInput(object):
+    "Marker returned by `read` when there are no more expressions"
+
+    def __repr__(self):
+        return "EOF"
+
+EOF = EndOfInput()
+
+def read(tokens, shared=None):
+    """Read the next expression from an iterator of tokens
+
+    Consumes exactly the tokens making up one expression, and returns
+    its AST, or EOF if the tokens are exhausted. Nested lists are built
+    on an explicit stack, so the whole expression is read in one pass.
+
+    Quoted lists are data, and are converted to Pairs as they are read.
+    Quotes inside quasiquote templates are left alone, since the unquotes
+    they contain still have to be filled in. Given SharedData, the data
+    and integers are shared with identical ones read before, as soon as
+    each list is complete."""
+    # [quote name or None, list under construction, in quasiquote, in shared data]
+    stack = []
+    for token in tokens:
+        quasiquoted, in_data = (stack[-1][2], stack[-1][3]) if stack else (False, False)
+        if token == '(':
+            stack.append([None, [], quasiquoted, in_data])
+            continue
+        elif token in quote_ticks:
+            name = quote_ticks[token]
+            stack.append([name, None, quasiquoted or name == 'quasiquote',
+                          in_data or (name == 'quote' and not quasiquoted
+                                      and shared is not None)])
+            continue
+        elif token == ')':
+            if not stack or stack[-1][0] is not None:
+                raise LispSyntaxError("Unexpected ')'")
+            _, exp, quasiquoted, in_data = stack.pop()
+            if in_data:
+                exp = shared.from_list(exp)
+            elif len(exp) == 2 and exp[0] == 'quote' and not quasiquoted:
+                exp[1] = _quoted(exp[1], shared)
+        else:
+            exp = atomize(token)
+            if shared is not None and type(exp) in (int, long):
+                exp = shared.atoms.setdefault(exp, exp)
+
+        while stack and stack[-1][0] is not None:
+            name, _, quasiquoted, _ = stack.pop()
+            if name == 'quote' and not quasiquoted:
+                exp = _quoted(exp, shared)
+            exp = [name, exp]
+        if not stack:
+            return exp
+        if not stack[-1][1] and exp == 'quasiquote':
+            stack[-1][2] = True
+        stack[-1][1].append(exp)
+
+    if stack:
+        raise LispSyntaxError("Unbalanced expression: "
+            "reached EOF with %d unclosed form(s)" % len(stack))
+    return EOF
+
+def _quoted(exp, shared=None):
+    if not isinstance(exp, list):
+        return exp
+    return from_list(exp) if shared is None else shared.from_list(exp)
+
+def read_all(tokens, shared=None):
+    """Generator reading expressions from tokens until they run out
+
+    Given SharedData, the quoted data and integers of the expressions are
+    shared with any identical ones read before."""
+    while True:
+        exp = read(tokens, shared)
+        if exp is EOF:
+            return
+        yield exp
+
+class SharedData(object):
+    """Hash-consing of the data in a program, to save memory
+
+    Tables and lists of literals in data-heavy programs often repeat the
+    same values and sublists many times. Each is a separate object when
+    read, but all copies can be one shared object. Quoted data is made of
+    immutable Pairs, so sharing them changes nothing a program can see.
+    eq compares atoms only, so it cannot tell either. Comparing shared
+    lists with = becomes an identity check.
+
+    Code is not shared, since caches such as the macro expansion cache
+    are keyed by the identity of each form. Neither are quasiquote
+    templates, which are filled in at runtime. Lists built at runtime,
+    by cons and list, are fresh Pairs as before, which may share tails
+    with the data. The table lives only as long as the program is read,
+    so it never grows with what the program does."""
+
+    def __init__(self):
+        self.atoms = {}
+        self.empty = []
+        self.pairs = {}  # (id of car, id of cdr or 0 for ()) to Pair
+
+    def from_list(self, lst):
+        "Shared Pairs with the elements of a Python list, like types.from_list"
+        tail, cdr_id = self.empty, 0
+        for x in reversed(lst):
+            if isinstance(x, list):
+                x = self.from_list(x)
+            elif type(x) in (int, long):
+                x = self.atoms.setdefault(x, x)
+            key = (id(x), cdr_id)
+            pair = self.pairs.get(key)
+            if pair is None:
+                pair = self.pairs[key] = Pair(x, tail)
+            tail, cdr_id = pair, id(pair)
+        return tail
+
+    def share_code(self, exp):
+        """Share the quoted data and integers in an expression read before,
+        such as one loaded from the cache, in place. Returns the expression."""
+        if isinstance(exp, list):
+            stack = [exp]
         else:
-            return "(%s)" % " ".join([unparse(x) for x in ast])
-    else:
-        return str(ast)  # string, integer or Closure
+            return self.share(exp)
+        while stack:
+            x = stack.pop()
+            if not x or x[0] == 'quasiquote':
+                continue
+            elif x[0] == 'quote' and len(x) == 2:
+                x[1] = self.share(x[1])
+                continue
+            for i, elem in enumerate(x):
+                if isinstance(elem, list):
+                    stack.append(elem)
+                elif type(elem) in (int, long):
+                    x[i] = self.atoms.setdefault(elem, elem)
+        return exp
+
+    def share(self, value):
+        "The shared copy of a quoted value"
+        if type(value) in (int, long):
+            return self.atoms.setdefault(value, value)
+        elif isinstance(value, list) and not value:
+            return self.empty
+        elif not isinstance(value, Pair):
+            return value  # a symbol or boolean
+        pairs = []
+        tail = value
+        while isinstance(tail, Pair):
+            pairs.append(tail)
+            tail = tail.cdr
+        # share from the end, so each cdr is already shared
+        cdr_id = 0 if tail == [] else id(tail)
+        for pair in reversed(pairs):
+            car = self.share(pair.car)
+            key = (id(car), cdr_id)
+            shared = self.pairs.get(key)
+            if shared is None:
+                if car is not pair.car or pair.cdr is not tail:
+                    pair = Pair(car, tail)
+                shared = self.pairs[key] = pair
+            tail, cdr_id = shared, id(shared)
+        return tail
+
+def intern_symbols(exp):
+    """Intern the symbols of an expression not made by the reader, such
+    as one loaded from a pickle, in place. Returns the expression."""
+    if is_symbol(exp):
+        return symbol(exp)
+    stack = [exp]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, list):
+            for i, elem in enumerate(x):
+                if is_symbol(elem):
+                    x[i] = symbol(elem)
+                elif isinstance(elem, (list, Pair)):
+                    stack.append(elem)
+        else:
+            while isinstance(x, Pair):
+                if is_symbol(x.car):
+                    x.car = symbol(x.car)
+                elif isinstance(x.car, (list, Pair)):
+                    stack.append(x.car)
+                x = x.cdr
+    return exp
+
+def unparse(ast, max_depth=None, max_length=None):
+    "The source text of an expression, see `write`"
+    if not isinstance(ast, (list, Pair)):
+        return _atom_text(ast)
+    parts = []
+    _write(ast, parts.append, max_depth, max_length)
+    return "".join(parts)
+
+def write(ast, out, max_depth=None, max_length=None):
+    """Write the source text of an expression to a file-like object
+
+    The text is written a piece at a time as the expression is walked,
+    without recursion, so huge and deeply nested values are written in
+    little memory. Lists nested more than `max_depth` deep are written as
+    (...), and the elements of a list after the first `max_length` as ..."""
+    _write(ast, out.write, max_depth, max_length)
+
+def _write(ast, write, max_depth, max_length):
+    stack = []  # [iterator over the elements left, number written] per open list
+    while True:
+        # write the start of `ast`, opening a list if it is one
+        quoted = _quoted_form(ast)
+        while quoted is not None:
+            write(quote_names[quoted[0]])
+            ast = quoted[1]
+            quoted = _quoted_form(ast)
+        if not isinstance(ast, (list, Pair)):
+            write(_atom_text(ast))
+        elif max_depth is not None and len(stack) >= max_depth:
+            write("(...)")
+        else:
+            write("(")
+            stack.append([iter(ast), 0])
+
+        # write elements up to the next list, closing the lists that are done
+        while stack:
+            top = stack[-1]
+            ast = next(top[0], EOF)
+            if ast is EOF:
+                write(")")
+                stack.pop()
+                continue
+            if max_length is not None and top[1] >= max_length:
+                write(" ...)" if top[1] else "...)")
+                stack.pop()
+                continue
+            if top[1]:
+                write(" ")
+            top[1] += 1
+            if isinstance(ast, (list, Pair)):
+                break
+            write(_atom_text(ast))
+        else:
+            return
+
+def _quoted_form(ast):
+    "The quote name and the quoted expression, if `ast` is a quote form"
+    if isinstance(ast, Pair):
+        if isinstance(ast.car, str) and ast.car in quote_names \
+                and isinstance(ast.cdr, Pair):
+            return ast.car, ast.cdr.car
+    elif isinstance(ast, list) and ast:
+        if isinstance(ast[0], str) and ast[0] in quote_names:
+            return ast[0], ast[1]
+    return None
+
+def _atom_text(ast):
+    if ast is TRUE:
+        return "#t"
+    elif ast is FALSE:
+        return "#f"
+    return str(ast)  # symbol, integer or Closure
 
 def atomize(elem):
     if elem == "#f":
@@ -47,40 +316,7 @@ def atomize(elem):
     elif elem.isdigit():
         return integer(int(elem))
     else: 
-        return elem  # symbols or lists
-
-def parse_multiple(source):
-    """Creates a list of ASTs from program source 
-    constituting multiple expressions"""
-    source = remove_comments(source)
-    return [parse(exp) for exp in split_exps(source)]
-
-def split_exps(source):
-    """Splits a source string into subexpressions 
-    that can be parsed individually"""
-    rest = source.strip()
-    exps = []
-    while rest:
-        exp, rest = partition_exp(rest)
-        exps.append(exp)
-    return exps
-
-def partition_exp(source):
-    """Split string into (exp, rest) where exp is the 
-    first expression in the string and rest is the 
-    rest of the string after this expression."""
-    source = source.strip()
-    if source[0] in quote_ticks:
-        exp, rest = partition_exp(source[1:])
-        return source[0] + exp, rest
-    elif source[0] == "(":
-        last = find_matching_paren(source)
-        return source[:last + 1], source[last + 1:]
-    else:
-        match = re.match(r"^[^\s)']+", source)
-        end = match.end()
-        atom = source[:end]
-        return atom, source[end:]
+        return symbol(elem)
 
 def find_matching_paren(source, start=0):
     """Given a string and the index of an opening parenthesis, determine 
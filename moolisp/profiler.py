@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Profiler for Moo Lisp programs run by the tree-walking evaluator.
+
+Records, per lambda, builtin and macro, how many times it was called,
+the time spent in it, and how many Lisp objects (cons cells, closures
+and environments) it allocated. Functions are known by the name they
+were first defined as, while anonymous lambdas are grouped together.
+
+Time and allocations are reported both inclusive and exclusive of the
+calls made from a function. For macros, only the expansion is counted;
+running the expanded code counts towards the caller.
+
+The evaluator calls the profiler from apply_lambda, apply_builtin and
+apply_macro, but only while one is enabled. Tail calls are eliminated
+while profiling too: a function making a call in tail position is
+counted as having returned when the call starts, as its frame is gone.
+"""
+
+from contextlib import contextmanager
+from timeit import default_timer
+
+import evaluator
+from env import Environment
+from types import Pair, Lambda
+
+class FunctionStats(object):
+    __slots__ = ('name', 'calls', 'inclusive', 'exclusive', 'allocations',
+                 'self_allocations', 'active')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.inclusive = self.exclusive = 0.0
+        self.allocations = self.self_allocations = 0
+        self.active = 0  # calls currently running, to not count recursion twice
+
+class Profiler(object):
+
+    def __init__(self, clock=default_timer):
+        self.clock = clock
+        self.stats = {}
+        self.allocations = 0
+        # running calls, as [stats, start, child time, allocations, child allocations]
+        self.calls = []
+
+    def call(self, fn, run, *args):
+        """Run `run(*args)` as a call to the Lisp function `fn`"""
+        self.enter(fn)
+        try:
+            return run(*args)
+        finally:
+            self.exit()
+
+    def enter(self, fn):
+        name = fn.name or str(fn)
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = FunctionStats(name)
+        stats.calls += 1
+        stats.active += 1
+        self.calls.append([stats, self.clock(), 0.0, self.allocations, 0])
+
+    def tail_call(self, fn, running):
+        """Enter a call to `fn` from the loop in evaluator.evaluate that
+        started with `running` calls. Any call that loop entered before was
+        in tail position, and has thus ended."""
+        if len(self.calls) > running:
+            self.exit()
+        self.enter(fn)
+
+    def exit(self):
+        stats, start, child_time, start_allocations, child_allocations = self.calls.pop()
+        elapsed = self.clock() - start
+        allocations = self.allocations - start_allocations
+        stats.active -= 1
+        if not stats.active:
+            stats.inclusive += elapsed
+            stats.allocations += allocations
+        stats.exclusive += elapsed - child_time
+        stats.self_allocations += allocations - child_allocations
+        if self.calls:
+            caller = self.calls[-1]
+            caller[2] += elapsed
+            caller[4] += allocations
+
+    def report(self, sort='inclusive', limit=None):
+        """The statistics as a table, in descending order of the `sort`
+        column: calls, inclusive, exclusive, allocations or name"""
+        if sort not in sort_keys:
+            raise ValueError("Can't sort by '%s', expected one of: %s"
+                % (sort, ", ".join(sorted(sort_keys))))
+        rows = sorted(self.stats.values(), key=sort_keys[sort], reverse=sort != 'name')
+        lines = ["%-24s %8s %12s %12s %10s %10s" % (
+            "name", "calls", "inclusive", "exclusive", "allocs", "self allocs")]
+        for stats in rows[:limit]:
+            lines.append("%-24s %8d %11.6fs %11.6fs %10d %10d" % (
+                stats.name[:24], stats.calls, stats.inclusive, stats.exclusive,
+                stats.allocations, stats.self_allocations))
+        return "\n".join(lines)
+
+sort_keys = {
+    'name': lambda stats: stats.name,
+    'calls': lambda stats: stats.calls,
+    'inclusive': lambda stats: stats.inclusive,
+    'exclusive': lambda stats: stats.exclusive,
+    'allocations': lambda stats: stats.allocations,
+}
+
+# Allocations are counted by swapping out the constructors of these types
+# while a profiler is enabled, so there is no cost when profiling is off.
+allocated_types = (Pair, Lambda, Environment)
+
+def enable(profiler):
+    """Start profiling the evaluator with `profiler`"""
+    if evaluator.profiler is not None:
+        raise RuntimeError("A profiler is already enabled")
+    for cls in allocated_types:
+        cls.__init__ = _counting(cls.__dict__['__init__'], profiler)
+    evaluator.profiler = profiler
+
+def disable():
+    """Stop profiling"""
+    for cls in allocated_types:
+        cls.__init__ = cls.__dict__['__init__'].original
+    evaluator.profiler = None
+
+@contextmanager
+def profiling(profiler=None):
+    """Context manager profiling the evaluator while it is active"""
+    profiler = profiler or Profiler()
+    enable(profiler)
+    try:
+        yield profiler
+    finally:
+        disable()
+
+def _counting(init, profiler):
+    def __init__(self, *args, **kwargs):
+        profiler.allocations += 1
+        init(self, *args, **kwargs)
+    __init__.original = init
+    return __init__
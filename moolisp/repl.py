@@ -3,15 +3,19 @@
 import sys
 from errors import LispError
 from colors import colored, faded
-from parser import remove_comments
-from interpreter import interpret, default_env
+from parser import parse, write, remove_comments
+from interpreter import default_env, get_engine
 
 # importing this gives readline goodness when running on systems
 # where it is supported (i.e. UNIX-y systems)
 import readline   # noqa
 
-def repl():
-    """Start the interactive Read-Eval-Print-Loop"""
+def repl(engine='eval', max_depth=100, max_length=1000):
+    """Start the interactive Read-Eval-Print-Loop
+
+    Results are printed as they are unparsed. Lists nested more than
+    `max_depth` deep, and elements after the first `max_length` of a
+    list, are left out, so huge values print quickly."""
     print
     print "                       " + faded("    ^__^             ")
     print "          welcome to   " + faded("    (oo)\_______     ")
@@ -22,10 +26,12 @@ def repl():
     print
 
     env = default_env()
+    run = get_engine(engine)
     while True:
         try:
             source = read_expression()
-            print interpret(source, env)
+            write(run(parse(source), env), sys.stdout, max_depth, max_length)
+            print
         except LispError, e:
             print colored("!", "red"),
             print faded(str(e.__class__.__name__) + ":"),
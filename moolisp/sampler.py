@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sampling profiler for Moo Lisp programs run by the tree-walking evaluator.
+
+A timer signal interrupts the program at regular intervals of CPU time,
+and the Lisp call stack at that point is recorded. The result is written
+as folded stacks, one line of semicolon separated frames and a sample
+count per distinct stack, as read by flame graph tools such as
+flamegraph.pl or speedscope.
+
+The Lisp call stack is found by walking the Python stack. Each call to
+moolisp.evaluator.evaluate keeps the lambda it is running in a local
+variable, replaced on tail calls, so there is no bookkeeping to pay for
+while the sampler is not running. Calls to builtins and macro expansions
+show up as the innermost frame.
+
+Uses SIGPROF, so this only works on Unix, in the main thread.
+"""
+
+import signal
+from collections import defaultdict
+
+import evaluator
+from parser import unparse
+
+_evaluate = evaluator.evaluate.__code__
+_apply_builtin = evaluator.apply_builtin.__code__
+_apply_macro = evaluator.apply_macro.__code__
+
+class Sampler(object):
+
+    def __init__(self, rate=100, sites=False):
+        """Sample `rate` times per second of CPU time. If `sites` is set,
+        frames include the call to the lambda, not just its name."""
+        self.interval = 1.0 / rate
+        self.sites = sites
+        self.samples = defaultdict(int)
+        self.previous_handler = None
+
+    def start(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self._handle)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handle(self, signum, frame):
+        self.sample(frame)
+
+    def sample(self, frame):
+        """Record the Lisp call stack of a Python stack frame"""
+        self.samples[tuple(self.lisp_stack(frame))] += 1
+
+    def lisp_stack(self, frame):
+        """The names of the Lisp functions running in a Python stack frame,
+        outermost first"""
+        stack = []
+        inner = None
+        while frame is not None:
+            code = frame.f_code
+            if code is _evaluate:
+                f_locals = frame.f_locals
+                if 'running' in f_locals:
+                    stack.append(self._label(f_locals['running'],
+                                             f_locals['running_site']))
+            elif code is _apply_builtin and inner is not _evaluate:
+                # not still evaluating the arguments
+                stack.append(_name(frame.f_locals['fn']))
+            elif code is _apply_macro:
+                stack.append(_name(frame.f_locals['macro']) + " (expand)")
+            inner = code
+            frame = frame.f_back
+        stack.reverse()
+        return stack or ["<toplevel>"]
+
+    def _label(self, fn, site):
+        label = _name(fn)
+        if self.sites:
+            label += " " + _shorten(unparse(site), 60)
+        return label
+
+    def folded(self):
+        """The samples as folded stacks, one line per distinct stack"""
+        return "".join("%s %d\n" % (";".join(stack), count)
+                       for stack, count in sorted(self.samples.iteritems()))
+
+    def write_folded(self, filename):
+        with open(filename, 'w') as output:
+            output.write(self.folded())
+
+def _name(fn):
+    return (fn.name or str(fn)).replace(';', ':')
+
+def _shorten(text, length):
+    text = text.replace(';', ':')
+    return text if len(text) <= length else text[:length - 3] + "..."
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""
+Evaluation server, keeping a warm interpreter for clients on a Unix socket.
+
+Starting the interpreter costs far more than running a small script: the
+modules are imported, and the prelude is loaded. The server pays this
+once, and then runs the programs its clients send, each in a thread of
+its own.
+
+Messages are JSON objects, each preceded by its length in bytes as a 4
+byte big-endian integer. Clients may send any number of requests over a
+connection, each getting a response before the next is read.
+
+    request:  {"source": "(define x 1) (+ x 1)", "session": "name"}
+    response: {"result": "2"}
+          or: {"error": "LispNamingError", "message": "Variable ..."}
+
+The statements in the source are run in order, and the result is the
+value of the last one, as with interpret_stream. Without a session, each
+request runs in a new environment of its own. Requests naming a session
+share its environment with the earlier requests naming it, and run one
+at a time. Given `limits`, each request is stopped once it exceeds them.
+See moolisp.client for the client side.
+"""
+
+import os
+import sys
+import signal
+import socket
+import threading
+from SocketServer import ThreadingUnixStreamServer, StreamRequestHandler
+from StringIO import StringIO
+
+from client import read_message, write_message
+from interpreter import interpret_stream, default_env, prelude, get_engine
+
+class Server(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, engine='eval', limits=None):
+        self.engine = engine
+        self.limits = limits
+        get_engine(engine)  # fail early on unknown engines
+        self.sessions = {}  # session name to [environment, lock]
+        self.sessions_lock = threading.Lock()
+        ThreadingUnixStreamServer.__init__(self, path, RequestHandler)
+
+    def session(self, name):
+        with self.sessions_lock:
+            if name not in self.sessions:
+                self.sessions[name] = [default_env(), threading.Lock()]
+            return self.sessions[name]
+
+    def evaluate(self, request):
+        """Run the source of a request, returning the response"""
+        try:
+            source = request['source']
+            if isinstance(source, unicode):
+                source = source.encode('utf-8')
+            name = request.get('session')
+            limits = self.limits and self.limits.copy()
+            if name is None:
+                result = interpret_stream(StringIO(source), default_env(), self.engine,
+                                          limits=limits)
+            else:
+                env, lock = self.session(name)
+                with lock:
+                    result = interpret_stream(StringIO(source), env, self.engine,
+                                              limits=limits)
+            return {'result': result}
+        except Exception, e:
+            return {'error': e.__class__.__name__, 'message': str(e)}
+
+class RequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request = read_message(self.rfile)
+            except (EOFError, ValueError):
+                return
+            if request is None:
+                return
+            write_message(self.wfile, self.server.evaluate(request))
+
+def serve(path, engine='eval', limits=None):
+    """Serve requests on a Unix socket at `path`, until interrupted"""
+    _remove_stale_socket(path)
+    prelude()  # loaded once, before the first request
+    # the evaluator recurses, so give the request threads deep stacks
+    threading.stack_size(64 * 1024 * 1024)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+    server = Server(path, engine, limits)
+    # exit cleanly on kill too, so the socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+def _remove_stale_socket(path):
+    "Remove the socket left by a server that is no longer running"
+    if not os.path.exists(path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        os.remove(path)
+    else:
+        raise RuntimeError("A server is already running at %s" % path)
+    finally:
+        sock.close()
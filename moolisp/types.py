@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 
 from inspect import getargspec
+from itertools import izip_longest
 from errors import LispTypeError
 
 ## functions creating and working with types
+#
+# Integers are plain Python ints (or longs) and booleans are the two
+# Boolean singletons below. Any other typed value is represented by a
+# ("type", tag, value) touple. The functions here treat all three alike.
 
 def tag(tag, value):
     """A typed value is represented by a touple of type and value"""
@@ -11,23 +16,42 @@ def tag(tag, value):
 
 def is_type(t):
     """Check whether value is typed"""
-    return isinstance(t, tuple) \
-        and len(t) == 3 \
-        and t[0] == "type"
+    return is_integer(t) \
+        or is_boolean(t) \
+        or (isinstance(t, tuple) and len(t) == 3 and t[0] == "type")
 
 def type_of(x):
     """Get type from a typed value"""
-    if not is_type(x):
+    if is_integer(x):
+        return 'int'
+    elif is_boolean(x):
+        return 'bool'
+    elif not is_type(x):
         raise LispTypeError("Type of non-type: %s" % x)
     return x[1]
 
 def value_of(x):
     """Get value of a typed value"""
-    if not is_type(x):
+    if type(x) is int or type(x) is long:
+        return x
+    elif x is TRUE or x is FALSE:
+        return x.value
+    elif not is_type(x):
         raise LispTypeError("Value of non-type: %s" % x)
     return x[2]
 
 ## 'special' types
+#
+# Symbols are plain strs, interned by the reader with `symbol`. There is
+# thus a single object per name, however often it occurs in the code.
+# Python caches the hash of a str, and dicts and sets compare keys by
+# identity before equality, so looking up an interned symbol in an
+# environment or a table of special forms never compares characters.
+# Names used as string literals in Python code are interned too.
+
+def symbol(name):
+    "The unique symbol object for the name"
+    return intern(name)
 
 def is_symbol(x):
     return isinstance(x, str)
@@ -42,21 +66,119 @@ def is_atom(x):
         or is_closure(x) \
         or is_macro(x)
 
+## lists
+#
+# Lists built at runtime, by cons and list, are chains of immutable Pairs
+# ending with the empty list []. Quoted lists are converted to Pairs when
+# the program is read. Code is always represented by Python lists, so
+# Pairs evaluated as code are converted back with `to_list`.
+
+class Pair(object):
+    "An immutable cons cell. Compares equal to lists with the same elements."
+    __slots__ = ('car', 'cdr')
+
+    def __init__(self, car, cdr):
+        self.car = car
+        self.cdr = cdr
+
+    def __iter__(self):
+        rest = self
+        while isinstance(rest, Pair):
+            yield rest.car
+            rest = rest.cdr
+        for x in rest:
+            yield x
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __nonzero__(self):
+        return True
+
+    def __eq__(self, other):
+        if self is other:
+            return True  # such as lists shared by moolisp.parser.SharedData
+        if not isinstance(other, (Pair, list)):
+            return NotImplemented
+        missing = object()
+        return all(x == y for x, y in izip_longest(self, other, fillvalue=missing))
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # pickled as a list of elements, so long lists don't recurse deeply
+        return (_pairs, (list(self),))
+
+    def __repr__(self):
+        return "Pair(%r)" % list(self)
+
+def _pairs(items):
+    result = []
+    for x in reversed(items):
+        result = Pair(x, result)
+    return result
+
+def is_pair(x):
+    return isinstance(x, Pair)
+
+def from_list(lst):
+    "Convert a Python list to Pairs, including any nested lists"
+    result = []
+    for x in reversed(lst):
+        result = Pair(from_list(x) if isinstance(x, list) else x, result)
+    return result
+
+def to_list(lst):
+    "Convert Pairs to a Python list, including any nested Pairs"
+    return [to_list(x) if isinstance(x, (Pair, list)) else x for x in lst]
+
+def hashable(x):
+    """A hashable key for a value, such that equal values have equal keys.
+
+    Lists and Pairs with the same elements give the same key, a tuple
+    marked as a list so it can't be mistaken for a typed value."""
+    if isinstance(x, (Pair, list)):
+        return (list,) + tuple(hashable(y) for y in x)
+    elif type(x) is tuple:
+        return tuple(hashable(y) for y in x)
+    return x
+
 ## booleans
 
+class Boolean(object):
+    "The type of the two boolean values, TRUE and FALSE"
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __reduce__(self):
+        # unpickle to the existing singletons, so identity checks hold
+        return (boolean, (self.value,))
+
+    def __repr__(self):
+        return "#t" if self.value else "#f"
+
+TRUE = Boolean(True)
+FALSE = Boolean(False)
+
 def boolean(x):
-    return tag('bool', x)
+    return TRUE if x else FALSE
     
 def is_boolean(x):
-    return is_type(x) and type_of(x) == 'bool'
+    return x is TRUE or x is FALSE
 
 ## integers
 
 def integer(x):
-    return tag('int', x)
+    return x
 
 def is_integer(x):
-    return is_type(x) and type_of(x) == 'int'
+    return type(x) is int or type(x) is long
 
 ## function helper classes
 
@@ -73,13 +195,16 @@ def is_builtin(x):
     return isinstance(x, Builtin)
 
 
-class Closure:
+class Closure(object):
     "Abstract base type for builtins and lambdas"
-    pass
+    __slots__ = ()
 
 class Builtin(Closure):
-    def __init__(self, fn):
+    __slots__ = ('fn', 'name')
+
+    def __init__(self, fn, name=None):
         self.fn = fn
+        self.name = name
 
     def __str__(self):
         argspec = getargspec(self.fn)
@@ -88,18 +213,52 @@ class Builtin(Closure):
         return "<builtin/%d%s>" % (nargs, is_vararg)
 
 class Lambda(Closure):
-    def __init__(self, params, body, env):
+    __slots__ = ('params', 'body', 'env', 'compiled', 'code', 'name', 'engine')
+
+    def __init__(self, params, body, env, engine='eval'):
         self.params = params
         self.body = body
         self.env = env
+        self.name = None
+        self.engine = engine  # name of the engine that made it, see moolisp.memo
+        self.compiled = None  # body as analyzed by moolisp.analyzer
+        self.code = None  # body as compiled by moolisp.vm
+
+    def __reduce__(self):
+        # the analyzed and compiled bodies can't be pickled, and are
+        # rebuilt when needed; the environment goes in the state, since
+        # it may refer back to the lambda
+        return (Lambda, (self.params, self.body, None, self.engine),
+                (self.env, self.name))
+
+    def __setstate__(self, state):
+        self.env, self.name = state
 
     def __str__(self):
         return "<lambda/%d>" % len(self.params)
 
-class Macro:
+class Macro(object):
+    __slots__ = ('params', 'body', 'compiled', 'code', 'name')
+
     def __init__(self, params, body):
         self.params = params
         self.body = body
+        self.name = None
+        self.compiled = None  # body as analyzed by moolisp.analyzer
+        self.code = None  # body as compiled by moolisp.vm
+
+    def __reduce__(self):
+        return (Macro, (self.params, self.body), self.name)
+
+    def __setstate__(self, name):
+        self.name = name
 
     def __str__(self):
         return "<macro/%d>" % len(self.params)
+
+def named(value, name):
+    """Name a lambda, macro or unnamed builtin (such as a memoized lambda)
+    after the variable it is first defined as"""
+    if type(value) in (Lambda, Macro, Builtin) and value.name is None:
+        value.name = name
+    return value
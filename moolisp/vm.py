@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+
+"""
+A compiler from ASTs to bytecode, and the virtual machine running it.
+
+Expressions are compiled into Code objects: flat lists of (opcode,
+argument) instructions for a stack machine. The bodies of lambdas and
+let forms, macro expansions, and forms passed to eval each get a Code
+object of their own. Variables are resolved ahead of time using the same
+Scope and Frame layout as moolisp.analyzer.
+
+The machine runs one Code object at a time. Calling a lambda saves the
+current position on a stack of continuations, then jumps to the start of
+the lambda body, so Lisp calls never recurse in Python. Calls in tail
+position replace the current code instead, and run in constant space.
+
+Like with the analyzer, syntax errors found while compiling are raised
+when the offending expression is run, not when it is compiled.
+"""
+
+from errors import LispError, LispSyntaxError, LispTypeError
+from env import Environment, Frame, Scope, UNBOUND, GlobalCache, assign
+from env import global_cache_stats
+from types import Lambda, Builtin, Macro, named
+from types import TRUE, FALSE, boolean, is_atom, is_symbol, is_list
+from types import is_pair, to_list
+from parser import unparse
+from limits import enforced
+from evaluator import expansion_cache, _is_macro_call
+from evaluator import _assert_exp_length, _assert_valid_definition, _assert_boolean
+from analyzer import _defined_variables
+
+opnames = [
+    'CONST',         # push the argument
+    'NAME',          # push the variable named by the argument
+    'GLOBAL',        # push a variable not allocated in any scope, cached by GlobalCache
+    'LOCAL',         # push the parameter with the given index
+    'DEREF',         # push the variable at (depth, index, name)
+    'SET_LOCAL',     # assign to parameter (index, name), replacing the value by name
+    'SET',           # assign by name, replacing the value on the stack by the name
+    'DEFINE_LOCAL',  # define variable (index, name) in the current frame
+    'DEFINE',        # define by name in the current environment
+    'POP',           # discard the top of the stack
+    'JUMP',          # continue at the given instruction
+    'TEST',          # pop a condition, jump to (target, ...) if it is false
+    'CHECK',         # check the called function, expanding calls to macros
+    'CALL',          # call the function below the given number of arguments
+    'TAIL_CALL',     # like CALL, but replacing the current code
+    'LET',           # run (scope, body, nvalues) in a new frame
+    'TAIL_LET',      # like LET, but replacing the current code
+    'EVAL',          # compile and run the form on the stack
+    'TAIL_EVAL',     # like EVAL, but replacing the current code
+    'EXPAND',        # expand the form on the stack, once if argument is set
+    'LAMBDA',        # create a lambda from (params, body, compiled body)
+    'MACRO',         # create a macro from (params, body)
+    'ATOM',          # replace the value on the stack by whether it is an atom
+    'EQ',            # pop two values, and push whether they are equal atoms
+    'BUILD_LIST',    # pop the given number of values, and push them as a list
+    'RAISE',         # raise the error given as argument
+    'RETURN',        # return the value on the stack from the current code
+]
+
+(CONST, NAME, GLOBAL, LOCAL, DEREF, SET_LOCAL, SET, DEFINE_LOCAL, DEFINE, POP,
+ JUMP, TEST, CHECK, CALL, TAIL_CALL, LET, TAIL_LET, EVAL, TAIL_EVAL, EXPAND,
+ LAMBDA, MACRO, ATOM, EQ, BUILD_LIST, RAISE, RETURN) = range(len(opnames))
+
+def execute(ast, env):
+    """Compile an AST, then run it in the specified environment."""
+    return run(compile_ast(ast), env)
+
+class Code(object):
+    "A compiled expression, as a list of (opcode, argument) instructions"
+    __slots__ = ('instructions',)
+
+    def __init__(self, instructions):
+        self.instructions = instructions
+
+    def __str__(self):
+        return "\n".join("%4d %-12s %s" % (i, opnames[op], "" if arg is None else arg)
+                         for i, (op, arg) in enumerate(self.instructions))
+
+class CallSite(object):
+    """A compiled call, with the expansion of the macro last called there
+
+    Macro calls are recognized at run time, since any expression may
+    evaluate to a macro. See moolisp.evaluator.ExpansionCache."""
+    __slots__ = ('ast', 'scope', 'tail', 'nargs', 'resume', 'macro', 'code')
+
+    def __init__(self, ast, scope, tail):
+        self.ast = ast
+        self.scope = scope
+        self.tail = tail
+        self.nargs = len(ast) - 1
+        self.resume = None  # where to continue after the call
+        self.macro = self.code = None
+
+    def __repr__(self):
+        return unparse(self.ast)
+
+## Compiler
+
+def compile_ast(ast, scope=None):
+    """Compile an Abstract Syntax Tree into a Code object.
+
+    The code must be run in a Frame laid out by `scope`, or in any
+    environment if the scope is None."""
+    instructions = []
+    _compile(ast, scope, True, instructions)
+    return Code(instructions)
+
+def _compile(ast, scope, tail, out):
+    "Append instructions for an expression, which returns if in tail position"
+    start = len(out)
+    try:
+        _compile_expression(ast, scope, tail, out)
+    except LispError, e:
+        del out[start:]
+        out.append((RAISE, e))
+
+def _compile_expression(ast, scope, tail, out):
+    if is_symbol(ast):
+        compile_variable(ast, scope, out)
+    elif is_atom(ast):
+        out.append((CONST, ast))
+    elif is_list(ast):
+        if not ast:
+            raise LispSyntaxError("Call to empty list: ()")
+        elif is_symbol(ast[0]) and ast[0] in special_forms:
+            special_forms[ast[0]](ast, scope, tail, out)
+            if ast[0] in tail_forms:
+                return
+        else:
+            return compile_call(ast, scope, tail, out)
+    elif is_pair(ast):
+        return _compile_expression(to_list(ast), scope, tail, out)
+    else:
+        raise LispSyntaxError(ast)
+
+    if tail:
+        out.append((RETURN, None))
+
+def compile_variable(name, scope, out):
+    address = scope.resolve(name) if scope is not None else None
+    if scope is None:
+        out.append((NAME, name))
+    elif address is None:
+        out.append((GLOBAL, GlobalCache(name)))
+    elif address[0] == 0 and scope.is_param(address[1]):
+        out.append((LOCAL, address[1]))
+    else:
+        out.append((DEREF, address + (name,)))
+
+def compile_call(ast, scope, tail, out):
+    site = CallSite(ast, scope, tail)
+    _compile(ast[0], scope, False, out)
+    out.append((CHECK, site))
+    for exp in ast[1:]:
+        _compile(exp, scope, False, out)
+    out.append((TAIL_CALL if tail else CALL, site.nargs))
+    site.resume = len(out)
+    if tail:
+        out.append((RETURN, None))  # reached after calls to builtins only
+
+def compiled_lambda(fn):
+    """The scope and compiled body of a lambda.
+
+    Lambdas made by the other engines are compiled the first time they
+    are called from the virtual machine."""
+    if fn.code is None:
+        fn_scope = Scope(fn.params, _defined_variables(fn.body))
+        fn.code = fn_scope, compile_ast(fn.body, fn_scope).instructions
+    return fn.code
+
+def call_lambda(fn, args):
+    "Run a lambda on already evaluated arguments, returning its value"
+    fn_scope, body = compiled_lambda(fn)
+    return _run(body, Frame(fn_scope, args + fn_scope.padding, fn.env))
+
+def compiled_macro(macro):
+    "The compiled body of a macro, compiled on first use"
+    if macro.code is None:
+        macro.code = compile_ast(macro.body).instructions
+    return macro.code
+
+def expand_once(form, env):
+    """expand macro form once, see moolisp.evaluator.expand_once"""
+    if is_pair(form):
+        form = to_list(form)
+    macro = execute(form[0], env)
+    return expand_call(macro, form, env)
+
+def expand_call(macro, form, env):
+    "expand a call to the given macro"
+    substitutions = Environment(zip(macro.params, form[1:]), env)
+    expansion = _run(compiled_macro(macro), substitutions)
+    return to_list(expansion) if is_pair(expansion) else expansion
+
+## Special forms
+
+def compile_atom(ast, scope, tail, out):
+    _compile(ast[1], scope, False, out)
+    out.append((ATOM, None))
+
+def compile_eq(ast, scope, tail, out):
+    _assert_exp_length(ast, 3)
+    _compile(ast[1], scope, False, out)
+    _compile(ast[2], scope, False, out)
+    out.append((EQ, None))
+
+def compile_macro(ast, scope, tail, out):
+    (_, params, body) = ast
+    out.append((MACRO, (params, body)))
+
+def compile_expand_1(ast, scope, tail, out):
+    _compile(ast[1], scope, False, out)
+    out.append((EXPAND, True))
+
+def compile_expand(ast, scope, tail, out):
+    _compile(ast[1], scope, False, out)
+    out.append((EXPAND, False))
+
+def compile_cond(ast, scope, tail, out):
+    jumps = []
+    for predicate, exp in ast[1:]:
+        _compile(predicate, scope, False, out)
+        test = len(out)
+        out.append(None)  # TEST, once the start of the next clause is known
+        _compile(exp, scope, tail, out)
+        if not tail:
+            jumps.append(len(out))
+            out.append(None)  # JUMP to the end
+        out[test] = (TEST, (len(out), predicate))
+    out.append((CONST, None))  # no clause matched
+    if tail:
+        out.append((RETURN, None))
+    for jump in jumps:
+        out[jump] = (JUMP, len(out))
+
+def compile_let(ast, scope, tail, out):
+    _assert_exp_length(ast, 3)
+    for d in ast[1]:
+        _assert_valid_definition(d)
+    for d in ast[1]:
+        _compile(d[1], scope, False, out)
+    let_scope = Scope([d[0] for d in ast[1]], _defined_variables(ast[2]), scope)
+    body = compile_ast(ast[2], let_scope).instructions
+    out.append((TAIL_LET if tail else LET, (let_scope, body, len(ast[1]))))
+
+def compile_eval(ast, scope, tail, out):
+    _assert_exp_length(ast, 2)
+    _compile(ast[1], scope, False, out)
+    out.append((TAIL_EVAL if tail else EVAL, None))
+
+def compile_set(ast, scope, tail, out):
+    _assert_exp_length(ast, 3)
+    (_, var, exp) = ast
+    _compile(exp, scope, False, out)
+    address = scope.resolve(var) if scope is not None else None
+    if address is not None and address[0] == 0 and scope.is_param(address[1]):
+        out.append((SET_LOCAL, (address[1], var)))
+    else:
+        out.append((SET, var))
+
+def compile_quote(ast, scope, tail, out):
+    _assert_exp_length(ast, 2)
+    out.append((CONST, ast[1]))
+
+def compile_quasiquote(ast, scope, tail, out):
+    _assert_exp_length(ast, 2)
+    _compile_template(ast[1], scope, out)
+
+def _compile_template(template, scope, out):
+    if not isinstance(template, list):
+        out.append((CONST, template))
+    elif template and template[0] == "unquote":
+        _assert_exp_length(template, 2)
+        _compile(template[1], scope, False, out)
+    else:
+        for exp in template:
+            _compile_template(exp, scope, out)
+        out.append((BUILD_LIST, len(template)))
+
+def compile_lambda(ast, scope, tail, out):
+    _assert_exp_length(ast, 3)
+    (_, params, body) = ast
+    fn_scope = Scope(params, _defined_variables(body), scope)
+    compiled = fn_scope, compile_ast(body, fn_scope).instructions
+    out.append((LAMBDA, (params, body, compiled)))
+
+def compile_begin(ast, scope, tail, out):
+    if len(ast[1:]) == 0:
+        raise LispSyntaxError("begin cannot be empty: %s" % unparse(ast))
+    for exp in ast[1:-1]:
+        _compile(exp, scope, False, out)
+        out.append((POP, None))
+    _compile(ast[-1], scope, tail, out)
+
+def compile_define(ast, scope, tail, out):
+    _assert_valid_definition(ast[1:])
+    var = ast[1]
+    _compile(ast[2], scope, False, out)
+    if scope is not None and var in scope.index:
+        out.append((DEFINE_LOCAL, (scope.index[var], var)))
+    else:
+        out.append((DEFINE, var))
+
+special_forms = {
+    'atom': compile_atom,
+    'eq': compile_eq,
+    'macro': compile_macro,
+    'expand': compile_expand,
+    'expand-1': compile_expand_1,
+    'cond': compile_cond,
+    'let': compile_let,
+    'eval': compile_eval,
+    'set!': compile_set,
+    'quote': compile_quote,
+    'quasiquote': compile_quasiquote,
+    'lambda': compile_lambda,
+    'λ': compile_lambda,
+    'begin': compile_begin,
+    'define': compile_define,
+}
+
+# forms compiling their own instructions for returning in tail position
+tail_forms = frozenset(['cond', 'let', 'eval', 'begin'])
+
+## Virtual machine
+
+def run(code, env):
+    """Run a Code object in the specified environment, returning its value"""
+    return _run(code.instructions, env)
+
+# The most frequent opcodes, and the names used while running them, are
+# bound as default arguments: local variables are faster to look up.
+def _run(instructions, env,
+         LOCAL=LOCAL, CONST=CONST, GLOBAL=GLOBAL, CHECK=CHECK, CALL=CALL,
+         TAIL_CALL=TAIL_CALL, RETURN=RETURN, TEST=TEST, JUMP=JUMP, DEREF=DEREF,
+         Frame=Frame, Lambda=Lambda, TRUE=TRUE, FALSE=FALSE, enforced=enforced,
+         global_cache_stats=global_cache_stats):
+    stack = []
+    push = stack.append
+    frames = []  # continuations, as (instructions, pc, env) to return to
+    pc = 0
+    while True:
+        op, arg = instructions[pc]
+        pc += 1
+
+        if op == LOCAL:
+            push(env.values[arg])
+        elif op == CONST:
+            push(arg)
+        elif op == GLOBAL:
+            if env.scope.shadowed:
+                push(env[arg.name])
+            else:
+                globals_, version, value = arg.entry
+                if globals_ is env.globals and version == arg.changes.version:
+                    global_cache_stats.hits += 1
+                    push(value)
+                else:
+                    push(arg.lookup(env.globals))
+        elif op == CHECK:
+            if enforced.limits is not None:
+                enforced.limits.step()
+            fn = stack[-1]
+            fn_type = type(fn)
+            if fn_type is Lambda:
+                if len(fn.params) != arg.nargs:
+                    msg = "Wrong number of arguments, expected %d got %d: %s" \
+                        % (len(fn.params), arg.nargs, unparse(arg.ast))
+                    raise LispTypeError(msg)
+            elif fn_type is Macro:
+                stack.pop()
+                if arg.macro is fn:
+                    expansion_cache.hits += 1
+                else:
+                    if arg.macro is not None:
+                        expansion_cache.invalidations += 1
+                    expansion_cache.misses += 1
+                    expanded_form = expand_call(fn, arg.ast, env)
+                    arg.macro = fn
+                    arg.code = compile_ast(expanded_form, arg.scope).instructions
+                if not arg.tail:
+                    frames.append((instructions, arg.resume, env))
+                instructions, pc = arg.code, 0
+            elif fn_type is not Builtin:
+                raise LispTypeError("Call to: " + unparse(arg.ast[0]))
+        elif op == CALL or op == TAIL_CALL:
+            if arg:
+                args = stack[-arg:]
+                del stack[-arg:]
+            else:
+                args = []
+            fn = stack.pop()
+            if type(fn) is Lambda:
+                fn_scope, body = fn.code or compiled_lambda(fn)
+                if fn_scope.padding:
+                    args.extend(fn_scope.padding)
+                if op == CALL:
+                    frames.append((instructions, pc, env))
+                instructions, pc, env = body, 0, Frame(fn_scope, args, fn.env)
+            else:
+                push(fn.fn(*args))
+        elif op == RETURN:
+            if not frames:
+                return stack.pop()
+            instructions, pc, env = frames.pop()
+        elif op == TEST:
+            p = stack.pop()
+            if p is FALSE:
+                pc = arg[0]
+            elif p is not TRUE:
+                _assert_boolean(p, arg[1])
+        elif op == JUMP:
+            pc = arg
+        elif op == DEREF:
+            depth, index, name = arg
+            if env.scope.shadowed:
+                value = env[name]
+            else:
+                frame = env
+                for _ in xrange(depth):
+                    frame = frame.outer
+                value = frame.values[index]
+                if value is UNBOUND:
+                    value = env[name]
+            push(value)
+        elif op == NAME:
+            push(env[arg])
+        elif op == POP:
+            stack.pop()
+        elif op == LET or op == TAIL_LET:
+            let_scope, body, nvalues = arg
+            if nvalues:
+                values = stack[-nvalues:]
+                del stack[-nvalues:]
+            else:
+                values = []
+            if let_scope.padding:
+                values.extend(let_scope.padding)
+            if op == LET:
+                frames.append((instructions, pc, env))
+            instructions, pc, env = body, 0, Frame(let_scope, values, env)
+        elif op == EVAL or op == TAIL_EVAL:
+            if enforced.limits is not None:
+                enforced.limits.step()
+            body = compile_ast(stack.pop()).instructions
+            if op == EVAL:
+                frames.append((instructions, pc, env))
+            instructions, pc = body, 0
+        elif op == SET_LOCAL:
+            env.values[arg[0]] = stack[-1]
+            stack[-1] = arg[1]
+        elif op == SET:
+            assign(env, arg, stack[-1])
+            stack[-1] = arg
+        elif op == DEFINE_LOCAL:
+            env.values[arg[0]] = named(stack[-1], arg[1])
+            stack[-1] = arg[1]
+        elif op == DEFINE:
+            env[arg] = named(stack[-1], arg)
+            stack[-1] = arg
+        elif op == LAMBDA:
+            params, body, compiled = arg
+            fn = Lambda(params, body, env, 'vm')
+            fn.code = compiled
+            push(fn)
+        elif op == MACRO:
+            push(Macro(*arg))
+        elif op == ATOM:
+            stack[-1] = boolean(is_atom(stack[-1]))
+        elif op == EQ:
+            v2 = stack.pop()
+            v1 = stack[-1]
+            stack[-1] = TRUE if v1 == v2 and is_atom(v1) else FALSE
+        elif op == BUILD_LIST:
+            if arg:
+                items = stack[-arg:]
+                del stack[-arg:]
+            else:
+                items = []
+            push(items)
+        elif op == EXPAND:
+            form = stack[-1]
+            if arg:
+                if _is_macro_call(form, env):
+                    form = expand_once(form, env)
+            else:
+                while _is_macro_call(form, env):
+                    form = expand_once(form, env)
+            stack[-1] = form
+        elif op == RAISE:
+            raise arg
+        else:
+            raise ValueError("Unknown opcode: %r" % op)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from os.path import join
+from mock import patch
+
+_dir = _env_patch = None
+
+def setup_package():
+    "Keep what the tests cache out of the user's cache directory"
+    global _dir, _env_patch
+    _dir = tempfile.mkdtemp()
+    _env_patch = patch.dict(os.environ, {'MOOLISP_CACHE': join(_dir, 'cache')})
+    _env_patch.start()
+
+def teardown_package():
+    _env_patch.stop()
+    shutil.rmtree(_dir)
+
+def engine_mixin(execute):
+    """A mixin class running a test class with `execute` as the default
+    engine, in place of the tree-walking evaluator"""
+    import test_eval
+    import test_macros
+    from moolisp import interpreter
+
+    class EngineMixin(object):
+
+        def setup(self):
+            self.patches = [
+                patch.dict(interpreter.engines, {'eval': execute}),
+                patch.object(test_eval, 'evaluate', execute),
+                patch.object(test_macros, 'evaluate', execute)]
+            for p in self.patches:
+                p.start()
+            base_setup = getattr(super(EngineMixin, self), 'setup', None)
+            if base_setup is not None:
+                base_setup()
+
+        def teardown(self):
+            for p in self.patches:
+                p.stop()
+
+    return EngineMixin
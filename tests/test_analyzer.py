@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the analyzing backend in moolisp.analyzer.
+
+The analyzer must behave exactly like the tree-walking evaluator, so
+most of the existing suites are run again with the analyzer swapped in.
+"""
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is
+
+import test_eval
+import test_core
+import test_lisp
+import test_macros
+import test_builtins
+from tests import engine_mixin
+from moolisp.analyzer import analyze, execute
+from moolisp.evaluator import evaluate
+from moolisp.interpreter import interpret, default_env
+from moolisp.parser import parse
+from moolisp.env import Environment
+from moolisp.errors import LispSyntaxError
+from moolisp.types import integer
+
+# Runs a test class with the analyzer as the default engine
+AnalyzerEngine = engine_mixin(execute)
+
+class TestAnalyzerEval(AnalyzerEngine, test_eval.TestEval, object):
+    pass
+
+class TestAnalyzerCore(AnalyzerEngine, test_core.TestDefaultEnvironment, object):
+    pass
+
+class TestAnalyzerLisp(AnalyzerEngine, test_lisp.TestMooLisp, object):
+    pass
+
+class TestAnalyzerMacros(AnalyzerEngine, test_macros.TestMacros, object):
+    pass
+
+class TestAnalyzerBuiltins(AnalyzerEngine, test_builtins.TestBuiltins, object):
+    pass
+
+class TestAnalyzer:
+
+    def test_analyze_returns_reusable_closure(self):
+        env = Environment({"x": integer(1)})
+        run = analyze(parse("(cond ((eq x 1) 'one) (#t 'other))"))
+        assert_equals("one", run(env))
+        env["x"] = integer(2)
+        assert_equals("other", run(env))
+
+    def test_syntax_errors_are_raised_when_run(self):
+        """Like with the evaluator, a malformed lambda body is only
+        reported once the lambda is called"""
+
+        env = Environment()
+        execute(parse("(define f (lambda () (begin)))"), env)
+        with assert_raises_regexp(LispSyntaxError, "begin cannot be empty"):
+            execute(parse("(f)"), env)
+
+    def test_lambda_body_is_analyzed_once(self):
+        env = Environment()
+        fn = execute(parse("(lambda (x) x)"), env)
+        body = fn.compiled
+        execute([fn, integer(1)], env)
+        assert_is(body, fn.compiled)
+
+    def test_calling_lambda_made_by_evaluator(self):
+        """Closures from the evaluator, like those in the core library,
+        can be called from analyzed code"""
+
+        env = default_env()
+        evaluate(parse("(define inc (lambda (x) (+ x 1)))"), env)
+        assert_equals(integer(42), execute(parse("(inc 41)"), env))
+
+    def test_select_engine_in_interpret(self):
+        assert_equals("120", interpret("""
+            ((lambda (fact) (fact fact 5))
+             (lambda (self n) (if (<= n 1) 1 (* n (self self (- n 1))))))
+        """, engine='analyze'))
+
+    def test_unknown_engine(self):
+        with assert_raises_regexp(ValueError, "Unknown engine 'foo'"):
+            interpret("42", engine='foo')
+
+class TestLexicalAddressing:
+    "Variables resolved to frame slots ahead of time, by the given engine"
+
+    engine = 'analyze'
+
+    def test_nested_closures(self):
+        env = default_env()
+        interpret("""
+            (define make-counter
+                (lambda (start)
+                    (let ((count start))
+                        (lambda (step)
+                            (begin
+                                (set! count (+ count step))
+                                count)))))
+        """, env, self.engine)
+        interpret("(define c (make-counter 10))", env, self.engine)
+        interpret("(c 1)", env, self.engine)
+        assert_equals("15", interpret("(c 4)", env, self.engine))
+
+    def test_defines_in_body_are_visible_to_earlier_closures(self):
+        env = default_env()
+        interpret("""
+            (define f
+                (lambda (x)
+                    (begin
+                        (define get-y (lambda () y))
+                        (define y (+ x 1))
+                        (get-y))))
+        """, env, self.engine)
+        assert_equals("42", interpret("(f 41)", env, self.engine))
+
+    def test_unbound_body_definition_falls_back_to_outer_variable(self):
+        env = default_env()
+        interpret("(define y 'global)", env, self.engine)
+        interpret("""
+            (define f
+                (lambda (flag)
+                    (begin
+                        (cond (flag (define y 'local)) (#t 'skip))
+                        y)))
+        """, env, self.engine)
+        assert_equals("global", interpret("(f #f)", env, self.engine))
+        assert_equals("local", interpret("(f #t)", env, self.engine))
+
+    def test_eval_sees_local_variables(self):
+        env = default_env()
+        interpret("(define f (lambda (x) (let ((y 2)) (eval '(+ x y)))))", env,
+            self.engine)
+        assert_equals("42", interpret("(f 40)", env, self.engine))
+
+    def test_definitions_made_at_runtime_shadow_outer_variables(self):
+        env = default_env()
+        interpret("(define x 'global)", env, self.engine)
+        interpret("""
+            (define f
+                (lambda ()
+                    (let ((unused 1))
+                        (begin
+                            (eval '(define x 'local))
+                            x))))
+        """, env, self.engine)
+        assert_equals("local", interpret("(f)", env, self.engine))
+        assert_equals("global", interpret("x", env, self.engine))
+
+    def test_only_scopes_with_definitions_made_at_runtime_are_shadowed(self):
+        env = default_env()
+        interpret("""
+            (define f
+                (lambda (x)
+                    (begin
+                        (eval '(define y 1))
+                        (lambda () (+ x y)))))
+        """, env, self.engine)
+        interpret("(define g (lambda (x) (lambda () x)))", env, self.engine)
+        assert_equals("2", interpret("((f 1))", env, self.engine))
+        assert_equals("3", interpret("((g 3))", env, self.engine))
+        f_scope, g_scope = self.scope(env['f']), self.scope(env['g'])
+        assert f_scope.shadowed and f_scope.inner[0].shadowed
+        assert not g_scope.shadowed and not g_scope.inner[0].shadowed
+
+    def scope(self, fn):
+        return (fn.code if self.engine == 'vm' else fn.compiled)[0]
+
+    def test_definitions_from_macro_expansion_in_body(self):
+        env = default_env()
+        interpret("(define defconst (macro (name value) `(define ,name ,value)))",
+            env, self.engine)
+        interpret("""
+            (define f
+                (lambda (x)
+                    (begin
+                        (defconst y 2)
+                        (* x y))))
+        """, env, self.engine)
+        assert_equals("42", interpret("(f 21)", env, self.engine))
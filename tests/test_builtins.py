@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from nose.tools import assert_equals
+from nose.tools import assert_equals, assert_is, assert_raises
 
 from moolisp.interpreter import interpret
 from moolisp.env import get_builtin_env
+from moolisp.errors import LispTypeError
 
 class TestBuiltins:
 
@@ -50,3 +51,18 @@ class TestBuiltins:
         assert_equals("1", interpret("(car lst)", self.env))
         assert_equals("2", interpret("(car (cdr lst))", self.env))
         assert_equals("(3 4 5)", interpret("(cdr (cdr lst))", self.env))
+
+    def test_cdr_returns_nil_at_end_of_list(self):
+        assert_equals("nil", interpret("(cdr (list 1))", self.env))
+        assert_equals("(0)", interpret("(cons 0 (cdr '(1)))", self.env))
+
+    def test_cons_shares_structure(self):
+        interpret("(define lst '(2 3))", self.env)
+        interpret("(define a (cons 1 lst))", self.env)
+        assert_is(self.env['lst'], self.env['a'].cdr)
+        assert_equals("(1 2 3)", interpret("a", self.env))
+        assert_equals("(2 3)", interpret("lst", self.env))
+
+    def test_cons_onto_non_list(self):
+        with assert_raises(LispTypeError):
+            interpret("(cons 1 2)", self.env)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import cPickle as pickle
+from os.path import join
+from mock import patch
+from nose.tools import assert_equals, assert_raises, assert_is, assert_in
+
+from moolisp import cache, parser
+from moolisp.cache import parse_cached, cache_key
+from moolisp.interpreter import interpret_file
+from moolisp.env import get_builtin_env
+from moolisp.errors import LispSyntaxError
+from moolisp.types import Pair
+
+PROGRAM = "(define xs '(1 (2 3) #t)) ; comment\n (cons 0 xs)"
+
+class TestCache:
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = join(self.dir, 'cache')
+        self.env_patch = patch.dict(os.environ, {'MOOLISP_CACHE': self.cache_dir})
+        self.env_patch.start()
+
+    def teardown(self):
+        self.env_patch.stop()
+        shutil.rmtree(self.dir)
+
+    def test_cached_forms_skip_the_parser(self):
+        forms = parse_cached(PROGRAM)
+        assert_equals(parser.parse_multiple(PROGRAM), forms)
+        with patch.object(parser, 'parse_multiple') as parse_multiple:
+            assert_equals(forms, parse_cached(PROGRAM))
+            assert_equals(0, parse_multiple.call_count)
+
+    def test_pairs_survive_the_cache(self):
+        parse_cached("'(1 2 3)")
+        quoted = parse_cached("'(1 2 3)")[0][1]
+        assert_is(Pair, type(quoted))
+        assert_equals([1, 2, 3], quoted)
+
+    def test_cached_symbols_are_interned(self):
+        parse_cached("(define foo '(foo))")
+        define, foo, quoted = parse_cached("(define foo '(foo))")[0]
+        assert_is(parser.parse('foo'), foo)
+        assert_is(foo, quoted[1].car)
+
+    def test_key_depends_on_source(self):
+        assert_equals(cache_key(PROGRAM), cache_key(PROGRAM))
+        assert cache_key(PROGRAM) != cache_key(PROGRAM + " ")
+
+    def test_shared_forms_are_cached_apart(self):
+        assert cache_key(PROGRAM) != cache_key(PROGRAM, shared=True)
+        parse_cached(PROGRAM)
+        parse_cached(PROGRAM, parser.SharedData())
+        assert_equals(2, len(os.listdir(self.cache_dir)))
+
+    def test_cached_data_is_shared(self):
+        source = "'((1 2) (1 2)) '(1 2)"
+        parse_cached(source, parser.SharedData())
+        first, second = parse_cached(source, parser.SharedData())
+        assert_is(first[1].car, first[1].cdr.car)
+        assert_is(first[1].car, second[1])
+
+    def test_corrupt_entries_are_parsed_again(self):
+        parse_cached(PROGRAM)
+        with open(join(self.cache_dir, cache_key(PROGRAM) + '.pickle'), 'wb') as f:
+            f.write("garbage")
+        assert_equals(parser.parse_multiple(PROGRAM), parse_cached(PROGRAM))
+
+    def test_cache_can_be_turned_off(self):
+        os.environ['MOOLISP_CACHE'] = ''
+        assert_is(None, cache.cache_dir())
+        parse_cached(PROGRAM)
+        assert_equals([], os.listdir(self.dir))
+
+    def test_unwritable_cache_is_ignored(self):
+        os.environ['MOOLISP_CACHE'] = join(self.dir, 'file', 'cache')
+        open(join(self.dir, 'file'), 'w').close()
+        assert_equals(parser.parse_multiple(PROGRAM), parse_cached(PROGRAM))
+
+    def test_cache_directory_is_private(self):
+        parse_cached(PROGRAM)
+        assert_equals(0700, os.stat(self.cache_dir).st_mode & 0777)
+
+    def plant(self, source, forms):
+        "Put forms other than those of the source in its cache entry"
+        with open(join(self.cache_dir, cache_key(source) + '.pickle'), 'wb') as f:
+            pickle.dump(forms, f)
+
+    def test_cache_writable_by_others_is_not_used(self):
+        os.makedirs(self.cache_dir)
+        self.plant(PROGRAM, ['planted'])
+        for mode in (0770, 0702):
+            os.chmod(self.cache_dir, mode)
+            assert_equals(parser.parse_multiple(PROGRAM), parse_cached(PROGRAM))
+
+    def test_cache_of_other_users_is_not_used(self):
+        os.makedirs(self.cache_dir, 0700)
+        self.plant(PROGRAM, ['planted'])
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            assert_equals(parser.parse_multiple(PROGRAM), parse_cached(PROGRAM))
+        assert_equals(['planted'], parse_cached(PROGRAM))
+
+    def test_prune_removes_least_recently_used_entries(self):
+        sources = ["'(%s %s)" % (name, "x" * 1000) for name in 'abc']
+        paths = [join(self.cache_dir, cache_key(source) + '.pickle')
+                 for source in sources]
+        for age, source in enumerate(sources):
+            parse_cached(source)
+            os.utime(paths[age], (age, age))
+        parse_cached(sources[0])  # used again, so no longer the oldest
+        cache.prune(self.cache_dir, size=os.path.getsize(paths[0]) * 2)
+        assert_equals(sorted([paths[0], paths[2]]),
+                      sorted(join(self.cache_dir, name)
+                             for name in os.listdir(self.cache_dir)))
+
+    def test_cache_is_pruned_when_storing(self):
+        with patch.object(cache, 'prune_interval', 1):
+            with patch.object(cache, 'max_size', 0):
+                parse_cached(PROGRAM)
+        assert_equals([], os.listdir(self.cache_dir))
+
+    def test_interpret_file_uses_cache(self):
+        filename = join(self.dir, 'program.moo')
+        with open(filename, 'w') as f:
+            f.write(PROGRAM)
+        assert_equals("(0 1 (2 3) #t)", interpret_file(filename, get_builtin_env()))
+        assert_in(cache_key(PROGRAM) + '.pickle', os.listdir(self.cache_dir))
+        assert_equals("(0 1 (2 3) #t)", interpret_file(filename, get_builtin_env()))
+
+    def test_statements_before_syntax_error_are_run(self):
+        filename = join(self.dir, 'broken.moo')
+        with open(filename, 'w') as f:
+            f.write("(define x 42) (x")
+        env = get_builtin_env()
+        with assert_raises(LispSyntaxError):
+            interpret_file(filename, env)
+        assert_equals(42, env['x'])
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from nose.tools import assert_equals
+from nose.tools import assert_equals, assert_is
 from moolisp.interpreter import interpret, default_env
 
 class TestDefaultEnvironment:
@@ -46,3 +46,17 @@ class TestDefaultEnvironment:
 
         assert_equals("(cond (#t 42) (#t 100))",
             interpret("(expand-1 '(if #t 42 100))"))
+
+    ## prelude
+
+    def test_default_envs_share_the_prelude(self):
+        assert_is(default_env().outer, default_env().outer)
+
+    def test_definitions_are_not_shared_between_envs(self):
+        env, other = default_env(), default_env()
+        interpret("(define nil 'redefined)", env)
+        interpret("(set! if 'clobbered)", env)
+        assert_equals("redefined", interpret("nil", env))
+        assert_equals("clobbered", interpret("if", env))
+        assert_equals("()", interpret("nil", other))
+        assert_equals("1", interpret("(if #t 1 2)", other))
@@ -3,7 +3,9 @@
 from nose.tools import assert_equals, assert_raises_regexp
 
 from moolisp.errors import LispNamingError
-from moolisp.env import Environment
+from moolisp.env import Environment, Frame, Scope, UNBOUND, assign
+from moolisp.env import GlobalCache, global_cache_stats, name_version
+from moolisp.interpreter import interpret, default_env
 
 class TestEnvironment:
 
@@ -34,3 +36,129 @@ class TestEnvironment:
     def test_lookup_on_missing_raises_exception(self):
         with assert_raises_regexp(LispNamingError, "my-missing-var"):
             Environment()["my-missing-var"]
+
+    def test_forks_are_isolated(self):
+        base = Environment({"x": 1}).freeze()
+        a, b = base.fork(), base.fork()
+        a["y"] = 2
+        assert_equals(1, a["x"])
+        assert_equals(2, a["y"])
+        with assert_raises_regexp(LispNamingError, "undefined"):
+            b["y"]
+
+    def test_frozen_environment_cannot_be_defined_in(self):
+        base = Environment({"x": 1}).freeze()
+        with assert_raises_regexp(LispNamingError, "frozen"):
+            base["y"] = 2
+
+    def test_assigning_frozen_variable_copies_it_into_fork(self):
+        base = Environment({"x": 1}).freeze()
+        fork = base.fork()
+        inner = Environment({"z": 0}, fork)
+        assign(inner, "x", 2)
+        assert_equals(2, inner["x"])
+        assert_equals(2, fork.get("x"))
+        assert_equals(1, base["x"])
+        assert_equals(1, base.fork()["x"])
+
+class TestFrame:
+
+    def test_resolve_variables_in_scope_chain(self):
+        outer = Scope(["a", "b"])
+        inner = Scope(["c"], ["d"], outer)
+        assert_equals((0, 0), inner.resolve("c"))
+        assert_equals((0, 1), inner.resolve("d"))
+        assert_equals((1, 1), inner.resolve("b"))
+        assert_equals(None, inner.resolve("global-var"))
+
+    def test_lookup_by_name(self):
+        env = Environment({"g": 1})
+        frame = Frame(Scope(["a"]), [2], env)
+        inner = Frame(Scope(["b"], [], frame.scope), [3], frame)
+        assert_equals(3, inner["b"])
+        assert_equals(2, inner["a"])
+        assert_equals(1, inner["g"])
+        assert_equals(env, inner.globals)
+
+    def test_unbound_slots_are_skipped(self):
+        outer = Frame(Scope(["x"]), [1], Environment())
+        frame = Frame(Scope([], ["x"], outer.scope), [UNBOUND], outer)
+        assert_equals(1, frame["x"])
+        assert_equals(outer, frame.defining_env("x"))
+        frame["x"] = 2
+        assert_equals(2, frame["x"])
+        assert_equals(1, outer["x"])
+
+    def test_environment_on_top_of_frame(self):
+        frame = Frame(Scope(["x"]), [1], Environment())
+        env = Environment({"y": 2}, frame)
+        assert_equals(1, env["x"])
+        env.defining_env("x")["x"] = 3
+        assert_equals(3, frame.values[0])
+
+    def test_lookup_on_missing_raises_exception(self):
+        with assert_raises_regexp(LispNamingError, "my-missing-var"):
+            Frame(Scope(["x"]), [1], Environment())["my-missing-var"]
+
+class TestGlobalCache:
+
+    def setup(self):
+        global_cache_stats.clear()
+
+    def test_define_set_and_update_change_the_version_of_the_name(self):
+        env = Environment({'x': 1})
+        x, y = name_version('x'), name_version('y')
+        versions = [x.version]
+        env['x'] = 2
+        versions.append(x.version)
+        assign(env, 'x', 3)
+        versions.append(x.version)
+        env.update({'x': 4})
+        versions.append(x.version)
+        assert_equals(4, len(set(versions)))
+        y_version = y.version
+        env['z'] = 5
+        env.update({'x': 6})
+        assert_equals(y_version, y.version)
+
+    def test_lookup_caches_the_value(self):
+        env = Environment({'x': 1})
+        cache = GlobalCache('x')
+        assert_equals(1, cache.lookup(env))
+        assert_equals((env, name_version('x').version, 1), cache.entry)
+        assert_equals((0, 1), (global_cache_stats.hits, global_cache_stats.misses))
+
+    def test_cached_values_are_seen_after_redefinition(self):
+        for engine in ['analyze', 'vm']:
+            env = default_env()
+            interpret("(define f (lambda () (car '(1))))", env, engine)
+            assert_equals("1", interpret("(f)", env, engine))
+            assert_equals("1", interpret("(f)", env, engine))
+            interpret("(define car cdr)", env, engine)
+            assert_equals("nil", interpret("(f)", env, engine))
+            interpret("(set! car (lambda (x) 'set))", env, engine)
+            assert_equals("set", interpret("(f)", env, engine))
+
+    def test_hot_loops_hit(self):
+        env = default_env()
+        interpret("(define loop (lambda (n) (if (= n 0) 'done (loop (- n 1)))))", env,
+                  'analyze')
+        interpret("(loop 100)", env, 'analyze')
+        assert global_cache_stats.hit_rate() > 0.9, str(global_cache_stats)
+
+    def test_hot_loops_setting_globals_hit(self):
+        for engine in ['analyze', 'vm']:
+            env = default_env()
+            interpret("(define n 0)", env, engine)
+            interpret("(define loop (lambda (i) (if (= i 0) n"
+                      " (begin (set! n (+ n 1)) (loop (- i 1))))))", env, engine)
+            global_cache_stats.clear()
+            assert_equals("100", interpret("(loop 100)", env, engine))
+            assert global_cache_stats.hit_rate() > 0.8, str(global_cache_stats)
+
+    def test_frames_are_not_cached(self):
+        env = default_env()
+        source = "((lambda (y) (begin (define g (eval '(lambda () y)))" \
+                 "                    (g) (set! y 2) (g))) 1)"
+        for engine in ['analyze', 'vm']:
+            assert_equals("2", interpret(source, env, engine))
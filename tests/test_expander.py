@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+from os.path import join
+from StringIO import StringIO
+from nose.tools import assert_equals
+
+from moolisp.expander import expand_all
+from moolisp.evaluator import expansion_cache
+from moolisp.interpreter import interpret, interpret_file, interpret_stream, default_env
+from moolisp.parser import parse, unparse
+
+class TestExpandAll:
+
+    def setup(self):
+        self.env = default_env()
+        interpret("(define unless (macro (p a b) `(if ,p ,b ,a)))", self.env)
+        self.dir = tempfile.mkdtemp()
+        self.filename = join(self.dir, 'program.moo')
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def expand(self, source, program=frozenset()):
+        return unparse(expand_all(parse(source), self.env, program))
+
+    def test_expand_macro_call(self):
+        assert_equals("(cond (#t 1) (#t 2))", self.expand("(if #t 1 2)"))
+
+    def test_expand_until_no_macro_calls_remain(self):
+        assert_equals("(lambda (x) (cond (x 2) (#t (cond (#f 3) (#t 4)))))",
+            self.expand("(lambda (x) (unless x (if #f 3 4) 2))"))
+
+    def test_original_ast_is_unchanged(self):
+        ast = parse("(begin (if #t 1 2))")
+        expand_all(ast, self.env)
+        assert_equals("(begin (if #t 1 2))", unparse(ast))
+
+    def test_quoted_forms_are_not_expanded(self):
+        assert_equals("'(if #t 1 2)", self.expand("'(if #t 1 2)"))
+        assert_equals("(expand-1 '(if #t 1 2))", self.expand("(expand-1 '(if #t 1 2))"))
+
+    def test_only_unquoted_parts_of_quasiquote_are_expanded(self):
+        assert_equals("`(if ,(cond (#t 1) (#t 2)))", self.expand("`(if ,(if #t 1 2))"))
+
+    def test_shadowed_macro_is_not_expanded(self):
+        source = "(lambda (if) (if 1 2 3))"
+        assert_equals(source, self.expand(source))
+        source = "(let ((if car)) (if 1 2 3))"
+        assert_equals(source, self.expand(source))
+
+    def test_macro_redefined_in_program_is_not_expanded(self):
+        source = "(begin (define if (lambda (a b c) b)) (if #t 1 2))"
+        assert_equals(source, self.expand(source))
+        assert_equals("1", interpret(source, self.env, expand=True))
+
+    def test_unknown_operators_are_left_alone(self):
+        assert_equals("(foo (cond (#t 1) (#t 2)))", self.expand("(foo (if #t 1 2))"))
+
+    def test_lambda_bodies_are_expanded_only_when_program_is_known(self):
+        source = "(lambda (x) (if x 1 2))"
+        assert_equals(source, self.expand(source, program=None))
+        assert_equals("(lambda (x) (cond (x 1) (#t 2)))", self.expand(source))
+        assert_equals(source, self.expand(source, program=frozenset(['if'])))
+
+    def test_stream_expands_macros_defined_earlier(self):
+        """Each statement is expanded after the previous ones have been
+        evaluated, so macros defined by them are expanded too"""
+
+        source = StringIO("""
+            (define when (macro (p x) `(if ,p ,x 'nothing)))
+            (when (< 5 10) (+ 5 1))
+        """)
+        misses = expansion_cache.misses
+        assert_equals("6", interpret_stream(source, self.env, expand=True))
+        assert_equals(misses, expansion_cache.misses)
+
+    def test_file_expands_lambda_bodies(self):
+        with open(self.filename, 'w') as f:
+            f.write("(define f (lambda (n) (if (< n 10) (+ n 1) 0))) (f 5)")
+        misses = expansion_cache.misses
+        assert_equals("6", interpret_file(self.filename, self.env, expand=True))
+        assert_equals(misses, expansion_cache.misses)
+
+    def test_macros_redefined_by_later_statements_are_not_expanded(self):
+        source = """
+            (define f (lambda (x) (if x 1 2)))
+            (define if (macro (a b c) ''redefined))
+            (f #t)
+        """
+        assert_equals("redefined", interpret_stream(StringIO(source), default_env(),
+                                                    expand=True))
+        with open(self.filename, 'w') as f:
+            f.write(source)
+        for optimize in (False, True):
+            assert_equals("redefined", interpret_file(self.filename, default_env(),
+                                                      expand=True, optimize=optimize))
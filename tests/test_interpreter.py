@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+from StringIO import StringIO
+from nose.tools import assert_equals, assert_raises
+
+from moolisp.interpreter import interpret_stream, default_env
+from moolisp.errors import LispSyntaxError
+
+class TestInterpretStream:
+
+    def test_returns_value_of_last_expression(self):
+        source = StringIO("(define x 42) ; comment\n(define y\n  (+ x 1))\ny\n")
+        assert_equals("43", interpret_stream(source))
+
+    def test_result_written_to_output(self):
+        output = StringIO()
+        source = StringIO("(define x 42) (list x '(a b))")
+        assert_equals(None, interpret_stream(source, output=output))
+        assert_equals("(42 (a b))", output.getvalue())
+
+    def test_hash_consed_data_gives_the_same_results(self):
+        source = "(define xs '((1 2) (1 2))) (list (= (car xs) (car (cdr xs))) xs)"
+        assert_equals("(#t ((1 2) (1 2)))",
+                      interpret_stream(StringIO(source), hash_cons=True))
+
+    def test_empty_stream(self):
+        assert_equals("", interpret_stream(StringIO(";; nothing here\n")))
+
+    def test_statements_are_evaluated_before_the_rest_is_read(self):
+        """Each statement is evaluated as soon as it has been read, so 
+        definitions take effect even if later input is malformed"""
+
+        env = default_env()
+        source = StringIO("(define x 1)\n(define y 2)\n(broken")
+        with assert_raises(LispSyntaxError):
+            interpret_stream(source, env)
+        assert_equals(["x", "y"], sorted(k for k in env if k in ("x", "y")))
+
+    def test_reads_lines_lazily(self):
+        """Input is consumed one line at a time, not all up front"""
+
+        class LineSource(object):
+            def __init__(self, lines):
+                self.lines = lines
+                self.read = 0
+
+            def readline(self):
+                if self.read == len(self.lines):
+                    return ''
+                self.read += 1
+                return self.lines[self.read - 1]
+
+        env = default_env()
+        source = LineSource(["(define a 1)\n", "(car ())\n", "(define b a)\n"])
+        with assert_raises(IndexError):
+            interpret_stream(source, env)
+        assert_equals(2, source.read)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the non-recursive evaluator in moolisp.iterative.
+
+It must behave exactly like the tree-walking evaluator, so the existing
+suites are run again with it.
+"""
+
+from mock import patch
+from nose.tools import assert_equals, assert_raises_regexp
+
+import test_eval
+import test_core
+import test_lisp
+import test_macros
+import test_builtins
+from tests import engine_mixin
+from moolisp import iterative
+from moolisp.iterative import execute
+from moolisp.interpreter import interpret, default_env
+from moolisp.errors import LispError, LispRecursionError
+
+# Runs a test class with the iterative evaluator as the default engine
+IterativeEngine = engine_mixin(execute)
+
+class TestIterativeEval(IterativeEngine, test_eval.TestEval, object):
+    pass
+
+class TestIterativeCore(IterativeEngine, test_core.TestDefaultEnvironment, object):
+    pass
+
+class TestIterativeLisp(IterativeEngine, test_lisp.TestMooLisp, object):
+    pass
+
+class TestIterativeMacros(IterativeEngine, test_macros.TestMacros, object):
+    pass
+
+class TestIterativeBuiltins(IterativeEngine, test_builtins.TestBuiltins, object):
+    pass
+
+BUILD = """
+(define build
+    (lambda (n) (if (= n 0) '() (cons n (build (- n 1))))))
+"""
+
+class TestIterative:
+
+    def setup(self):
+        self.env = default_env()
+
+    def test_deep_non_tail_recursion(self):
+        interpret(BUILD, self.env, 'iterative')
+        assert_equals("20000", interpret("(car (build 20000))", self.env, 'iterative'))
+
+    def test_deeply_nested_forms(self):
+        source = "(+ 1 " * 5000 + "0" + ")" * 5000
+        assert_equals("5000", interpret(source, self.env, 'iterative'))
+
+    def test_maximum_depth(self):
+        interpret(BUILD, self.env, 'iterative')
+        with patch.object(iterative, 'max_depth', 1000):
+            with assert_raises_regexp(LispRecursionError, "depth of 1000 exceeded"):
+                interpret("(build 1000)", self.env, 'iterative')
+            assert_equals("10", interpret("(car (build 10))", self.env, 'iterative'))
+
+    def test_recursion_error_is_a_lisp_error(self):
+        assert issubclass(LispRecursionError, LispError)
+
+    def test_quasiquote_evaluates_unquotes_in_order(self):
+        interpret("(define x 1)", self.env, 'iterative')
+        assert_equals("(a (1 b) 2)", interpret(
+            "`(a (,x b) ,(begin (set! x 2) x))", self.env, 'iterative'))
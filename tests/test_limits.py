@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_is, assert_raises_regexp
+
+from moolisp.interpreter import interpret, interpret_stream, default_env
+from moolisp.errors import LispLimitError
+from moolisp.limits import Limits, enforced
+from StringIO import StringIO
+
+LOOP = "((lambda (f) (f f)) (lambda (f) (f f)))"
+
+class TestLimits:
+
+    engine = 'eval'
+
+    def setup(self):
+        self.env = default_env()
+
+    def run(self, source, limits):
+        return interpret(source, self.env, self.engine, limits=limits)
+
+    def test_step_limit_stops_endless_loop(self):
+        with assert_raises_regexp(LispLimitError, "Step limit of 5000 exceeded"):
+            self.run(LOOP, Limits(steps=5000))
+
+    def test_exactly_the_allowed_steps_are_taken(self):
+        limits = Limits(steps=2500)
+        with assert_raises_regexp(LispLimitError, "Step limit"):
+            self.run(LOOP, limits)
+        assert_equals(2501, limits.steps_taken())
+
+    def test_program_within_limits_runs(self):
+        self.run("(define count (lambda (n) (if (= n 0) 'done (count (- n 1)))))",
+                 Limits(steps=100))
+        assert_equals("done", self.run("(count 100)", Limits(steps=1000)))
+
+    def test_time_limit_stops_endless_loop(self):
+        with assert_raises_regexp(LispLimitError, "Time limit of 0.05 seconds"):
+            self.run(LOOP, Limits(seconds=0.05))
+
+    def test_memory_limit_stops_growing_list(self):
+        self.run("(define grow (lambda (xs) (grow (cons xs xs))))", None)
+        with assert_raises_regexp(LispLimitError, "Memory limit of 1048576 bytes"):
+            self.run("(grow '())", Limits(memory=1024 * 1024))
+
+    def test_eval_takes_steps(self):
+        self.run("(define e '(eval e))", None)
+        with assert_raises_regexp(LispLimitError, "Step limit"):
+            self.run("(eval e)", Limits(steps=100))
+
+    def test_limits_are_lifted_afterwards(self):
+        with assert_raises_regexp(LispLimitError, "Step limit"):
+            self.run(LOOP, Limits(steps=100))
+        assert_is(None, enforced.limits)
+        self.run("(define count (lambda (n) (if (= n 0) 'done (count (- n 1)))))",
+                 None)
+        assert_equals("done", self.run("(count 500)", None))
+
+    def test_limits_apply_to_all_statements_of_a_stream(self):
+        source = "(define count (lambda (n) (if (= n 0) 'done (count (- n 1)))))" \
+                 "(count 40) (count 40)"
+        assert_equals("done", interpret_stream(StringIO(source), self.env, self.engine,
+                                               limits=Limits(steps=400)))
+        with assert_raises_regexp(LispLimitError, "Step limit"):
+            interpret_stream(StringIO(source), self.env, self.engine,
+                             limits=Limits(steps=200))
+
+class TestLimitsAnalyzed(TestLimits):
+    engine = 'analyze'
+
+class TestLimitsCompiled(TestLimits):
+    engine = 'vm'
+
+class TestLimitsIterative(TestLimits):
+    engine = 'iterative'
+
+class TestNestedLimits:
+
+    def test_inner_limits_are_restored_to_outer(self):
+        outer, inner = Limits(steps=10), Limits(steps=20)
+        with outer:
+            with inner:
+                assert_is(inner, enforced.limits)
+            assert_is(outer, enforced.limits)
+        assert_is(None, enforced.limits)
+
+    def test_copies_count_separately(self):
+        limits = Limits(steps=10)
+        copy = limits.copy()
+        with limits:
+            for _ in range(5):
+                limits.step()
+        assert_equals(5, limits.steps_taken())
+        assert_equals(0, copy.steps_taken())
+
+    def test_remaining_limits_count_on(self):
+        limits = Limits(steps=10, seconds=60)
+        with limits:
+            for _ in range(4):
+                limits.step()
+            left = limits.remaining()
+        with left:
+            for _ in range(6):
+                left.step()
+            with assert_raises_regexp(LispLimitError, "Step limit of 10 exceeded"):
+                left.step()
+        assert left.seconds_left() <= limits.seconds_left() + 0.01
+
+    def test_remaining_steps_can_be_shared(self):
+        limits = Limits(steps=10)
+        with limits:
+            for _ in range(2):
+                limits.step()
+            part = limits.remaining(4)
+        with part:
+            for _ in range(2):
+                part.step()
+            with assert_raises_regexp(LispLimitError, "Step limit of 10 exceeded"):
+                part.step()
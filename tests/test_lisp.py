@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
-from nose.tools import assert_equals
+from nose.tools import assert_equals, assert_raises_regexp
+
+from moolisp.errors import LispNamingError
 
 from moolisp.interpreter import interpret, default_env
 
@@ -31,3 +33,66 @@ class TestMooLisp:
         """, env)
         assert_equals("6", interpret("(gcd 108 30)", env))
         assert_equals("1", interpret("(gcd 17 5)", env))
+
+    def test_tail_calls_run_in_constant_stack_space(self):
+        """Tail recursion through if, cond, let and begin does not grow the
+        Python stack, so loops can run far past the recursion limit"""
+        env = default_env()
+        interpret("""
+            (define count
+                (lambda (n acc)
+                    (if (= n 0)
+                        acc
+                        (let ((next (- n 1)))
+                            (begin
+                                (define ignored acc)
+                                (cond ((< acc 0) 'never)
+                                      (#t (count next (+ acc 1)))))))))
+        """, env)
+        assert_equals("5000", interpret("(count 5000 0)", env))
+
+    def test_mutual_tail_recursion(self):
+        env = default_env()
+        interpret("""
+            (begin
+                (define even? (lambda (n) (if (= n 0) #t (odd? (- n 1)))))
+                (define odd? (lambda (n) (if (= n 0) #f (even? (- n 1))))))
+        """, env)
+        assert_equals("#t", interpret("(even? 5000)", env))
+
+    def test_closures_use_the_environment_they_were_defined_in(self):
+        """Free variables are looked up where a lambda was defined,
+        not where it is called"""
+        env = default_env()
+        interpret("""
+            (begin
+                (define x 'outer)
+                (define get-x (lambda () x))
+                (define call-with-x (lambda (x) (get-x))))
+        """, env)
+        assert_equals("outer", interpret("(call-with-x 'inner)", env))
+
+    def test_closures_cannot_see_variables_of_the_caller(self):
+        """A lambda defined at top level can't use the caller's locals"""
+        env = default_env()
+        interpret("(define get-y (lambda () y))", env)
+        with assert_raises_regexp(LispNamingError, "y"):
+            interpret("(let ((y 1)) (get-y))", env)
+
+    def test_list_recursion(self):
+        env = default_env()
+        interpret("""
+            (begin
+                (define range (lambda (n acc)
+                    (if (= n 0) acc (range (- n 1) (cons n acc)))))
+                (define sum (lambda (lst acc)
+                    (if (nil? lst) acc (sum (cdr lst) (+ acc (car lst)))))))
+        """, env)
+        assert_equals("(1 2 3)", interpret("(range 3 '())", env))
+        assert_equals("50005000", interpret("(sum (range 10000 '()) 0)", env))
+
+    def test_evaluating_lists_built_at_runtime(self):
+        env = default_env()
+        assert_equals("3", interpret("(eval (list '+ 1 2))", env))
+        assert_equals("3", interpret("(eval '(car (cdr '(2 3))))", env))
+        assert_equals("(1 2)", interpret("(eval (cons 'list '(1 2)))", env))
@@ -8,7 +8,7 @@ The macros are heavily inspired by how Clojure macros works.
 from nose.tools import assert_equals, assert_true
 
 from moolisp.interpreter import interpret, default_env
-from moolisp.evaluator import evaluate
+from moolisp.evaluator import evaluate, expansion_cache
 from moolisp.env import Environment
 from moolisp.types import is_macro
 
@@ -113,3 +113,28 @@ class TestMacros:
 
         assert_equals("(foo foo bar foo)",
             interpret("(test 'bar)", env))  
+
+    def test_macro_expansions_are_cached_per_call_site(self):
+        """A macro call is only expanded the first time it is evaluated"""
+
+        env = default_env()
+        interpret("""(define count 
+                        (lambda (n) 
+                            (if (= n 0) 'done (count (- n 1)))))""", env)
+        expansion_cache.clear()
+        assert_equals("done", interpret("(count 10)", env))
+        assert_equals(1, expansion_cache.misses)
+        assert_equals(10, expansion_cache.hits)
+
+    def test_redefining_macro_invalidates_cached_expansions(self):
+        env = default_env()
+        interpret("""(define count 
+                        (lambda (n) 
+                            (if (= n 0) 'done (count (- n 1)))))""", env)
+        interpret("(count 3)", env)
+        invalidations = expansion_cache.invalidations
+        interpret("""(define if 
+                        (macro (pred then else) 
+                            ''redefined))""", env)
+        assert_equals("redefined", interpret("(count 3)", env))
+        assert_equals(invalidations + 1, expansion_cache.invalidations)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+from nose.tools import assert_equals, assert_raises_regexp
+
+from moolisp.interpreter import interpret, default_env
+from moolisp.errors import LispTypeError
+from moolisp.memo import LRUCache
+from moolisp.types import Pair, hashable, tag
+
+FIB = """
+(define fib
+    (memoize (lambda (n)
+        (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))))
+"""
+
+class TestMemoize:
+
+    engine = 'eval'
+
+    def setup(self):
+        self.env = default_env()
+
+    def run(self, source):
+        return interpret(source, self.env, self.engine)
+
+    def test_recursive_calls_are_cached(self):
+        self.run(FIB)
+        assert_equals("12586269025", self.run("(fib 50)"))
+        assert_equals("(48 51 51 128)", self.run("(memo-stats fib)"))
+
+    def test_repeated_call_is_a_hit(self):
+        self.run("(define square (memoize (lambda (x) (* x x))))")
+        self.run("(square 3)")
+        assert_equals("9", self.run("(square 3)"))
+        assert_equals("(1 1 1 128)", self.run("(memo-stats square)"))
+
+    def test_least_recently_used_result_is_evicted(self):
+        self.run("(define id (memoize (lambda (x) x) 2))")
+        self.run("(begin (id 1) (id 2) (id 1) (id 3))")
+        assert_equals("(1 3 2 2)", self.run("(memo-stats id)"))
+        self.run("(id 1)")
+        self.run("(id 2)")
+        assert_equals("(2 4 2 2)", self.run("(memo-stats id)"))
+
+    def test_equal_lists_share_an_entry(self):
+        self.run("(define len (memoize (lambda (xs) (cond ((eq xs 'nil) 0)"
+                 " (#t (+ 1 (len (cdr xs))))))))")
+        self.run("(len '(1 2 3))")
+        assert_equals("3", self.run("(len (list 1 2 3))"))
+        assert_equals("(1 4 4 128)", self.run("(memo-stats len)"))
+
+    def test_clear(self):
+        self.run(FIB)
+        self.run("(fib 10)")
+        assert_equals("#t", self.run("(memo-clear fib)"))
+        assert_equals("(0 0 0 128)", self.run("(memo-stats fib)"))
+
+    def test_named_after_definition(self):
+        self.run(FIB)
+        assert_equals('fib', self.env['fib'].name)
+
+    def test_errors(self):
+        with assert_raises_regexp(LispTypeError, "Can't memoize"):
+            self.run("(memoize car)")
+        with assert_raises_regexp(LispTypeError, "positive integer"):
+            self.run("(memoize (lambda (x) x) 0)")
+        with assert_raises_regexp(LispTypeError, "Not a memoized function"):
+            self.run("(memo-stats car)")
+        with assert_raises_regexp(LispTypeError, "expected 1 got 2"):
+            self.run("((memoize (lambda (x) x)) 1 2)")
+
+    def test_lambdas_run_with_the_engine_that_made_them(self):
+        self.run("(define id (lambda (x) x))")
+        assert_equals(self.engine, self.env['id'].engine)
+        assert_equals("1", self.run("((memoize id) 1)"))
+
+class TestMemoizeAnalyzed(TestMemoize):
+    engine = 'analyze'
+
+class TestMemoizeCompiled(TestMemoize):
+    engine = 'vm'
+
+class TestMemoizeIterative(TestMemoize):
+    engine = 'iterative'
+
+    def test_deep_recursion_in_memoized_lambdas(self):
+        self.run("(define count (lambda (n) (if (= n 0) 0 (+ 1 (count (- n 1))))))")
+        self.run("(define count-memo (memoize (lambda (n) (count n))))")
+        assert_equals("5000", self.run("(count-memo 5000)"))
+
+class TestLRUCache:
+
+    def test_get_and_store(self):
+        cache = LRUCache(2)
+        cache.store('a', 1)
+        assert_equals(1, cache.get('a'))
+        assert_equals(None, cache.get('b'))
+        assert_equals((1, 1), (cache.hits, cache.misses))
+
+    def test_size_is_bounded(self):
+        cache = LRUCache(2)
+        for key in 'abc':
+            cache.store(key, key)
+        assert_equals(['b', 'c'], list(cache.entries))
+
+class TestHashable:
+
+    def test_lists_and_pairs(self):
+        pairs = Pair(1, Pair(Pair(2, Pair(3, [])), []))
+        assert_equals(hashable([1, [2, 3]]), hashable(pairs))
+        assert hashable([1, 2]) != hashable([1, [2]])
+        assert_equals(1, len(set([hashable([]), hashable([])])))
+
+    def test_lists_differ_from_typed_values(self):
+        assert hashable(['type', 'string', 'x']) != hashable(tag('string', 'x'))
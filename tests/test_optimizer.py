@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+from os.path import join
+from StringIO import StringIO
+from nose.tools import assert_equals
+
+from moolisp.optimizer import optimize, program_variables
+from moolisp.expander import expand_all
+from moolisp.interpreter import interpret, interpret_file, interpret_stream, default_env
+from moolisp.parser import parse, parse_multiple, unparse
+
+class TestOptimize:
+
+    def setup(self):
+        self.env = default_env()
+        self.dir = tempfile.mkdtemp()
+        self.filename = join(self.dir, 'program.moo')
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def optimize(self, source):
+        return unparse(optimize(parse(source), self.env))
+
+    def test_fold_builtin_calls(self):
+        assert_equals("7", self.optimize("(+ 3 4)"))
+        assert_equals("(f 14)", self.optimize("(f (* 2 (+ 3 4)))"))
+        assert_equals("#t", self.optimize("(= 'a 'a)"))
+
+    def test_calls_with_unknown_arguments_are_kept(self):
+        assert_equals("(+ x 4)", self.optimize("(+ x (- 5 1))"))
+
+    def test_failing_calls_are_left_to_evaluation(self):
+        assert_equals("(/ 1 0)", self.optimize("(/ 1 0)"))
+        assert_equals("(+ 1 'a)", self.optimize("(+ 1 'a)"))
+
+    def test_impure_builtins_are_not_folded(self):
+        assert_equals("(cons 1 '())", self.optimize("(cons 1 '())"))
+
+    def test_prune_cond_clauses(self):
+        assert_equals("b", self.optimize("(cond (#f a) (#t b) (c d))"))
+        assert_equals("(cond (x a) (#t b))",
+            self.optimize("(cond (x a) ((< 1 2) b) (c d))"))
+        assert_equals("(cond)", self.optimize("(cond ((> 1 2) a))"))
+
+    def test_inline_constant_let_bindings(self):
+        assert_equals("10", self.optimize("(let ((x 5)) (* x 2))"))
+        assert_equals("(let ((y (f))) (+ 6 y))",
+            self.optimize("(let ((x (+ 1 2)) (y (f))) (+ (* 2 x) y))"))
+        assert_equals("'(a b)", self.optimize("(let ((x '(a b))) x)"))
+
+    def test_inner_bindings_shadow_constants(self):
+        assert_equals("(lambda (x) (+ x 1))",
+            self.optimize("(let ((x 5)) (lambda (x) (+ x 1)))"))
+
+    def test_assigned_let_bindings_are_kept(self):
+        source = "(let ((x 5)) (begin (set! x 6) x))"
+        assert_equals(source, self.optimize(source))
+        assert_equals("6", interpret(source, self.env, optimize=True))
+
+    def test_let_bindings_seen_by_eval_are_kept(self):
+        source = "(let ((x 5)) (eval 'x))"
+        assert_equals(source, self.optimize(source))
+        assert_equals("5", interpret(source, self.env, optimize=True))
+
+    def test_let_bindings_seen_by_macros_are_kept(self):
+        interpret("(define get-x (macro () 'x))", self.env)
+        source = "(let ((x 5)) (get-x))"
+        assert_equals(source, self.optimize(source))
+        assert_equals("5", interpret(source, self.env, optimize=True))
+
+    def test_drop_constants_from_begin(self):
+        assert_equals("(begin (f) (g))", self.optimize("(begin 1 (f) '(a) (g))"))
+        assert_equals("(f)", self.optimize("(begin #t (f))"))
+        assert_equals("x", self.optimize("(begin (+ 1 2) x)"))
+
+    def test_quoted_forms_are_not_optimized(self):
+        assert_equals("'(+ 1 2)", self.optimize("'(+ 1 2)"))
+        assert_equals("`((+ 1 2) ,3)", self.optimize("`((+ 1 2) ,(+ 1 2))"))
+
+    def test_original_ast_is_unchanged(self):
+        ast = parse("(begin 1 (+ 1 2))")
+        optimize(ast, self.env)
+        assert_equals("(begin 1 (+ 1 2))", unparse(ast))
+
+    def test_shadowed_builtins_are_not_folded(self):
+        source = "(lambda (+) (+ 1 2))"
+        assert_equals(source, self.optimize(source))
+        source = "(let ((+ -)) (+ 1 2))"
+        assert_equals(source, self.optimize(source))
+        assert_equals("-1", interpret(source, self.env, optimize=True))
+
+    def test_builtins_redefined_in_program_are_not_folded(self):
+        source = "(begin (define + -) (+ 3 4))"
+        assert_equals(source, self.optimize(source))
+        source = "(begin (set! * +) (* 3 4))"
+        assert_equals(source, self.optimize(source))
+
+    def test_builtins_redefined_earlier_are_not_folded(self):
+        interpret("(define + -)", self.env)
+        assert_equals("(+ 3 4)", self.optimize("(+ 3 4)"))
+
+    def test_stream_optimizes_after_expanding(self):
+        source = StringIO("""
+            (define x (if (< 1 2) (+ 1 (* 2 3)) (car '())))
+            x
+        """)
+        assert_equals("7", interpret_stream(source, self.env, expand=True,
+                                            optimize=True))
+
+    def test_lambda_bodies_are_folded_only_when_program_is_known(self):
+        source = "(lambda (n) (if (< 1 2) (+ n (* 2 3)) (car '())))"
+        expanded = expand_all(parse(source), self.env, frozenset())
+        assert_equals("(lambda (n) (cond ((< 1 2) (+ n (* 2 3))) (#t (car '()))))",
+                      unparse(optimize(expanded, self.env)))
+        assert_equals("(lambda (n) (+ n 6))",
+                      unparse(optimize(expanded, self.env,
+                                       program_variables([], self.env))))
+
+    def test_builtins_redefined_by_later_statements_are_not_folded(self):
+        source = "(define f (lambda () (+ 1 2))) (define + (lambda (a b) 0)) (f)"
+        assert_equals("0", interpret_stream(StringIO(source), default_env(),
+                                            optimize=True))
+        with open(self.filename, 'w') as f:
+            f.write(source)
+        assert_equals("0", interpret_file(self.filename, default_env(), optimize=True))
+
+    def test_builtins_redefined_by_macros_are_not_folded(self):
+        with open(self.filename, 'w') as f:
+            f.write("(define redefine (macro (n v) `(define ,n ,v)))"
+                    " (define f (lambda () (+ 1 2)))"
+                    " (redefine + *)"
+                    " (f)")
+        assert_equals("2", interpret_file(self.filename, default_env(), expand=True,
+                                          optimize=True))
+        assert_equals("2", interpret_file(self.filename, default_env(), optimize=True))
+
+    def test_builtins_redefined_by_eval_are_not_folded(self):
+        with open(self.filename, 'w') as f:
+            f.write("(define f (lambda () (+ 1 2)))"
+                    " (eval (list 'define '+ '*))"
+                    " (f)")
+        assert_equals("2", interpret_file(self.filename, default_env(), expand=True,
+                                          optimize=True))
+
+    def test_file_optimizes_lambda_bodies(self):
+        with open(self.filename, 'w') as f:
+            f.write("(define f (lambda (n) (+ n (* 2 3)))) (f 5)")
+        assert_equals("11", interpret_file(self.filename, self.env, optimize=True))
+        assert_equals("(+ n 6)", unparse(self.env['f'].body))
+
+    def program_variables(self, source):
+        return program_variables(parse_multiple(source), self.env)
+
+    def test_program_variables(self):
+        assert_equals(frozenset(['f', 'g', 'm', '+']), self.program_variables(
+            "(define f (lambda () (set! g 1)))"
+            " (define m (macro () '(define + -)))"
+            " (f)"))
+
+    def test_program_variables_include_macro_expansions(self):
+        interpret("(define defzero (macro (n) `(define ,n 0)))", self.env)
+        assert_equals(frozenset(['f', 'x']), self.program_variables(
+            "(define f (lambda () (defzero x))) (f)"))
+
+    def test_program_variables_unknown_with_eval(self):
+        assert_equals(None, self.program_variables("(eval '(define + -))"))
+        assert_equals(None, self.program_variables("(lambda (x) (eval x))"))
+
+    def test_program_variables_unknown_with_unresolved_calls(self):
+        for source in ["(define m (macro () '(define + -))) (m)",
+                       "(define f car) (f '(1))",
+                       "(lambda (g) (g 1))",
+                       "((car (list +)) 1 2)"]:
+            assert_equals(None, self.program_variables(source))
+        assert_equals(frozenset(['f']), self.program_variables(
+            "(define f (lambda (x) x)) ((lambda (y) (f y)) 1)"))
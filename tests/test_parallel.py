@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import time
+from mock import patch
+from nose.tools import assert_equals, assert_is, assert_raises_regexp
+
+from moolisp import parallel
+from moolisp.parallel import dumps, loads
+from moolisp.interpreter import interpret, default_env, prelude
+from moolisp.env import Environment, UNBOUND
+from moolisp.errors import LispError, LispLimitError, LispNamingError, LispTypeError
+from moolisp.limits import Limits
+from moolisp.types import Builtin, Pair, TRUE, tag
+
+def teardown_module():
+    parallel.shutdown()
+
+FIB = "(define fib (lambda (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))"
+
+class TestParallel:
+
+    engine = 'eval'
+
+    def setup(self):
+        self.env = default_env()
+
+    def run(self, source):
+        return interpret(source, self.env, self.engine)
+
+    def test_pmap_keeps_order(self):
+        self.run(FIB)
+        assert_equals("(0 1 1 2 3 5 8 13 21 34)",
+            self.run("(pmap fib '(0 1 2 3 4 5 6 7 8 9))"))
+
+    def test_pmap_closure(self):
+        self.run("(define make-adder (lambda (n) (lambda (x) (+ x n))))")
+        assert_equals("(11 12 13)", self.run("(pmap (make-adder 10) (list 1 2 3))"))
+
+    def test_pmap_builtin_and_lists(self):
+        assert_equals("(1 3)", self.run("(pmap car '((1 2) (3 4)))"))
+        assert_equals("nil", self.run("(pmap car '())"))
+
+    def test_preduce(self):
+        self.run(FIB)
+        assert_equals("88", self.run("(preduce + (pmap fib '(1 2 3 4 5 6 7 8 9)) 0)"))
+        assert_equals("42", self.run("(preduce + '() 42)"))
+
+    def test_memoized_functions_can_be_sent(self):
+        self.run("(define mfib (memoize (lambda (n) (if (< n 2) n"
+                 " (+ (mfib (- n 1)) (mfib (- n 2)))))))")
+        assert_equals("(832040 12586269025)", self.run("(pmap mfib '(30 50))"))
+
+    def test_workers_do_not_share_definitions(self):
+        self.run("(define counter 0)")
+        self.run("(pmap (lambda (x) (set! counter x)) '(1 2 3))")
+        assert_equals("0", self.run("counter"))
+
+    def test_lisp_errors_are_raised(self):
+        with assert_raises_regexp(LispNamingError, "'undefined' is undefined"):
+            self.run("(pmap (lambda (x) undefined) '(1 2))")
+        with assert_raises_regexp(LispError, "ZeroDivisionError"):
+            self.run("(pmap (lambda (x) (/ x 0)) '(1 2))")
+
+    def test_argument_errors(self):
+        with assert_raises_regexp(LispTypeError, "pmap expects a function of 1"):
+            self.run("(pmap (lambda (x y) x) '(1 2))")
+        with assert_raises_regexp(LispTypeError, "preduce expects a list"):
+            self.run("(preduce + 1 0)")
+
+class TestParallelAnalyzed(TestParallel):
+    engine = 'analyze'
+
+class TestParallelCompiled(TestParallel):
+    engine = 'vm'
+
+class TestParallelIterative(TestParallel):
+    engine = 'iterative'
+
+class TestSerialization:
+
+    def test_values(self):
+        values = [42, TRUE, 'symbol', tag('string', 'moo'), Pair(1, Pair(2, []))]
+        for value in values:
+            assert_equals(value, loads(dumps(value)))
+        assert_is(TRUE, loads(dumps(TRUE)))
+        assert_is(UNBOUND, loads(dumps(UNBOUND)))
+
+    def test_prelude_is_sent_by_name(self):
+        env = default_env()
+        interpret("(define x 1)", env)
+        copy = loads(dumps(env))
+        assert_equals(1, copy['x'])
+        assert_is(prelude(), copy.outer)
+        assert_is(prelude()['car'], loads(dumps(prelude()['car'])))
+        assert len(dumps(env)) < 200
+
+    def test_recursive_closure(self):
+        env = default_env()
+        interpret(FIB, env, 'analyze')
+        interpret("(fib 5)", env, 'analyze')
+        fib = loads(dumps(env['fib']))
+        assert_is(None, fib.compiled)
+        assert_is(fib, fib.env['fib'])
+        assert_equals("55", interpret("(fib 10)", fib.env))
+
+    def test_unknown_builtins_can_not_be_sent(self):
+        env = Environment({'f': Builtin(lambda: 1, 'f')})
+        with assert_raises_regexp(LispTypeError, "Can't send f"):
+            dumps(env)
+
+SPIN = "(define spin (lambda (n) (spin n)))"
+
+class InProcessPool(object):
+    "Runs the chunks right away in this process, counting those that finish"
+
+    def __init__(self):
+        self.finished = 0
+
+    def map_async(self, worker, chunks):
+        self.results = []
+        for chunk in chunks:
+            self.results.append(worker(chunk))
+            self.finished += 1
+        return self
+
+    def get(self, timeout):
+        return self.results
+
+class TestParallelLimits:
+
+    def setup(self):
+        self.env = default_env()
+        interpret(SPIN, self.env)
+
+    def test_workers_stop_at_time_limit(self):
+        start = time.time()
+        with assert_raises_regexp(LispLimitError, "Time limit of 0.5 seconds"):
+            interpret("(pmap (lambda (x) (spin x)) '(1 2))", self.env,
+                      limits=Limits(seconds=0.5))
+        assert time.time() - start < 3
+
+    def test_workers_stop_at_step_limit(self):
+        with assert_raises_regexp(LispLimitError, "Step limit of 1000 exceeded"):
+            interpret("(pmap (lambda (x) (spin x)) '(1 2))", self.env,
+                      limits=Limits(steps=1000))
+
+    def test_step_limit_covers_all_chunks(self):
+        """Each chunk fits in the limit, but all of them together don't"""
+        interpret(FIB, self.env)
+        with assert_raises_regexp(LispLimitError, "Step limit of 2000 exceeded"):
+            interpret("(pmap fib '(10 10 10 10))", self.env, limits=Limits(steps=2000))
+
+    def test_chunks_stop_at_their_share_of_the_steps(self):
+        interpret(FIB, self.env)
+        pool = InProcessPool()
+        with patch.object(parallel, 'pool', lambda: pool):
+            with assert_raises_regexp(LispLimitError, "Step limit of 2000 exceeded"):
+                interpret("(pmap fib '(10 10 10 10))", self.env,
+                          limits=Limits(steps=2000))
+        assert_equals(0, pool.finished)
+
+    def test_steps_of_workers_are_counted(self):
+        interpret(FIB, self.env)
+        limits = Limits(steps=100000)
+        interpret("(pmap fib '(10 10 10 10))", self.env, limits=limits)
+        assert limits.steps_taken() > 4 * 177
+
+    def test_workers_do_not_inherit_limits(self):
+        parallel.shutdown()
+        interpret("(pmap car '((1) (2)))", self.env, limits=Limits(steps=10))
+        interpret(FIB, self.env)
+        assert_equals("(6765 6765)", interpret("(pmap fib '(20 20))", self.env))
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from nose.tools import assert_equals, assert_raises_regexp
+from nose.tools import assert_equals, assert_is, assert_is_not, assert_raises_regexp
 
-from moolisp.types import integer, boolean
-from moolisp.parser import parse
+from moolisp.types import integer, boolean, Pair
+from moolisp.parser import parse, parse_multiple, tokenize, read, EOF, intern_symbols
+from moolisp.parser import SharedData
 from moolisp.errors import LispSyntaxError
 
 class TestParsing:
@@ -50,3 +51,100 @@ class TestParsing:
         expected_ast = ['define', 'variable', 
                             ['if', boolean(True), integer(42), ['something', 'else']]]
         assert_equals(expected_ast, parse(program))
+
+    def test_parse_comment_at_end_of_input(self):
+        assert_equals(['foo'], parse('(foo) ; no trailing newline'))
+
+    def test_parse_exception_unexpected_closing_paren(self):
+        with assert_raises_regexp(LispSyntaxError, "Unexpected '\)'"):
+            parse(')')
+
+    def test_parse_deeply_nested_list(self):
+        """The reader does not recurse, so nesting depth is not limited
+        by the Python stack"""
+
+        depth = 10000
+        ast = parse('(' * depth + ')' * depth)
+        for _ in range(depth - 1):
+            ast = ast[0]
+        assert_equals([], ast)
+
+    def test_parse_multiple(self):
+        program = "(define x 1) 'x ; comment\n (foo (bar))"
+        assert_equals([['define', 'x', integer(1)], ['quote', 'x'], ['foo', ['bar']]],
+            parse_multiple(program))
+
+    def test_tokenize(self):
+        assert_equals(['(', 'foo', "'", '(', '1', '#t', ')', '`', 'a,b', ',', 'c', ')'],
+            list(tokenize("(foo '(1 #t) ; comment\n `a,b ,c)")))
+
+    def test_read_consumes_one_expression_at_a_time(self):
+        tokens = tokenize("(foo bar) 'baz")
+        assert_equals(['foo', 'bar'], read(tokens))
+        assert_equals(['quote', 'baz'], read(tokens))
+        assert_equals(EOF, read(tokens))
+
+    def test_quoted_lists_are_read_as_pairs(self):
+        assert_equals(Pair, type(parse("'(a (b))")[1]))
+        assert_equals(Pair, type(parse("'(a (b))")[1].cdr.car))
+        assert_equals(Pair, type(parse("(quote (a))")[1]))
+
+    def test_quotes_in_quasiquote_templates_stay_lists(self):
+        assert_equals(list, type(parse("`(a '(b ,c))")[1][1][1]))
+        assert_equals(list, type(parse("(quasiquote (a '(b ,c)))")[1][1][1]))
+
+    def test_symbols_are_interned(self):
+        first, second = parse_multiple("(foo bar) '(bar foo)")
+        assert_is(first[0], second[1].cdr.car)
+        assert_is(first[1], second[1].car)
+        assert_is('lambda', parse("(lambda (x) x)")[0])
+
+    def test_intern_symbols(self):
+        exp = ['f' + 'oo', Pair('b' + 'ar', Pair(['baz' + ''], [])), 1]
+        assert_is(exp, intern_symbols(exp))
+        assert_is(parse('foo'), exp[0])
+        assert_is(parse('bar'), exp[1].car)
+        assert_is(parse('baz'), exp[1].cdr.car[0])
+
+class TestSharedData:
+
+    def setup(self):
+        self.shared = SharedData()
+
+    def parse(self, source):
+        return parse_multiple(source, self.shared)
+
+    def test_equal_quoted_lists_are_shared(self):
+        first, second = self.parse("'((a 1) (b (a 1))) '(b (a 1))")
+        assert_is(first[1].car, first[1].cdr.car.cdr.car)
+        assert_is(first[1].cdr.car, second[1])
+
+    def test_quoted_lists_share_tails(self):
+        first, second = self.parse("'(x y z) '(w y z)")
+        assert_is(first[1].cdr, second[1].cdr)
+        assert_equals(['w', 'y', 'z'], second[1])
+
+    def test_integers_are_shared(self):
+        first, second = self.parse("(f 123456789) '(123456789)")
+        assert_is(first[1], second[1].car)
+
+    def test_code_is_not_shared(self):
+        first, second = self.parse("(f (g 1)) (f (g 1))")
+        assert_equals(first, second)
+        assert_is_not(first, second)
+        assert_is_not(first[1], second[1])
+
+    def test_quasiquote_templates_are_not_shared(self):
+        first, second = self.parse("`(a '(b)) `(a '(b))")
+        assert_is(list, type(first[1][1][1]))
+        assert_is_not(first[1], second[1])
+
+    def test_share_code_read_before(self):
+        forms = parse_multiple("'(a (1 2)) (f '((1 2)) `(1 2))")
+        assert_equals(forms, [self.shared.share_code(exp) for exp in forms])
+        assert_is(forms[0][1].cdr.car, forms[1][1][1].car)
+        assert_is(list, type(forms[1][2][1]))
+
+    def test_shared_data_reads_the_same(self):
+        source = "(define xs '((1 #t) (1 #t) () (a . b)))"
+        assert_equals(parse(source), self.parse(source)[0])
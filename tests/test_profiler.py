@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from itertools import count
+from nose.tools import assert_equals, assert_true, assert_is, assert_raises_regexp
+
+from moolisp import evaluator
+from moolisp.profiler import Profiler, profiling
+from moolisp.interpreter import interpret, default_env
+from moolisp.types import Pair
+
+PROGRAM = """
+(begin
+    (define square (lambda (x) (* x x)))
+    (define count-down
+        (lambda (n)
+            (if (= n 0) '() (cons (square n) (count-down (- n 1))))))
+    (count-down 3))
+"""
+
+class TestProfiler:
+
+    def setup(self):
+        self.env = default_env()
+
+    def profile(self, source, profiler=None):
+        with profiling(profiler) as profiler:
+            result = interpret(source, self.env)
+        return result, profiler
+
+    def test_calls_are_counted_by_defined_name(self):
+        result, profiler = self.profile(PROGRAM)
+        assert_equals("(9 4 1)", result)
+        assert_equals(4, profiler.stats['count-down'].calls)
+        assert_equals(3, profiler.stats['square'].calls)
+        assert_equals(3, profiler.stats['cons'].calls)
+        assert_equals(4, profiler.stats['if'].calls)
+
+    def test_anonymous_lambdas(self):
+        _, profiler = self.profile("((lambda (x) x) 1)")
+        assert_equals(1, profiler.stats['<lambda/1>'].calls)
+
+    def test_recursive_calls_are_timed_once(self):
+        """With a clock ticking once per reading, the outermost call to
+        count-down spans all the others"""
+
+        _, profiler = self.profile(PROGRAM, Profiler(clock=count().next))
+        stats = profiler.stats['count-down']
+        total = sum(s.exclusive for s in profiler.stats.values())
+        assert_equals(total, stats.inclusive)
+        assert_true(stats.exclusive < stats.inclusive)
+
+    def test_allocations(self):
+        _, profiler = self.profile(PROGRAM)
+        assert_equals(3, profiler.stats['cons'].self_allocations)
+        # one environment per call, and per macro expansion
+        assert_equals(3, profiler.stats['square'].allocations)
+        assert_equals(4 + 3 + 3 + profiler.stats['if'].allocations,
+            profiler.stats['count-down'].allocations)
+
+    def test_disabled_after_profiling(self):
+        self.profile(PROGRAM)
+        assert_is(None, evaluator.profiler)
+        with profiling() as profiler:
+            Pair(1, [])
+        assert_equals(1, profiler.allocations)
+        Pair(1, [])
+        assert_equals(1, profiler.allocations)
+
+    def test_report_is_sorted(self):
+        _, profiler = self.profile(PROGRAM)
+        lines = profiler.report(sort='calls').splitlines()
+        assert_equals(['name', 'calls'], lines[0].split()[:2])
+        calls = [int(line.split()[1]) for line in lines[1:]]
+        assert_equals(sorted(calls, reverse=True), calls)
+        with assert_raises_regexp(ValueError, "Can't sort by 'foo'"):
+            profiler.report(sort='foo')
+
+    def test_tail_calls_run_in_constant_stack_space(self):
+        self.profile("(define loop (lambda (n) (if (= n 0) 'done (loop (- n 1)))))")
+        result, profiler = self.profile("(loop 10000)")
+        assert_equals("done", result)
+        assert_equals(10001, profiler.stats['loop'].calls)
+        assert_equals([], profiler.calls)
+
+    def test_tail_calls_end_the_calling_function(self):
+        self.profile("(define f (lambda (x) (g x)))")
+        self.profile("(define g (lambda (x) (* x x)))")
+        _, profiler = self.profile("(f 3)", Profiler(clock=count().next))
+        # f ends when g is entered, so the time in g is not part of f
+        assert_equals(profiler.stats['f'].inclusive, profiler.stats['f'].exclusive)
+        assert_equals(1, profiler.stats['g'].calls)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import sys
+from nose.tools import assert_equals, assert_true
+
+from moolisp.sampler import Sampler
+from moolisp.interpreter import interpret, default_env
+from moolisp.types import Builtin, boolean
+
+class TestSampler:
+
+    def setup(self):
+        self.sampler = Sampler()
+        self.env = default_env()
+
+        def probe():
+            # sample the stack of the apply_builtin frame calling us
+            self.sampler.sample(sys._getframe(1))
+            return boolean(True)
+        self.env['probe'] = Builtin(probe, 'probe')
+
+    def test_stack_of_nested_calls(self):
+        interpret("(define inner (lambda () (probe)))", self.env)
+        interpret("(define outer (lambda () (cons (inner) '())))", self.env)
+        interpret("(outer)", self.env)
+        assert_equals({('outer', 'inner', 'probe'): 1}, dict(self.sampler.samples))
+
+    def test_tail_calls_replace_frames(self):
+        interpret("""
+            (define loop
+                (lambda (n) (if (= n 0) (probe) (loop (- n 1)))))
+        """, self.env)
+        interpret("(loop 5)", self.env)
+        assert_equals({('loop', 'probe'): 1}, dict(self.sampler.samples))
+
+    def test_arguments_are_evaluated_by_the_caller(self):
+        interpret("(define f (lambda (x) x))", self.env)
+        interpret("(f (cons (probe) '()))", self.env)
+        assert_equals({('probe',): 1}, dict(self.sampler.samples))
+
+    def test_call_sites(self):
+        self.sampler.sites = True
+        interpret("((lambda (x) (probe)) 'arg)", self.env)
+        assert_equals([("<lambda/1> ((lambda (x) (probe)) 'arg)", 'probe')],
+            self.sampler.samples.keys())
+
+    def test_folded_output(self):
+        self.sampler.samples[('a', 'b')] += 2
+        self.sampler.samples[('a',)] += 1
+        assert_equals("a 1\na;b 2\n", self.sampler.folded())
+
+    def test_sampling_on_timer(self):
+        interpret("""
+            (define fib (lambda (n)
+                (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))
+        """, self.env)
+        with Sampler(rate=1000) as sampler:
+            interpret("(fib 16)", self.env)
+        assert_true(sampler.samples)
+        assert_true(any('fib' in stack for stack in sampler.samples))
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from os.path import dirname, join
+from StringIO import StringIO
+from nose.tools import assert_equals, assert_is, assert_raises
+
+from moolisp.client import Client, read_message, write_message
+from moolisp.server import Server
+from moolisp.limits import Limits
+
+MOO = join(dirname(__file__), '..', 'moo')
+
+class TestMessages:
+
+    def test_round_trip(self):
+        stream = StringIO()
+        write_message(stream, {'source': u"(λ (x) x)"})
+        write_message(stream, {'source': "2"})
+        stream.seek(0)
+        assert_equals({'source': u"(λ (x) x)"}, read_message(stream))
+        assert_equals({'source': "2"}, read_message(stream))
+        assert_is(None, read_message(stream))
+
+    def test_truncated_message(self):
+        stream = StringIO()
+        write_message(stream, {'source': "(+ 1 2)"})
+        with assert_raises(EOFError):
+            read_message(StringIO(stream.getvalue()[:-1]))
+
+class TestServer:
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = join(self.dir, 'moo.sock')
+        self.server = Server(self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+        self.thread.start()
+        self.client = Client(self.path)
+
+    def teardown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.dir)
+
+    def test_result_of_last_statement(self):
+        assert_equals({'result': "(1 2)"},
+            self.client.evaluate("(define x 1) (cons x '(2))"))
+
+    def test_requests_are_isolated(self):
+        self.client.evaluate("(define x 1)")
+        response = self.client.evaluate("x")
+        assert_equals('LispNamingError', response['error'])
+        assert_equals("Variable 'x' is undefined", response['message'])
+
+    def test_named_sessions(self):
+        self.client.evaluate("(define x 1)", session='a')
+        with Client(self.path) as other:
+            assert_equals({'result': "2"}, other.evaluate("(+ x 1)", session='a'))
+            assert_equals('LispNamingError', other.evaluate("x", session='b')['error'])
+
+    def test_moo_client_writes_utf8_to_pipes(self):
+        client = subprocess.Popen([sys.executable, MOO, '--client', self.path],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE)
+        out, err = client.communicate("(list 'λ ø)")
+        assert_equals(1, client.returncode)
+        assert_equals(("", "LispNamingError: Variable 'ø' is undefined\n"), (out, err))
+        client = subprocess.Popen([sys.executable, MOO, '--client', self.path],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        assert_equals(("(λ ø)\n", None), client.communicate("'(λ ø)"))
+
+    def test_syntax_errors(self):
+        response = self.client.evaluate("(car")
+        assert_equals('LispSyntaxError', response['error'])
+
+    def test_concurrent_clients(self):
+        results = {}
+
+        def run(n):
+            with Client(self.path) as client:
+                results[n] = client.evaluate(
+                    "(define loop (lambda (n acc)"
+                    "    (if (= n 0) acc (loop (- n 1) (+ acc 1)))))"
+                    "(loop %d 0)" % (n * 100))
+        threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_equals(dict((n, {'result': str(n * 100)}) for n in range(8)), results)
+
+class TestServerLimits(TestServer):
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = join(self.dir, 'moo.sock')
+        self.server = Server(self.path, limits=Limits(steps=100000))
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.01,))
+        self.thread.start()
+        self.client = Client(self.path)
+
+    def test_each_request_has_its_own_limits(self):
+        loop = "((lambda (f) (f f)) (lambda (f) (f f)))"
+        assert_equals('LispLimitError', self.client.evaluate(loop)['error'])
+        assert_equals({'result': "3"}, self.client.evaluate("(+ 1 2)"))
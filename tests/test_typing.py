@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from nose.tools import assert_equals, assert_true, assert_false
+import pickle
+from nose.tools import assert_equals, assert_true, assert_false, assert_is, \
+    assert_raises
 
-from moolisp.types import tag, is_type, type_of, value_of
+from moolisp.types import tag, is_type, type_of, value_of, integer, boolean, \
+    is_integer, is_boolean, TRUE, FALSE, Lambda, Pair, from_list, to_list
+from moolisp.errors import LispTypeError
 
 class TestTyping:
 
@@ -23,3 +27,50 @@ class TestTyping:
 
     def test_false(self):
         assert_false(value_of(tag('bool', False)))
+
+    def test_integers_are_native(self):
+        assert_is(int, type(integer(42)))
+        assert_true(is_integer(integer(42)))
+        assert_true(is_integer(10 ** 30))
+        assert_equals('int', type_of(integer(42)))
+        assert_equals(42, value_of(integer(42)))
+
+    def test_booleans_are_singletons(self):
+        assert_is(TRUE, boolean(True))
+        assert_is(FALSE, boolean(False))
+        assert_is(FALSE, boolean(0))
+        assert_equals('bool', type_of(boolean(True)))
+        assert_is(True, value_of(boolean(True)))
+
+    def test_python_booleans_are_not_moo_values(self):
+        assert_false(is_integer(True))
+        assert_false(is_boolean(True))
+
+    def test_unpickled_booleans_are_the_singletons(self):
+        assert_is(TRUE, pickle.loads(pickle.dumps(TRUE)))
+        assert_is(FALSE, pickle.loads(pickle.dumps(FALSE, 2)))
+
+    def test_value_of_non_type(self):
+        with assert_raises(LispTypeError):
+            value_of("foo")
+
+    def test_closures_have_no_instance_dict(self):
+        fn = Lambda(["x"], "x", None)
+        assert_false(hasattr(fn, '__dict__'))
+
+    def test_pairs_equal_lists_with_same_elements(self):
+        pairs = Pair(1, Pair(2, []))
+        assert_equals([1, 2], pairs)
+        assert_equals(pairs, [1, 2])
+        assert_true(pairs != [1, 2, 3])
+        assert_true(pairs != [1])
+        assert_true(pairs != 1)
+        assert_equals(2, len(pairs))
+
+    def test_conversion_between_lists_and_pairs(self):
+        pairs = from_list([1, ['a', []], 'b'])
+        assert_is(Pair, type(pairs))
+        assert_is(Pair, type(pairs.cdr.car))
+        assert_equals([], from_list([]))
+        assert_equals([1, ['a', []], 'b'], to_list(pairs))
+        assert_is(list, type(to_list(pairs)[1]))
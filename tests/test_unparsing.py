@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
+from itertools import count
+from StringIO import StringIO
 from nose.tools import assert_equals
 
-from moolisp.types import boolean, integer
-from moolisp.parser import unparse
+from moolisp.types import boolean, integer, Pair, from_list
+from moolisp.parser import unparse, write
 
 class TestUnparsing:
     """Suite for testing the `unparse` function, which takes an 
@@ -39,3 +41,43 @@ class TestUnparsing:
 
     def test_unparse_empty_list(self):
         assert_equals("()", unparse([]))
+
+    def test_unparse_list_starting_with_list(self):
+        assert_equals("((if car) 1)", unparse([["if", "car"], integer(1)]))
+
+    def test_unparse_pairs(self):
+        assert_equals("(a (1 b) 'c)", unparse(from_list(["a", [1, "b"], ["quote", "c"]])))
+
+    def test_unparse_deeply_nested_list(self):
+        nested = []
+        for _ in range(100000):
+            nested = Pair(nested, [])
+        assert_equals("(" * 100001 + ")" * 100001, unparse(nested))
+
+    def test_max_depth(self):
+        ast = ["a", ["b", ["c"]], ["quote", ["d", ["e"]]]]
+        assert_equals("(a (b (...)) '(d (...)))", unparse(ast, max_depth=2))
+        assert_equals("(...)", unparse(ast, max_depth=0))
+        assert_equals("a", unparse("a", max_depth=0))
+
+    def test_max_length(self):
+        ast = from_list(["a", ["b", "c", "d"], "e"])
+        assert_equals("(a (b c ...) ...)", unparse(ast, max_length=2))
+        assert_equals("(...)", unparse(ast, max_length=0))
+        assert_equals("(a (b c d) e)", unparse(ast, max_length=3))
+
+class TestWrite:
+
+    def test_write_to_stream(self):
+        out = StringIO()
+        write(from_list(range(1000)), out)
+        assert_equals(unparse(range(1000)), out.getvalue())
+
+    def test_only_elements_up_to_max_length_are_walked(self):
+        class Endless(list):
+            def __iter__(self):
+                return count()
+
+        out = StringIO()
+        write(Endless(), out, max_length=3)
+        assert_equals("(0 1 2 ...)", out.getvalue())
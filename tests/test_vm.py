@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the bytecode compiler and virtual machine in moolisp.vm.
+
+Like the analyzer, the virtual machine must behave exactly like the
+tree-walking evaluator, so the existing suites are run again with it.
+"""
+
+from nose.tools import assert_equals, assert_raises_regexp, assert_is, assert_in
+
+import test_eval
+import test_core
+import test_lisp
+import test_macros
+import test_builtins
+from tests import engine_mixin
+import test_analyzer
+from moolisp import vm
+from moolisp.vm import compile_ast, execute, run
+from moolisp.evaluator import evaluate
+from moolisp.interpreter import interpret, default_env
+from moolisp.parser import parse
+from moolisp.env import Environment
+from moolisp.errors import LispSyntaxError
+from moolisp.types import integer
+
+# Runs a test class with the virtual machine as the default engine
+VirtualMachineEngine = engine_mixin(execute)
+
+class TestVirtualMachineEval(VirtualMachineEngine, test_eval.TestEval, object):
+    pass
+
+class TestVirtualMachineCore(VirtualMachineEngine, test_core.TestDefaultEnvironment,
+        object):
+    pass
+
+class TestVirtualMachineLisp(VirtualMachineEngine, test_lisp.TestMooLisp, object):
+    pass
+
+class TestVirtualMachineMacros(VirtualMachineEngine, test_macros.TestMacros, object):
+    pass
+
+class TestVirtualMachineBuiltins(VirtualMachineEngine, test_builtins.TestBuiltins,
+        object):
+    pass
+
+class TestVirtualMachineLexicalAddressing(test_analyzer.TestLexicalAddressing):
+    engine = 'vm'
+
+class TestVirtualMachine:
+
+    def test_compiled_code_is_reusable(self):
+        env = Environment({"x": integer(1)})
+        code = compile_ast(parse("(cond ((eq x 1) 'one) (#t 'other))"))
+        assert_equals("one", run(code, env))
+        env["x"] = integer(2)
+        assert_equals("other", run(code, env))
+
+    def test_code_is_flat(self):
+        code = compile_ast(parse("(cond ((eq x 1) 'one) (#t 'other))"))
+        ops = [vm.opnames[op] for op, _ in code.instructions]
+        assert_equals(['NAME', 'CONST', 'EQ', 'TEST', 'CONST', 'RETURN',
+                       'CONST', 'TEST', 'CONST', 'RETURN', 'CONST', 'RETURN'], ops)
+
+    def test_disassembly(self):
+        code = compile_ast(parse("(f 'x)"))
+        assert_in("CHECK        (f 'x)", str(code))
+        assert_in("TAIL_CALL    1", str(code))
+
+    def test_syntax_errors_are_raised_when_run(self):
+        env = Environment()
+        execute(parse("(define f (lambda () (begin)))"), env)
+        with assert_raises_regexp(LispSyntaxError, "begin cannot be empty"):
+            execute(parse("(f)"), env)
+
+    def test_lambda_body_is_compiled_once(self):
+        env = Environment()
+        fn = execute(parse("(lambda (x) x)"), env)
+        code = fn.code
+        execute([fn, integer(1)], env)
+        assert_is(code, fn.code)
+
+    def test_calling_lambda_made_by_evaluator(self):
+        env = default_env()
+        evaluate(parse("(define inc (lambda (x) (+ x 1)))"), env)
+        assert_equals(integer(42), execute(parse("(inc 41)"), env))
+
+    def test_deep_non_tail_recursion(self):
+        """Lisp calls do not use the Python stack"""
+
+        env = default_env()
+        interpret("(define count (lambda (n) (if (= n 0) 0 (+ 1 (count (- n 1))))))",
+            env, 'vm')
+        assert_equals("20000", interpret("(count 20000)", env, 'vm'))
+
+    def test_select_engine_in_interpret(self):
+        assert_equals("120", interpret("""
+            ((lambda (fact) (fact fact 5))
+             (lambda (self n) (if (<= n 1) 1 (* n (self self (- n 1))))))
+        """, engine='vm'))